@@ -1,9 +1,17 @@
 import os
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import data.get_flow as get_flow
 import data.get_CODWR_flow as get_CODWR_flow
 import data.get_noaa as get_noaa
+import data.smap_store as smap_store
+import data.basin_features as basin_features
+import dataUtils.get_coordinates as get_coordinates
 import normalize_data
+import station_catalog
 import pandas as pd
 import logging
 import re
@@ -21,6 +29,10 @@ TODO:
 2) remove station ID one-hot encoding
  """
 
+# Concurrent requests allowed per upstream service when sites are built in parallel
+HOST_LIMITS = {'USGS': 4, 'DWR': 2, 'NOAA': 2}
+_host_semaphores = {host: threading.BoundedSemaphore(limit) for host, limit in HOST_LIMITS.items()}
+
 # This function will merge NOAA and flow data.
 def merge_dataframes(noaa_data, flow_data, station_id):
      # Check if 'Date' column is in both dataframes
@@ -61,14 +73,39 @@ def merge_dataframes(noaa_data, flow_data, station_id):
         logging.error(f"Error merging dataframes for station ID {station_id}: {e}")
         return pd.DataFrame()  # Return an empty DataFrame on error
  
+# Left-join the stored daily basin soil moisture (built by nasa_moisture --all-sites) onto a site's data
+def join_soil_moisture(site_data, huc_id, start_date, end_date):
+    if site_data.empty or huc_id is None:
+        return site_data
+    soil_moisture = smap_store.read_soil_moisture([huc_id], start_date, end_date)
+    if soil_moisture.empty:
+        logging.warning(f"No stored soil moisture for HUC {huc_id}")
+        return site_data
+    return pd.merge(site_data, soil_moisture[['Date', 'Soil Moisture']], on='Date', how='left')
+
+# Add the cached static SSURGO soil features of the site's HUC as constant columns
+def join_static_features(site_data, huc_id, static_features):
+    if site_data.empty or huc_id is None:
+        return site_data
+    features = static_features.get(str(huc_id))
+    if features is None:
+        logging.warning(f"No cached SSURGO features for HUC {huc_id}")
+        return site_data
+    for column in basin_features.STATIC_FEATURE_COLUMNS:
+        site_data[column] = features.get(column, np.nan)
+    return site_data
+
 # This function will handle fetching and processing (non-flow) data for a single site ID
-def fetch_and_process_data(prefix, site_id, start_date, end_date, flow_data):
-    coords_dict = get_coordinates(prefix, site_id)
+def fetch_and_process_data(prefix, site_id, start_date, end_date, flow_data, coords_dict):
+    if coords_dict is None:
+        logging.warning(f"No coordinates for {prefix}:{site_id}. Skipping...")
+        return pd.DataFrame()
     latitude = coords_dict['latitude']
     longitude = coords_dict['longitude']
 
     # Fetch NOAA data
-    closest_noaa_station, noaa_data = get_noaa.main(latitude, longitude, start_date, end_date)
+    with _host_semaphores['NOAA']:
+        closest_noaa_station, noaa_data = get_noaa.main(latitude, longitude, start_date, end_date)
 
     # Add the site ID to the NOAA data
     if not noaa_data.empty:
@@ -93,7 +130,7 @@ def fetch_and_process_data(prefix, site_id, start_date, end_date, flow_data):
 
     if noaa_data.empty or flow_data.empty:
         logging.warning(f"No data available for site ID {site_id}. Skipping...")
-        return None, None
+        return pd.DataFrame()
 
     # Check for and handle missing or non-numeric values in key columns
     for df in [noaa_data, flow_data]:
@@ -110,26 +147,43 @@ def get_site_ids(filename=None):
     with open(filename, 'r') as f:
         return [line.strip() for line in f]
 
+# Write the combined data as zstd Parquet, one hive partition (stationID=...) per station
+def write_partitioned_parquet(final_data, output_dir):
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)  # drop partitions of stations no longer in the build
+    typed = final_data.copy()
+    typed['Date'] = pd.to_datetime(typed['Date'])
+    for col in typed.columns:
+        if col not in ('Date', 'stationID') and pd.api.types.is_string_dtype(typed[col]):
+            # Blank cells are missing values, not text, so they should not keep a column as str
+            values = typed[col].replace('', np.nan)
+            converted = pd.to_numeric(values, errors='coerce')
+            if converted.notna().sum() == values.notna().sum():
+                typed[col] = converted
+    typed.to_parquet(output_dir, engine='pyarrow', partition_cols=['stationID'], compression='zstd', index=False)
+
 # This function will save the combined data from all site IDs.
-def save_combined_data(all_data, base_path):
-    final_data = pd.DataFrame()
-    for site_id, data in all_data.items():
-        # Ensure data alignment; might need additional checks or preprocessing here
-        final_data = pd.concat([final_data, data])
+def save_combined_data(all_data, base_path, write_csv=False):
+    # Concatenate every site once instead of growing a frame site by site
+    final_data = pd.concat(list(all_data.values()), ignore_index=True)
 
     # Preview the combined data
     ml_utils.preview_data(final_data)
 
-    # Save the combined raw data to a CSV file
-    combined_data_file_path = os.path.join(base_path, 'openFlowML', 'combined_data_all_sites.csv')
-    final_data.to_csv(combined_data_file_path, index=False)
+    # Save the combined raw data as Parquet partitioned by station (and optionally as the old CSV)
+    write_partitioned_parquet(final_data, os.path.join(base_path, 'openFlowML', 'combined_data'))
+    if write_csv:
+        final_data.to_csv(os.path.join(base_path, 'openFlowML', 'combined_data_all_sites.csv'), index=False)
 
     # Apply normalization which includes one-hot encoding within the normalization function
-    normalized_data = normalize_data.normalize_data(combined_data_file_path, final_data)
+    normalized_data = normalize_data.normalize_data(final_data)
+    if normalized_data is None:
+        return None
 
-    # Save the normalized data to a separate CSV file
-    normalized_data_path = os.path.join(base_path, 'openFlowML', 'normalized_data.csv')
-    normalized_data.to_csv(normalized_data_path, index=False)
+    # Save the normalized data
+    normalized_data.to_parquet(os.path.join(base_path, 'openFlowML', 'normalized_data.parquet'), compression='zstd', index=False)
+    if write_csv:
+        normalized_data.to_csv(os.path.join(base_path, 'openFlowML', 'normalized_data.csv'), index=False)
 
     return normalized_data
 
@@ -164,39 +218,80 @@ def get_site_ids(filename=None):
         return [line.strip() for line in f]
 
 
-def main(training_num_years = 7):
-    all_data = {}
+# Build one site's merged dataset from its resolved flow feed; returns None when there is nothing to keep
+def build_site_data(feed, site_id, start_date, end_date, coords_dict, huc_id, static_features):
+    prefix, id = feed.split(':')
+    logging.info(f"Consuming {prefix}:{id} for {site_id}")
+    if prefix == "DWR":
+        with _host_semaphores['DWR']:
+            flow_dataframe = get_CODWR_flow.main(id, start_date, end_date)
+    elif prefix == "USGS":
+        with _host_semaphores['USGS']:
+            flow_dataframe = get_flow.main(id, start_date, end_date)
+    else:
+        logging.warning(f"Unrecognized prefix for site ID {site_id}. Skipping...")
+        return None
+    noaa_dataframe = fetch_and_process_data(prefix, id, start_date, end_date, flow_dataframe, coords_dict)
+    if flow_dataframe.empty or noaa_dataframe.empty:
+        logging.warning(f"No data available for site ID {site_id}. Skipping...")
+        return None
+
+    site_data = merge_dataframes(noaa_dataframe, flow_dataframe, site_id)
+    site_data = join_soil_moisture(site_data, huc_id, start_date, end_date)
+    return join_static_features(site_data, huc_id, static_features)
+
+def main(training_num_years = 7, max_workers = 1, write_csv = False):
+    """
+    Build the combined dataset. With max_workers > 1 sites are built concurrently (network
+    requests per service are capped by HOST_LIMITS); a failing site is logged and skipped, and
+    the output keeps site_ids.txt order whatever order the sites finish in.
+    """
+    results = {}
     site_ids = get_site_ids()
     base_path = get_base_path()
     end_date = datetime.now()
     start_date = end_date - timedelta(days=training_num_years*365)
+    site_hucs = basin_features.load_site_hucs()
+    static_features = basin_features.load_static_features()
 
-    for site_id in site_ids:
-        try:
-            prefix, id = site_id.split(':')
-            logging.info(f"Consuming {prefix}:{id}")
-            if prefix == "DWR":
-                flow_dataframe = get_CODWR_flow.main(id, start_date, end_date)
-            elif prefix == "USGS":
-                flow_dataframe = get_flow.main(id, start_date, end_date)
-            else:
-                logging.warning(f"Unrecognized prefix for site ID {site_id}. Skipping...")
-                continue
-            noaa_dataframe = fetch_and_process_data(prefix,id, start_date, end_date, flow_dataframe)
-            if flow_dataframe.empty:
-                logging.warning(f"No data available for site ID {site_id}. Skipping...")
+    # One feed per physical gauge: DWR stations mirroring a requested or catalogued USGS gauge are fetched once
+    conn = station_catalog.connect()
+    try:
+        feeds = station_catalog.resolve_sites(conn, site_ids)
+    finally:
+        conn.close()
+    logging.info(f"{len(site_ids)} requested sites resolved to {len(feeds)} flow feeds")
+    coordinates = get_coordinates.resolve_coordinates(list(feeds))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(build_site_data, feed, site_id, start_date, end_date, coordinates.get(feed),
+                            site_hucs.get(site_id), static_features): site_id
+            for feed, site_id in feeds.items()
+        }
+        for future in as_completed(futures):
+            site_id = futures[future]
+            try:
+                site_data = future.result()
+            except Exception as e:
+                logging.error(f"An error occurred for site ID {site_id}: {e}")
                 continue
+            if site_data is not None:
+                results[site_id] = site_data
+                logging.info(f"Finished {site_id} ({len(results)} of {len(futures)} sites)")
 
-            all_data[site_id] = merge_dataframes(noaa_dataframe, flow_dataframe, site_id)
-        except Exception as e:
-            logging.error(f"An error occurred for site ID {site_id}: {e}")
-
+    all_data = {site_id: results[site_id] for site_id in feeds.values() if site_id in results}
     if all_data:
-        final_data = save_combined_data(all_data, base_path)
+        final_data = save_combined_data(all_data, base_path, write_csv)
         return final_data
     else:
         logging.error("No combined data for all sites")
         return None
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Combine flow, weather and basin features for every site in site_ids.txt.')
+    parser.add_argument('--years', type=int, default=7, help='Years of training data')
+    parser.add_argument('--workers', type=int, default=1, help='Sites built concurrently')
+    parser.add_argument('--csv', action='store_true', help='Also write the combined and normalized data as CSV')
+    args = parser.parse_args()
+    main(args.years, args.workers, args.csv)
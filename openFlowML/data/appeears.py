@@ -1,16 +1,22 @@
 import shutil
 import logging
-from dataUtils.get_poly import simplify_polygon, validate_polygon, get_huc_polygon
 import os
 import datetime
 import rasterio
 from rasterio.plot import show
 import numpy as np
-from rasterio.mask import mask
+from rasterio.windows import Window
+import pandas as pd
+import re
 from shapely.geometry import box
-from dataUtils.get_poly import check_polygon_intersection, get_huc_polygon, validate_polygon, simplify_polygon
-from dataUtils.data_utils import appeears_login, appeears_logout, load_vars, get_earthdata_auth, get_smap_data_bounds
+from dataUtils.get_poly import check_polygon_intersection, get_huc_polygon, validate_polygon, simplify_polygon, get_site_basins, get_site_ids
+from dataUtils.appeears_registry import task_fingerprint, register_task, mark_task_downloaded, forget_task, forget_task_id, get_registered_task, get_downloaded_bundle
+from dataUtils.downloads import download_file
+from dataUtils.zonal import get_pixel_weights, cells_window, offset_cells, zonal_stats
+from dataUtils.appeears_client import get_appeears_client
+from dataUtils.data_utils import load_vars, get_earthdata_auth, get_smap_data_bounds, get_cache_dir
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tempfile
 import argparse
 import requests
@@ -26,49 +32,22 @@ matplotlib_available = matplotlib_spec is not None
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-load_vars()
+# Task states that can still yield (or already hold) a usable bundle
+REUSABLE_TASK_STATUSES = {"queued", "pending", "processing", "done"}
+# Task states that can never yield a bundle; registry entries in these states are dropped
+UNUSABLE_TASK_STATUSES = {"expired", "deleted", "error"}
 
-def check_appeears_product(product_id, layer_name):
+# Per-process copy of the user's task list (see get_user_tasks)
+_user_tasks = None
+_user_tasks_fetched = 0.0
+
+def check_appeears_product(client, product_id, layer_name):
     """
     Check if the specified product and layer are available in AppEEARS.
+    The product catalog is fetched once per process by the shared client.
     """
-    # First, get the list of all products
-    products_url = "https://appeears.earthdatacloud.nasa.gov/api/product"
-    
     try:
-        response = requests.get(products_url, headers=None, timeout=30)
-        response.raise_for_status()
-        
-        # Print raw response for debugging
-        print("Raw API Response:")
-        print(response.text[:1000])  # Print first 1000 characters
-        
-        products = response.json()
-        
-        print(f"Type of products: {type(products)}")
-        
-        if isinstance(products, list):
-            print("Products is a list. Printing first item:")
-            print(products[0] if products else "Empty list")
-        elif isinstance(products, dict):
-            print("Products is a dictionary. Printing keys:")
-            print(products.keys())
-        else:
-            print(f"Unexpected type for products: {type(products)}")
-        
-        print("Available Soil Moisture Products:")
-        if isinstance(products, list):
-            for product in products:
-                if isinstance(product, dict) and 'ProductAndVersion' in product:
-                    # Check if the product is related to soil moisture
-                    if 'soil moisture' in product.get('Description', '').lower():
-                        print(f"- {product['ProductAndVersion']}: {product.get('Description', 'N/A')}")
-                        print(f"  Available: {product.get('Available', 'N/A')}")
-                        print(f"  Temporal Extent: {product.get('TemporalExtentStart', 'N/A')} to {product.get('TemporalExtentEnd', 'N/A')}")
-                        print(f"  Resolution: {product.get('Resolution', 'N/A')}")
-                        print(f"  Source: {product.get('Source', 'N/A')}")
-                        print("  ---")
-        
+        products = client.products()
     except requests.Timeout:
         logging.error("Request timed out while checking product availability")
         return False
@@ -79,35 +58,44 @@ def check_appeears_product(product_id, layer_name):
         logging.error(f"Unexpected error: {e}")
         return False
 
+    logging.info("Available Soil Moisture Products:")
+    if isinstance(products, list):
+        for product in products:
+            if isinstance(product, dict) and 'ProductAndVersion' in product:
+                # Check if the product is related to soil moisture
+                if 'soil moisture' in product.get('Description', '').lower():
+                    logging.info(f"- {product['ProductAndVersion']}: {product.get('Description', 'N/A')}")
+                    logging.info(f"  Available: {product.get('Available', 'N/A')}")
+                    logging.info(f"  Temporal Extent: {product.get('TemporalExtentStart', 'N/A')} to {product.get('TemporalExtentEnd', 'N/A')}")
+                    logging.info(f"  Resolution: {product.get('Resolution', 'N/A')}")
+                    logging.info(f"  Source: {product.get('Source', 'N/A')}")
+    else:
+        logging.warning(f"Unexpected type for products: {type(products)}")
+
     return True  # Return True for now, adjust based on actual product availability check
 
-def get_product_layers(token, product_id):
+def get_product_layers(client, product_id):
     """
-    Get available layers for a specific product from AppEEARS API.
+    Get available layers for a specific product from AppEEARS API (cached by the client per process).
     """
-    url = f"https://appeears.earthdatacloud.nasa.gov/api/product/{product_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        product_info = response.json()
+        product_info = client.product_layers(product_id)
         
-        logging.info(f"Available layers for {product_id}:")
+        logging.debug(f"Available layers for {product_id}:")
         for layer_name, layer_info in product_info.items():
-            logging.info(f"- {layer_name}: {layer_info.get('Description', 'No description available')}")
+            logging.debug(f"- {layer_name}: {layer_info.get('Description', 'No description available')}")
         
         return product_info
     except requests.RequestException as e:
         logging.error(f"Error getting product layers: {e}")
         return {}
 
-def submit_appears_task(token, polygon, start_date, end_date):
+def build_task_payload(client, polygon, start_date, end_date):
     """
-    Submit a task to AppEEARS API for SMAP data retrieval.
+    Build the AppEEARS area task payload for SMAP data retrieval.
     """
     product_id = "SPL3SMP_E.006"
-    layers = get_product_layers(token, product_id)
+    layers = get_product_layers(client, product_id)
     
     if not layers:
         logging.error(f"No layers found for product {product_id}")
@@ -124,13 +112,7 @@ def submit_appears_task(token, polygon, start_date, end_date):
     
     logging.info(f"Selected layer: {soil_moisture_layer}")
     
-    url = "https://appeears.earthdatacloud.nasa.gov/api/task"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
-    task_payload = {
+    return {
         "task_type": "area",
         "task_name": "SMAP_Soil_Moisture_Extraction",
         "params": {
@@ -167,20 +149,82 @@ def submit_appears_task(token, polygon, start_date, end_date):
             }
         }
     }
-    
+
+def get_user_tasks(client, max_age=60):
+    """
+    List the user's AppEEARS tasks, reusing the listing for max_age seconds.
+    """
+    global _user_tasks, _user_tasks_fetched
+    if _user_tasks is not None and time.monotonic() - _user_tasks_fetched < max_age:
+        return _user_tasks
+
+    try:
+        response = client.get("task")
+        response.raise_for_status()
+        _user_tasks = response.json()
+        _user_tasks_fetched = time.monotonic()
+        return _user_tasks
+    except requests.RequestException as e:
+        logging.error(f"Error listing AppEEARS tasks: {e}")
+        return []
+
+def find_existing_task(client, fingerprint):
+    """
+    Find a task matching the fingerprint that can be reused instead of submitting a new one:
+    first in the local registry, then in the user's AppEEARS task list.
+    """
+    entry = get_registered_task(fingerprint)
+    if entry:
+        if get_downloaded_bundle(entry["task_id"]):
+            return entry["task_id"]
+        status = check_task_status(client, entry["task_id"])
+        if status in UNUSABLE_TASK_STATUSES:
+            logging.info(f"Registered AppEEARS task {entry['task_id']} is {status}; submitting a new one")
+            forget_task(fingerprint)
+        else:
+            # Reusable, or the status could not be read right now: keep the registered task
+            return entry["task_id"]
+
+    for task in get_user_tasks(client):
+        if task.get("status") not in REUSABLE_TASK_STATUSES or "params" not in task:
+            continue
+        if task_fingerprint(task.get("task_type"), task["params"]) == fingerprint:
+            register_task(fingerprint, task["task_id"])
+            return task["task_id"]
+    return None
+
+def submit_appears_task(client, polygon, start_date, end_date, reuse=True):
+    """
+    Submit a task to AppEEARS API for SMAP data retrieval.
+    With reuse=True an existing task for the identical request is returned instead of queueing a new one.
+    """
+    task_payload = build_task_payload(client, polygon, start_date, end_date)
+    if task_payload is None:
+        return None
+
+    fingerprint = task_fingerprint(task_payload["task_type"], task_payload["params"])
+    if reuse:
+        existing_task_id = find_existing_task(client, fingerprint)
+        if existing_task_id:
+            logging.info(f"Reusing AppEEARS task {existing_task_id} for identical request {fingerprint[:12]}")
+            return existing_task_id
+
+    headers = {"Content-Type": "application/json"}
+
     try:
-        logging.info(f"Submitting task to URL: {url}")
-        logging.info(f"Headers: {headers}")
+        logging.info(f"Submitting task to URL: {client.url('task')}")
         logging.info(f"Payload: {json.dumps(task_payload, indent=2)}")
         
-        response = requests.post(url, headers=headers, data=json.dumps(task_payload), timeout=30)
+        response = client.post("task", headers=headers, data=json.dumps(task_payload))
         
         logging.info(f"Response status code: {response.status_code}")
         logging.info(f"Response headers: {response.headers}")
         logging.info(f"Response content: {response.text}")
         
         if response.status_code == 202:
-            return response.json()["task_id"]
+            task_id = response.json()["task_id"]
+            register_task(fingerprint, task_id)
+            return task_id
         else:
             logging.error(f"Failed to submit task. Status code: {response.status_code}")
             logging.error(f"Response: {response.text}")
@@ -192,76 +236,230 @@ def submit_appears_task(token, polygon, start_date, end_date):
         logging.error(f"Error submitting task: {e}")
         return None
     
-def check_task_status(token, task_id):
+def check_task_status(client, task_id):
     """
-    Check the status of an AppEEARS task.
+    Check the status of an AppEEARS task. Returns None when the status could not be read
+    (network error or non-200 reply); callers treat that as "ask again later".
     """
-    url = f"https://appeears.earthdatacloud.nasa.gov/api/task/{task_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    response = requests.get(url, headers=headers)
-    
+    try:
+        response = client.get(f"task/{task_id}")
+    except requests.RequestException as e:
+        logging.warning(f"Error checking status of task {task_id}: {e}")
+        return None
+
     if response.status_code == 200:
         return response.json()["status"]
     else:
         logging.error(f"Failed to check task status. Status code: {response.status_code}")
         return None
 
-def download_task_results(token, task_id, output_dir):
+def download_task_results(client, task_id, output_dir, max_workers=4):
     """
     Download the results of a completed AppEEARS task.
+    Files are streamed to disk in parallel, resumed after interruptions and checked against the
+    bundle's size and checksum, so files already present are skipped. Returns True if every file is in place.
     """
-    url = f"https://appeears.earthdatacloud.nasa.gov/api/bundle/{task_id}"
-    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get(f"bundle/{task_id}")
     
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        bundle_info = response.json()
-        for file_info in bundle_info["files"]:
-            file_id = file_info["file_id"]
-            file_name = file_info["file_name"]
-            download_url = f"https://appeears.earthdatacloud.nasa.gov/api/bundle/{task_id}/{file_id}"
-            
-            file_response = requests.get(download_url, headers=headers, allow_redirects=True)
-            if file_response.status_code == 200:
-                with open(f"{output_dir}/{file_name}", "wb") as f:
-                    f.write(file_response.content)
-                logging.info(f"Downloaded: {file_name}")
-            else:
-                logging.error(f"Failed to download {file_name}. Status code: {file_response.status_code}")
-    else:
+    if response.status_code != 200:
         logging.error(f"Failed to get bundle info. Status code: {response.status_code}")
+        return False
+
+    bundle_info = response.json()
+
+    def fetch(file_info):
+        download_url = client.url(f"bundle/{task_id}/{file_info['file_id']}")
+        return download_file(download_url, os.path.join(output_dir, file_info["file_name"]), session=client.session,
+                             headers=client.auth_headers(), expected_size=file_info.get("file_size"), sha256=file_info.get("sha256"))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        completed = list(executor.map(fetch, bundle_info["files"]))
+
+    failed = [f["file_name"] for f, ok in zip(bundle_info["files"], completed) if not ok]
+    if failed:
+        logging.error(f"Failed to download {len(failed)} of {len(completed)} files for task {task_id}: {failed}")
+        return False
+
+    mark_task_downloaded(task_id, output_dir)
+    return True
+
+def split_date_range(start_date, end_date, chunk_days):
+    """
+    Split a date range into consecutive (start, end) chunks of at most chunk_days days.
+    """
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+    return chunks
+
+def run_appeears_tasks(client, site_polygons, start_date, end_date, output_root, chunk_days=365,
+                       max_downloads=4, initial_poll=30, max_poll=300, max_wait=6 * 3600, poll_workers=4):
+    """
+    Submit AppEEARS area tasks for every site ({name: polygon}) and date chunk up front, then poll
+    them all with per-task exponential backoff and download each bundle as soon as it is done.
+    Identical requests reuse earlier tasks, and bundles already on disk are not downloaded again.
+    Returns {(name, chunk_start, chunk_end): output_dir or None}.
+    """
+    results = {}
+    tasks = []
+    for name, polygon in site_polygons.items():
+        for chunk_start, chunk_end in split_date_range(start_date, end_date, chunk_days):
+            key = (name, chunk_start, chunk_end)
+            task_id = submit_appears_task(client, polygon, chunk_start, chunk_end)
+            if not task_id:
+                logging.error(f"Failed to submit AppEEARS task for {name} {chunk_start} - {chunk_end}")
+                continue
+            existing_bundle = get_downloaded_bundle(task_id)
+            if existing_bundle:
+                logging.info(f"Results of task {task_id} for {key} already downloaded to {existing_bundle}")
+                results[key] = existing_bundle
+                continue
+            output_dir = os.path.join(output_root, str(name), f"{chunk_start:%Y%m%d}_{chunk_end:%Y%m%d}")
+            tasks.append({"key": key, "task_id": task_id, "output_dir": output_dir,
+                          "interval": initial_poll, "next_poll": time.monotonic() + initial_poll})
+    logging.info(f"Waiting on {len(tasks)} AppEEARS tasks")
+
+    downloads = {}
+    deadline = time.monotonic() + max_wait
+    # Polls run on their own small pool so they never queue behind bundle downloads
+    with ThreadPoolExecutor(max_workers=max_downloads) as executor, \
+            ThreadPoolExecutor(max_workers=poll_workers) as poll_executor:
+        pending = list(tasks)
+        while pending and time.monotonic() < deadline:
+            now = time.monotonic()
+            due = [task for task in pending if task["next_poll"] <= now]
+            if not due:
+                time.sleep(max(min(task["next_poll"] for task in pending) - now, 0))
+                continue
+
+            statuses = poll_executor.map(lambda task: check_task_status(client, task["task_id"]), due)
+            for task, status in zip(due, statuses):
+                if status == "done":
+                    logging.info(f"Task {task['task_id']} for {task['key']} is done, downloading")
+                    os.makedirs(task["output_dir"], exist_ok=True)
+                    downloads[executor.submit(download_task_results, client, task["task_id"], task["output_dir"])] = task
+                    pending.remove(task)
+                elif status in UNUSABLE_TASK_STATUSES:
+                    logging.error(f"Task {task['task_id']} for {task['key']} is {status}; it will be resubmitted next run")
+                    forget_task_id(task["task_id"])
+                    results[task["key"]] = None
+                    pending.remove(task)
+                else:
+                    if status is None:
+                        logging.warning(f"Could not read the status of task {task['task_id']}; retrying in {task['interval']:.0f} seconds")
+                    # Back off: long-queued tasks are polled less and less often
+                    task["next_poll"] = now + task["interval"]
+                    task["interval"] = min(task["interval"] * 1.5, max_poll)
+
+        for task in pending:
+            logging.error(f"Task {task['task_id']} for {task['key']} did not complete within {max_wait} seconds")
+            results[task["key"]] = None
+
+        for future in as_completed(downloads):
+            task = downloads[future]
+            try:
+                results[task["key"]] = task["output_dir"] if future.result() else None
+            except Exception as e:
+                logging.error(f"Failed to download results of task {task['task_id']}: {e}")
+                results[task["key"]] = None
+
+    return results
+
+def geotiff_date(geotiff_path):
+    """
+    Observation date of an AppEEARS GeoTIFF, from the "doyYYYYDDD" part of its file name.
+    """
+    match = re.search(r"doy(\d{4})(\d{3})", os.path.basename(geotiff_path))
+    if not match:
+        return None
+    year, day_of_year = int(match.group(1)), int(match.group(2))
+    return datetime.date(year, 1, 1) + datetime.timedelta(days=day_of_year - 1)
+
+def get_polygon_cells(src, polygon, cells_cache=None):
+    """
+    Fractional pixel weights of the polygon on the raster's grid, plus the window that holds them.
+    Rasters of one bundle share a grid, so the result is kept per (transform, shape, CRS) in
+    cells_cache and on disk by the zonal engine.
+    """
+    key = (src.transform.to_gdal(), src.shape, str(src.crs))
+    if cells_cache is not None and key in cells_cache:
+        return cells_cache[key]
+
+    cells = get_pixel_weights(polygon, src.transform, src.shape, src.crs)
+    if len(cells[0]) == 0:
+        raise ValueError(f"Polygon does not overlap {src.name}")
+    row_off, col_off, height, width = cells_window(cells)
+    window = Window(col_off, row_off, width, height)
+    result = (window, offset_cells(cells, row_off, col_off))
+    if cells_cache is not None:
+        cells_cache[key] = result
+    return result
+
+def zonal_stats_geotiff(geotiff_path, polygon, cells_cache=None):
+    """
+    Area-weighted mean, min, max and valid-pixel count of the first band within the polygon,
+    reading only the window around the polygon.
+    """
+    with rasterio.open(geotiff_path) as src:
+        window, cells = get_polygon_cells(src, polygon, cells_cache)
+        data = src.read(1, window=window)
+        return zonal_stats(data, cells, fill_value=src.nodata)
 
 def extract_soil_moisture_from_geotiff(geotiff_path, polygon):
     """
     Extract soil moisture data for the given polygon from the GeoTIFF file using rasterio.
     """
     try:
-        with rasterio.open(geotiff_path) as src:
-            # Create a GeoJSON-like geometry object
-            geom = {"type": "Polygon", "coordinates": [polygon]}
-            
-            # Mask the raster with the polygon
-            out_image, out_transform = mask(src, [geom], crop=True)
-            
-            # Get the data from the masked raster
-            data = out_image[0]  # Assuming it's a single-band raster
-            
-            # Calculate average soil moisture
-            valid_data = data[data != src.nodata]
-            if len(valid_data) > 0:
-                average_moisture = np.mean(valid_data)
-                return average_moisture
-            else:
-                logging.warning("No valid data found within the polygon")
-                return None
+        stats = zonal_stats_geotiff(geotiff_path, polygon)
+        if stats["count"] > 0:
+            return stats["mean"]
+        else:
+            logging.warning("No valid data found within the polygon")
+            return None
         
     except Exception as e:
         logging.error(f"Error extracting soil moisture data: {e}")
         logging.error("Traceback: ", exc_info=True)
         return None
 
+def extract_soil_moisture_series(output_dir, polygon, max_workers=4):
+    """
+    Dated series of mean, min, max and valid count over every GeoTIFF in a downloaded bundle.
+    The polygon weights are computed once per grid and files are read in a worker pool.
+    """
+    geotiff_paths = sorted(os.path.join(root, f) for root, _, files in os.walk(output_dir)
+                           for f in files if f.endswith('.tif'))
+    geotiff_paths = [path for path in geotiff_paths if geotiff_date(path) is not None]
+    if not geotiff_paths:
+        logging.error(f"No dated GeoTIFF files found in {output_dir}")
+        return pd.DataFrame(columns=['Date', 'mean', 'min', 'max', 'count'])
+
+    cells_cache = {}
+    # Compute the pixel weights once up front so the workers only ever read them
+    try:
+        with rasterio.open(geotiff_paths[0]) as src:
+            get_polygon_cells(src, polygon, cells_cache)
+    except Exception as e:
+        logging.error(f"Error computing the polygon weights for {output_dir}: {e}")
+        return pd.DataFrame(columns=['Date', 'mean', 'min', 'max', 'count'])
+
+    def process(path):
+        try:
+            return {"Date": geotiff_date(path), **zonal_stats_geotiff(path, polygon, cells_cache)}
+        except Exception as e:
+            logging.error(f"Error extracting soil moisture from {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = [row for row in executor.map(process, geotiff_paths) if row is not None]
+
+    series = pd.DataFrame(rows, columns=['Date', 'mean', 'min', 'max', 'count'])
+    logging.info(f"Extracted {len(series)} dated values from {len(geotiff_paths)} GeoTIFF files")
+    return series.sort_values('Date').reset_index(drop=True)
+
 def visualize_smap_data(geotiff_path, polygon, average_moisture):
     """
     Create a detailed visualization of SMAP data with the polygon overlay.
@@ -304,11 +502,9 @@ def visualize_smap_data(geotiff_path, polygon, average_moisture):
         logging.error("Traceback: ", exc_info=True)
 
 # Add a function to verify the token:
-def verify_token(token):
-    url = "https://appeears.earthdatacloud.nasa.gov/api/user"
-    headers = {"Authorization": f"Bearer {token}"}
+def verify_token(client):
     try:
-        response = requests.get(url, headers=headers)
+        response = client.get("user")
         if response.status_code == 200:
             logging.info("Token verified successfully")
             return True
@@ -320,26 +516,51 @@ def verify_token(token):
         logging.error(f"Error verifying token: {e}")
         return False
 
+def main_all_sites(start_date, end_date, site_ids_file=None, chunk_days=365, output_root=None):
+    """
+    Submit AppEEARS tasks for every basin in site_ids.txt at once and download each bundle as it finishes.
+    Bundles are kept under output_root (the shared AppEEARS cache directory by default).
+    """
+    load_vars()
+    client = get_appeears_client()
+    if not client.token:
+        logging.error("Failed to login to AppEEARS. Please check your credentials.")
+        return None
+
+    try:
+        basin_polygons, site_hucs = get_site_basins(get_site_ids(site_ids_file))
+        basin_polygons = {huc_id: validate_polygon(polygon) for huc_id, polygon in basin_polygons.items()}
+        logging.info(f"Resolved {len(site_hucs)} sites to {len(basin_polygons)} HUC8 basins")
+        output_root = output_root or get_cache_dir("appeears")
+        results = run_appeears_tasks(client, basin_polygons, start_date, end_date, output_root, chunk_days=chunk_days)
+        finished = sum(1 for output_dir in results.values() if output_dir)
+        logging.info(f"{finished} of {len(results)} AppEEARS tasks downloaded to {output_root}")
+        return results
+    finally:
+        client.logout()
+
 def main(start_date, end_date, lat, lon, visual):
+    load_vars()
+
     # Login to AppEEARS
-    token = appeears_login()
-    if not token:
+    client = get_appeears_client()
+    if not client.token:
         logging.error("Failed to login to AppEEARS. Please check your credentials.")
         return
 
     # Check if the product and layer are available
     product_id = "SPL3SMP_E.003"
     layer_name = "soil_moisture"
-    if not check_appeears_product(product_id, layer_name):
+    if not check_appeears_product(client, product_id, layer_name):
         logging.error("Required product or layer is not available. Exiting.")
-        appeears_logout()
+        client.logout()
         return
 
     # Get the HUC8 polygon
-    huc8_polygon = get_huc_polygon(lat, lon, 8)
+    huc8_polygon, huc_id, _ = get_huc_polygon(lat, lon, 8)
     if not huc8_polygon:
         logging.error("Failed to retrieve HUC8 polygon")
-        appeears_logout()
+        client.logout()
         return
 
     # Simplify & validate the polygon
@@ -347,69 +568,54 @@ def main(start_date, end_date, lat, lon, visual):
     simplified_polygon = validate_polygon(simplified_polygon)
     logging.debug(f"Validated polygon coordinates: {simplified_polygon}")
 
-    # Submit AppEEARS task
-    task_id = submit_appears_task(token, simplified_polygon, start_date, end_date)
-    if not task_id:
-        logging.error("Failed to submit AppEEARS task")
-        appeears_logout()
+    # Submit the AppEEARS task, wait for it and download the results
+    output_root = tempfile.mkdtemp()
+    whole_range = (end_date - start_date).days + 1
+    results = run_appeears_tasks(client, {huc_id: simplified_polygon}, start_date, end_date, output_root, chunk_days=whole_range)
+    output_dir = results.get((huc_id, start_date, end_date))
+    if not output_dir:
+        logging.error("AppEEARS task did not produce any results")
+        shutil.rmtree(output_root)
+        client.logout()
         return
 
-    # Wait for task to complete
-    max_retries = 30  # 30 minutes maximum wait time
-    retries = 0
-    while retries < max_retries:
-        status = check_task_status(token, task_id)
-        if status == "done":
-            logging.info("Task completed successfully")
-            break
-        elif status == "error":
-            logging.error("Task failed")
-            appeears_logout()
-            return
-        elif status is None:
-            logging.error("Failed to check task status")
-            appeears_logout()
-            return
-        time.sleep(60)  # Wait for 60 seconds before checking again
-        retries += 1
-    else:
-        logging.error("Task did not complete within the maximum wait time")
-        appeears_logout()
-        return
-    
-    # Download results
-    output_dir = tempfile.mkdtemp()
-    download_task_results(token, task_id, output_dir)
-
     # Process and visualize results
-    geotiff_file = next((f for f in os.listdir(output_dir) if f.endswith('.tif')), None)
-    if geotiff_file:
-        geotiff_path = os.path.join(output_dir, geotiff_file)
-        average_soil_moisture = extract_soil_moisture_from_geotiff(geotiff_path, simplified_polygon)
-        
-        if average_soil_moisture is not None:
-            logging.info(f"Average soil moisture: {average_soil_moisture:.4f}")
-            
-            if visual:
-                visualize_smap_data(geotiff_path, simplified_polygon, average_soil_moisture)
-        else:
-            logging.error("Failed to calculate average soil moisture")
-    else:
+    series = extract_soil_moisture_series(output_dir, simplified_polygon)
+    valid_series = series[series['count'] > 0]
+    if not valid_series.empty:
+        average_soil_moisture = valid_series['mean'].mean()
+        logging.info(f"Soil moisture series ({len(valid_series)} of {len(series)} days with data):\n{series}")
+        logging.info(f"Average soil moisture: {average_soil_moisture:.4f}")
+
+        if visual:
+            geotiff_path = next(os.path.join(root, f) for root, _, files in os.walk(output_dir)
+                                for f in sorted(files) if f.endswith('.tif') and geotiff_date(f) == valid_series['Date'].iloc[0])
+            visualize_smap_data(geotiff_path, simplified_polygon, average_soil_moisture)
+    elif series.empty:
         logging.error("No GeoTIFF file found in the downloaded results")
+    else:
+        logging.error("Failed to calculate average soil moisture")
 
     # Clean up
-    shutil.rmtree(output_dir)
+    shutil.rmtree(output_root)
     
     # Logout from AppEEARS
-    appeears_logout()
+    client.logout()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Calculate average soil moisture for a HUC8 polygon from SMAP L3 data.')
     parser.add_argument('--start-date', type=lambda d: datetime.datetime.strptime(d, '%Y-%m-%d').date(), required=True, help='Start Date in YYYY-MM-DD format')
     parser.add_argument('--end-date', type=lambda d: datetime.datetime.strptime(d, '%Y-%m-%d').date(), required=True, help='End Date in YYYY-MM-DD format')
-    parser.add_argument('--lat', type=float, required=True, help='Latitude of the point within the desired HUC8 polygon')
-    parser.add_argument('--lon', type=float, required=True, help='Longitude of the point within the desired HUC8 polygon')
+    parser.add_argument('--lat', type=float, help='Latitude of the point within the desired HUC8 polygon')
+    parser.add_argument('--lon', type=float, help='Longitude of the point within the desired HUC8 polygon')
     parser.add_argument('--visual', action='store_true', help='Enable matplotlib visualization')
+    parser.add_argument('--all-sites', action='store_true', help='Run tasks for every basin in site_ids.txt concurrently (ignores --lat/--lon)')
+    parser.add_argument('--chunk-days', type=int, default=365, help='Days per AppEEARS task when running --all-sites')
     args = parser.parse_args()
 
-    main(args.start_date, args.end_date, args.lat, args.lon, args.visual)
\ No newline at end of file
+    if args.all_sites:
+        main_all_sites(args.start_date, args.end_date, chunk_days=args.chunk_days)
+    elif args.lat is None or args.lon is None:
+        parser.error("--lat and --lon are required unless --all-sites is given")
+    else:
+        main(args.start_date, args.end_date, args.lat, args.lon, args.visual)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+from dataUtils.cache import get_cache_dir
+
+'''
+Cached per-basin metadata that combine_data joins without touching the network.
+
+Two small JSON files live in the static_features cache: the HUC each site belongs to (written by
+any --all-sites pipeline that resolves the site basins) and the area-weighted SSURGO features of
+each HUC (written by get_ssurgo). Readers only need this module, not the pipelines and their
+geospatial dependencies.
+'''
+
+CACHE_NAME = "static_features"
+FEATURES_FILE = "ssurgo.json"
+SITE_HUCS_FILE = "site_hucs.json"
+STATIC_FEATURE_COLUMNS = [
+    "AWS 0-100cm (cm)",
+    "Depth to Restrictive Layer (cm)",
+    "Depth to Bedrock (cm)",
+    "HSG A", "HSG B", "HSG C", "HSG D",
+]
+_lock = threading.Lock()
+
+def _path(filename, cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(CACHE_NAME), filename)
+
+def _load(filename, cache_dir=None):
+    path = _path(filename, cache_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _update(filename, entries, cache_dir=None):
+    with _lock:
+        cached = _load(filename, cache_dir)
+        cached.update(entries)
+        path = _path(filename, cache_dir)
+        with open(path + ".tmp", "w") as f:
+            json.dump(cached, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+def load_static_features(cache_dir=None):
+    """
+    {huc_id: {feature: value}} for every HUC computed so far.
+    """
+    return _load(FEATURES_FILE, cache_dir)
+
+def save_static_features(huc_id, features, cache_dir=None):
+    _update(FEATURES_FILE, {str(huc_id): features}, cache_dir)
+
+def load_site_hucs(cache_dir=None):
+    """
+    {site_id: huc_id} for every site whose basin has been resolved.
+    """
+    return _load(SITE_HUCS_FILE, cache_dir)
+
+def save_site_hucs(site_hucs, cache_dir=None):
+    """
+    Remember which HUC each site belongs to, so readers can look sites up without the network.
+    """
+    _update(SITE_HUCS_FILE, {site_id: str(huc_id) for site_id, huc_id in site_hucs.items()}, cache_dir)
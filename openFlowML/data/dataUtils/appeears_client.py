@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import requests
+from requests.adapters import HTTPAdapter
+
+'''
+Shared AppEEARS API client.
+
+One pooled HTTP session and one bearer token per process: the token is kept until shortly
+before its expiration and refreshed just in time, and the product catalog and per-product
+layer listings are fetched once and reused for the life of the process.
+'''
+
+logger = logging.getLogger(__name__)
+
+APPEEARS_API = "https://appeears.earthdatacloud.nasa.gov/api"
+# Refresh the token this long before AppEEARS says it expires
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+def parse_expiration(expiration_str):
+    """
+    Parse AppEEARS' token expiration (e.g. 2024-07-30T18:04:12Z) as an aware UTC datetime.
+    """
+    # Remove the 'Z' at the end and split the string
+    date_part, time_part = expiration_str[:-1].split('T')
+    year, month, day = map(int, date_part.split('-'))
+    hour, minute, second = map(int, time_part.split('.')[0].split(':'))
+    return datetime(year, month, day, hour, minute, second, tzinfo=timezone.utc)
+
+class AppEEARSClient:
+    """
+    Pooled session, just-in-time token refresh and cached product metadata for AppEEARS.
+    """
+
+    def __init__(self, username=None, password=None, pool_size=16):
+        self.username = username or os.getenv("EARTHDATA_USERNAME")
+        self.password = password or os.getenv("EARTHDATA_PASSWORD")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self._token = None
+        self._expiration = None
+        self._products = None
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        return f"{APPEEARS_API}/{path.lstrip('/')}"
+
+    def login(self):
+        """
+        Log in and store a fresh token. Returns the token, or None if the login failed.
+        """
+        if not self.username or not self.password:
+            raise ValueError("EARTHDATA_USERNAME and EARTHDATA_PASSWORD environment variables must be set.")
+        try:
+            response = self.session.post(self.url("login"), auth=(self.username, self.password), timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            self._token = data['token']
+            self._expiration = parse_expiration(data['expiration'])
+            logger.info(f"Logged in to AppEEARS, token valid until {self._expiration}")
+            return self._token
+        except requests.RequestException as e:
+            logger.error(f"AppEEARS login failed: {e}")
+            return None
+
+    @property
+    def token(self):
+        """
+        Current bearer token, logging in again only when it is missing or about to expire.
+        """
+        with self._lock:
+            if self._token is None or datetime.now(timezone.utc) >= self._expiration - TOKEN_REFRESH_MARGIN:
+                self.login()
+            return self._token
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def get(self, path, auth=True, **kwargs):
+        kwargs.setdefault("timeout", 30)
+        headers = {**(self.auth_headers() if auth else {}), **kwargs.pop("headers", {})}
+        return self.session.get(self.url(path), headers=headers, **kwargs)
+
+    def post(self, path, auth=True, **kwargs):
+        kwargs.setdefault("timeout", 30)
+        headers = {**(self.auth_headers() if auth else {}), **kwargs.pop("headers", {})}
+        return self.session.post(self.url(path), headers=headers, **kwargs)
+
+    def products(self):
+        """
+        The AppEEARS product catalog, fetched once per process.
+        """
+        if self._products is None:
+            response = self.get("product", auth=False)
+            response.raise_for_status()
+            self._products = response.json()
+        return self._products
+
+    def product_layers(self, product_id):
+        """
+        Layer metadata for a product, fetched once per product per process.
+        """
+        if product_id not in self._layers:
+            response = self.get(f"product/{product_id}")
+            response.raise_for_status()
+            self._layers[product_id] = response.json()
+        return self._layers[product_id]
+
+    def logout(self):
+        """
+        Invalidate the current token, if any.
+        """
+        with self._lock:
+            if not self._token:
+                return True
+            try:
+                response = self.session.post(self.url("logout"), headers={"Authorization": f"Bearer {self._token}"}, timeout=30)
+                if response.status_code != 204:
+                    logger.error(f"Logout failed: {response.text}")
+                    return False
+            except requests.RequestException as e:
+                logger.error(f"Logout failed: {e}")
+                return False
+            self._token = None
+            self._expiration = None
+            return True
+
+_client = None
+
+def get_appeears_client():
+    """
+    Process-wide AppEEARS client, so every site in a run shares one login and one catalog fetch.
+    """
+    global _client
+    if _client is None:
+        _client = AppEEARSClient()
+    return _client
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from dataUtils.data_utils import get_cache_dir
+
+'''
+Fingerprints and a local registry of AppEEARS tasks.
+
+Two task payloads with the same product, layers, dates, output options and polygon ask AppEEARS
+for the same bundle. The fingerprint captures exactly those fields (not the task name), so an
+identical request can reuse an earlier task, or its already downloaded bundle, instead of
+waiting in the queue again.
+'''
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = "task_registry.json"
+_lock = threading.Lock()
+
+def _normalize_date(value):
+    # AppEEARS accepts and echoes MM-DD-YYYY; tolerate ISO dates as well
+    for fmt in ("%m-%d-%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(str(value)[:10], fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return str(value)
+
+def _round_coords(coords, ndigits=6):
+    if isinstance(coords, (list, tuple)):
+        return [_round_coords(c, ndigits) for c in coords]
+    return round(float(coords), ndigits)
+
+def task_fingerprint(task_type, params):
+    """
+    Stable hash of the parts of an AppEEARS task request that determine its output.
+    """
+    canonical = {
+        "task_type": task_type,
+        "dates": sorted((_normalize_date(d.get("startDate")), _normalize_date(d.get("endDate")))
+                        for d in params.get("dates", [])),
+        "layers": sorted((layer.get("product"), layer.get("layer")) for layer in params.get("layers", [])),
+        "output": {
+            "format": (params.get("output", {}).get("format") or {}).get("type"),
+            "projection": params.get("output", {}).get("projection"),
+        },
+        "geometry": [_round_coords(f.get("geometry", {}).get("coordinates", []))
+                     for f in params.get("geo", {}).get("features", [])],
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _registry_path(cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir("appeears"), REGISTRY_FILE)
+
+def load_registry(cache_dir=None):
+    path = _registry_path(cache_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_registry(registry, cache_dir=None):
+    path = _registry_path(cache_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def register_task(fingerprint, task_id, cache_dir=None):
+    """
+    Record the task submitted for a fingerprint.
+    """
+    with _lock:
+        registry = load_registry(cache_dir)
+        registry[fingerprint] = {"task_id": task_id, "output_dir": None}
+        _save_registry(registry, cache_dir)
+
+def mark_task_downloaded(task_id, output_dir, cache_dir=None):
+    """
+    Record where a task's bundle was downloaded.
+    """
+    with _lock:
+        registry = load_registry(cache_dir)
+        for entry in registry.values():
+            if entry["task_id"] == task_id:
+                entry["output_dir"] = output_dir
+        _save_registry(registry, cache_dir)
+
+def forget_task(fingerprint, cache_dir=None):
+    with _lock:
+        registry = load_registry(cache_dir)
+        if registry.pop(fingerprint, None) is not None:
+            _save_registry(registry, cache_dir)
+
+def forget_task_id(task_id, cache_dir=None):
+    """
+    Drop every registry entry pointing at a task, so the next run submits the request again.
+    """
+    with _lock:
+        registry = load_registry(cache_dir)
+        kept = {fingerprint: entry for fingerprint, entry in registry.items() if entry["task_id"] != task_id}
+        if len(kept) != len(registry):
+            _save_registry(kept, cache_dir)
+
+def get_registered_task(fingerprint, cache_dir=None):
+    """
+    Registry entry ({task_id, output_dir}) for a fingerprint, or None.
+    """
+    return load_registry(cache_dir).get(fingerprint)
+
+def get_downloaded_bundle(task_id, cache_dir=None):
+    """
+    Local directory holding a task's downloaded bundle, if it still exists and is not empty.
+    """
+    for entry in load_registry(cache_dir).values():
+        output_dir = entry.get("output_dir")
+        if entry["task_id"] == task_id and output_dir and os.path.isdir(output_dir) and os.listdir(output_dir):
+            return output_dir
+    return None
@@ -0,0 +1,17 @@
+import os
+
+'''
+Location of the persistent caches shared across runs.
+
+Kept free of other imports so both the data package and the top-level station scripts can use it.
+'''
+
+def get_cache_dir(name):
+    """
+    Return (creating it if needed) a persistent cache directory that is shared across runs.
+    The root defaults to ~/.cache/openflow and can be overridden with OPENFLOW_CACHE_DIR.
+    """
+    root = os.getenv("OPENFLOW_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "openflow")
+    cache_dir = os.path.join(root, name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+import earthaccess
+from earthaccess.results import DataGranule
+from dataUtils.data_utils import get_cache_dir
+
+'''
+On-disk cache of CMR searches made through earthaccess.
+
+Collection concept ids never change, and the granule list for a month is final once the month
+(plus a short processing lag) is over. Listings are cached per collection, bounding box and
+month: closed months are read from disk forever and only still-open months are searched again.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Days after a month ends before its granule list is considered final
+CLOSE_LAG_DAYS = 7
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+def month_ranges(start_date, end_date):
+    """
+    Yield (month_start, month_end) for every calendar month touched by the date range.
+    """
+    current = _as_date(start_date).replace(day=1)
+    end_date = _as_date(end_date)
+    while current <= end_date:
+        next_month = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        yield current, next_month - timedelta(days=1)
+        current = next_month
+
+def is_month_closed(month_end, today=None):
+    today = today or date.today()
+    return today > month_end + timedelta(days=CLOSE_LAG_DAYS)
+
+def get_collection_concept_id(short_name, version, cache_dir=None):
+    """
+    Look up (once) and cache the concept id of a CMR collection.
+    """
+    path = os.path.join(cache_dir or get_cache_dir("cmr"), "collections.json")
+    collections = _read_json(path) or {}
+    key = f"{short_name}.{version}"
+    if key in collections:
+        return collections[key]
+
+    results = earthaccess.DataCollections().short_name(short_name).version(version).get()
+    if not results:
+        return None
+    collections[key] = results[0].concept_id()
+    _write_json(path, collections)
+    logger.info(f"Cached concept id for {key}: {collections[key]}")
+    return collections[key]
+
+def _granule_date(granule):
+    try:
+        begin = granule["umm"]["TemporalExtent"]["RangeDateTime"]["BeginningDateTime"]
+        return _as_date(begin)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _search_month(concept_id, bbox, month_start, month_end):
+    query = (earthaccess.DataGranules()
+             .concept_id(concept_id)
+             .temporal(month_start.isoformat(), month_end.isoformat())
+             .bounding_box(*bbox))
+    if query.hits() == 0:
+        return []
+    return query.get_all()
+
+def search_granules(concept_id, start_date, end_date, bbox, cache_dir=None, today=None):
+    """
+    Granules of a collection intersecting bbox (min_lon, min_lat, max_lon, max_lat) between two dates.
+    The search is done month by month so each month's listing can be cached independently.
+    """
+    cache_dir = cache_dir or get_cache_dir("cmr")
+    bbox = tuple(round(float(v), 4) for v in bbox)
+    bbox_key = "_".join(f"{v:.4f}" for v in bbox)
+    start, end = _as_date(start_date), _as_date(end_date)
+
+    granules = []
+    searched = 0
+    for month_start, month_end in month_ranges(start, end):
+        path = os.path.join(cache_dir, f"{concept_id}_{bbox_key}_{month_start:%Y-%m}.json")
+        cached = _read_json(path)
+        if cached is None or not cached.get("closed"):
+            month_granules = _search_month(concept_id, bbox, month_start, month_end)
+            searched += 1
+            cached = {
+                "closed": is_month_closed(month_end, today),
+                "granules": [dict(g) for g in month_granules],
+                "cloud_hosted": [getattr(g, "cloud_hosted", False) for g in month_granules],
+            }
+            _write_json(path, cached)
+        for item, cloud_hosted in zip(cached["granules"], cached["cloud_hosted"]):
+            granule = DataGranule(item, cloud_hosted=cloud_hosted)
+            granule_date = _granule_date(granule)
+            if granule_date is None or start <= granule_date <= end:
+                granules.append(granule)
+
+    logger.info(f"Found {len(granules)} granules ({searched} CMR month searches, the rest from cache)")
+    return granules
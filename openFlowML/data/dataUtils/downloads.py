@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import os
+import time
+import requests
+
+'''
+Streaming, resumable file downloads.
+
+Data are streamed to a ".part" file next to the destination in fixed-size chunks. After an
+interruption the transfer continues from the bytes already on disk with an HTTP Range request,
+and the finished file is checked against the expected size and/or SHA-256 before being moved
+into place. Files that are already complete are never downloaded again.
+'''
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MAX_RETRIES = 3
+RETRY_DELAY = 5  # seconds
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_complete(path, expected_size=None, sha256=None):
+    """
+    Whether a file already matches the expected size (cheap) or, if no size is known, the checksum.
+    """
+    if not os.path.exists(path):
+        return False
+    if expected_size is not None:
+        return os.path.getsize(path) == int(expected_size)
+    if sha256:
+        return sha256_of(path) == sha256.lower()
+    return False
+
+def _verify(path, expected_size, sha256):
+    if expected_size is not None and os.path.getsize(path) != int(expected_size):
+        return False
+    if sha256 and sha256_of(path) != sha256.lower():
+        return False
+    return True
+
+def download_file(url, dest_path, session=None, headers=None, expected_size=None, sha256=None,
+                  chunk_size=CHUNK_SIZE, timeout=60, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY):
+    """
+    Stream url to dest_path, resuming partial downloads with Range requests.
+    Returns True when dest_path holds a verified copy of the file.
+    """
+    if is_complete(dest_path, expected_size, sha256):
+        logger.info(f"Already downloaded: {dest_path}")
+        return True
+
+    session = session or requests.Session()
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    part_path = dest_path + ".part"
+
+    for attempt in range(max_retries):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected_size is not None and offset >= int(expected_size):
+            break
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+        try:
+            with session.get(url, headers=request_headers, stream=True, timeout=timeout, allow_redirects=True) as response:
+                if response.status_code == 416:
+                    # Nothing left to send: the partial file already holds everything
+                    break
+                response.raise_for_status()
+                # A server that ignores Range answers 200 with the whole file, so start over
+                mode = "ab" if offset and response.status_code == 206 else "wb"
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+            # A body that ends early is an interrupted transfer: keep the bytes and resume them
+            size = os.path.getsize(part_path)
+            if expected_size is None or size >= int(expected_size):
+                break
+            logger.warning(f"Download attempt {attempt + 1} for {os.path.basename(dest_path)} stopped after {size} of {expected_size} bytes")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Download attempt {attempt + 1} for {os.path.basename(dest_path)} failed: {e}")
+        if attempt < max_retries - 1:
+            time.sleep(retry_delay)
+    else:
+        logger.error(f"Giving up on {url} after {max_retries} attempts")
+        return False
+
+    if not os.path.exists(part_path) or not _verify(part_path, expected_size, sha256):
+        logger.error(f"Downloaded file failed verification, discarding: {dest_path}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return False
+
+    os.replace(part_path, dest_path)
+    logger.info(f"Downloaded: {dest_path}")
+    return True
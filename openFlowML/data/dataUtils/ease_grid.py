@@ -0,0 +1,43 @@
+import logging
+from dataUtils.data_utils import get_cache_dir
+from dataUtils.zonal import compute_pixel_weights, get_pixel_weights
+
+'''
+Polygon -> EASE-Grid 2.0 cell weights for SMAP L3 zonal means.
+
+The SPL3SMP_E product is delivered on the global 9 km EASE-2 grid (EPSG:6933), so the cells
+that cover a basin never change between granules. Compute them once per HUC, keep them on
+disk, and every granule's basin mean becomes an indexed weighted average. The weights and
+reductions themselves come from the generic raster engine in dataUtils.zonal.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Global EASE-Grid 2.0, 9 km (SPL3SMP_E)
+EASE2_CRS = "EPSG:6933"
+EASE2_ROWS = 1624
+EASE2_COLS = 3856
+EASE2_CELL_SIZE = 9008.055210146      # meters
+EASE2_ORIGIN_X = -17367530.44516138   # upper-left corner x
+EASE2_ORIGIN_Y = 7314540.830638504    # upper-left corner y
+
+EASE2_TRANSFORM = (EASE2_CELL_SIZE, 0.0, EASE2_ORIGIN_X, 0.0, -EASE2_CELL_SIZE, EASE2_ORIGIN_Y)
+EASE2_SHAPE = (EASE2_ROWS, EASE2_COLS)
+
+def compute_cell_weights(polygon, fractional=True):
+    """
+    Find the EASE-2 cells that fall inside a (lon, lat) polygon.
+    With fractional=True each cell is weighted by the share of its area covered by the polygon,
+    otherwise cells whose center lies inside the polygon get a weight of 1.
+    Returns (rows, cols, weights) arrays.
+    """
+    rows, cols, weights = compute_pixel_weights(polygon, EASE2_TRANSFORM, EASE2_SHAPE, EASE2_CRS, fractional=fractional)
+    logger.info(f"Polygon covers {len(rows)} EASE-2 cells")
+    return rows, cols, weights
+
+def get_cell_weights(polygon, huc_id=None, fractional=True, cache_dir=None):
+    """
+    Return (rows, cols, weights) for a polygon, loading them from the on-disk cache when available.
+    """
+    return get_pixel_weights(polygon, EASE2_TRANSFORM, EASE2_SHAPE, EASE2_CRS, fractional=fractional,
+                             cache_dir=cache_dir or get_cache_dir("ease2_weights"), prefix=huc_id or "poly")
@@ -1,9 +1,19 @@
 import requests
 import argparse
+import json
+import os
 import sys
 import logging
+import time
+from dataUtils.data_utils import get_cache_dir
+from dataUtils.rdb import iter_rdb
 '''
-TODO: remove? may not need this with get_all_stations.py
+Site coordinates for PREFIX:ID entries of site_ids.txt.
+
+resolve_coordinates answers a whole site list with one multi-site NWIS site-service call and one
+multi-abbreviation DWR call, and keeps the results in a persistent cache so later builds only ask
+for sites they have not seen before. Sites neither source knows are remembered for MISS_TTL so they
+are not asked for again on every build.
 '''
 
 if not logging.getLogger().hasHandlers():
@@ -11,64 +21,154 @@ if not logging.getLogger().hasHandlers():
 
 logger = logging.getLogger(__name__)
 
-def get_usgs_coordinates(site_number):
-    base_url = "https://waterdata.usgs.gov/nwis/inventory"
-    params = {
-        'search_site_no': site_number,
-        'search_site_no_match_type': 'exact',
-        'group_key': 'NONE',
-        'format': 'sitefile_output',
-        'sitefile_output_format': 'rdb',
-        'column_name': ['site_no', 'station_nm', 'dec_lat_va', 'dec_long_va'],
-        'list_of_search_criteria': 'search_site_no'
-    }
-    
-    response = requests.get(base_url, params=params)
-    lines = response.text.splitlines()
-    
+DWR_STATIONS_URL = "https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations"
+USGS_SITE_URL = "https://waterservices.usgs.gov/nwis/site/"
+COORDINATES_FILE = "coordinates.json"
+MISSES_FILE = "coordinate_misses.json"
+# Seconds before an unresolvable site is looked up again
+MISS_TTL = 7 * 24 * 3600
+# Sites per request, keeping the query strings well inside URL length limits
+BATCH_SIZE = 100
+
+def _coordinates(latitude, longitude):
     try:
-         # Filter out comment lines and retrieve relevant data
-        data_lines = [line for line in lines if not line.startswith('#')]
-        if len(data_lines) < 3:
-            return None
-        data = next((line for line in data_lines[2:] if line.split('\t')[0] == site_number), None)
-        if data is None:
-            return None
-        fields = data.split('\t')
-        return {
-            'latitude': fields[2],
-            'longitude': fields[3]
+        return {'latitude': float(latitude), 'longitude': float(longitude)}
+    except (TypeError, ValueError):
+        return None
+
+def get_dwr_coordinates_bulk(abbrevs):
+    """
+    {ABBREV: {'latitude', 'longitude'}} for DWR stations, one request per BATCH_SIZE abbreviations.
+    Abbreviations are matched case-insensitively and returned upper-case, as DWR stores them.
+    """
+    abbrevs = list(dict.fromkeys(abbrev.upper() for abbrev in abbrevs))
+    coordinates = {}
+    for i in range(0, len(abbrevs), BATCH_SIZE):
+        params = {
+            "format": "json",
+            "dateFormat": "dateOnly",
+            "fields": "abbrev,longitude,latitude",
+            "encoding": "deflate",
+            "abbrev": ",".join(abbrevs[i:i + BATCH_SIZE]),
         }
+        response = requests.get(DWR_STATIONS_URL, params=params)
+        response.raise_for_status()
+        for station in response.json().get('ResultList', []):
+            coords = _coordinates(station.get('latitude'), station.get('longitude'))
+            if station.get('abbrev') and coords:
+                coordinates[station['abbrev'].upper()] = coords
+    return coordinates
+
+def get_usgs_coordinates_bulk(site_numbers):
+    """
+    {site_no: {'latitude', 'longitude'}} from the NWIS site service, one request per BATCH_SIZE sites.
+    """
+    site_numbers = list(dict.fromkeys(site_numbers))
+    coordinates = {}
+    for i in range(0, len(site_numbers), BATCH_SIZE):
+        params = {'format': 'rdb', 'sites': ",".join(site_numbers[i:i + BATCH_SIZE]), 'siteStatus': 'all'}
+        response = requests.get(USGS_SITE_URL, params=params)
+        if response.status_code == 404:
+            continue
+        response.raise_for_status()
+        for row in iter_rdb(response.text.splitlines()):
+            coords = _coordinates(row.get('dec_lat_va'), row.get('dec_long_va'))
+            if row.get('site_no') and coords:
+                coordinates[row['site_no']] = coords
+    return coordinates
+
+def get_usgs_coordinates(site_number):
+    try:
+        return get_usgs_coordinates_bulk([site_number]).get(site_number)
     except Exception:
         return None
 
 def get_dwr_coordinates(abbrev):
-    base_url = "https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations"
-    params = {
-        "format": "json",
-        "dateFormat": "dateOnly",
-        "fields": "abbrev,longitude,latitude",
-        "encoding": "deflate",
-        "abbrev": abbrev,
-    }
-
-    response = requests.get(base_url, params=params)
-    lines = response.text.splitlines()
-    
     try:
-        # Filter out comment lines and retrieve relevant data
-        data_lines = [line for line in lines if not line.startswith('#')]
-        if len(data_lines) < 3:
-            return None
-        data = data_lines[2]
-        fields = data.split('\t')
-        return {
-            'latitude': fields[1],
-            'longitude': fields[2]
-        }
+        return get_dwr_coordinates_bulk([abbrev]).get(abbrev.upper())
     except Exception:
         return None
 
+def _cache_path(cache_dir=None, filename=COORDINATES_FILE):
+    return os.path.join(cache_dir or get_cache_dir("coordinates"), filename)
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_json(data, path):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def load_cached_coordinates(cache_dir=None):
+    return _load_json(_cache_path(cache_dir))
+
+def save_cached_coordinates(coordinates, cache_dir=None):
+    _save_json(coordinates, _cache_path(cache_dir))
+
+def load_cached_misses(cache_dir=None):
+    """
+    {PREFIX:ID: unix time of the last lookup that found nothing}.
+    """
+    return _load_json(_cache_path(cache_dir, MISSES_FILE))
+
+def save_cached_misses(misses, cache_dir=None):
+    _save_json(misses, _cache_path(cache_dir, MISSES_FILE))
+
+def _canonical_site_id(site_id):
+    prefix, _, key = site_id.partition(':')
+    return f"{prefix}:{key.upper()}" if prefix == 'DWR' else site_id
+
+def resolve_coordinates(site_ids, cache_dir=None, refresh=False):
+    """
+    {PREFIX:ID: {'latitude', 'longitude'}} for every resolvable entry of a site list.
+    Cached sites are answered locally; the rest are fetched in one batch per source and cached.
+    Sites that were not found within the last MISS_TTL seconds are not looked up again.
+    """
+    cached = {} if refresh else load_cached_coordinates(cache_dir)
+    misses = {} if refresh else load_cached_misses(cache_dir)
+    now = time.time()
+    missing = {'USGS': [], 'DWR': []}
+    for site_id in dict.fromkeys(map(_canonical_site_id, site_ids)):
+        prefix, _, key = site_id.partition(':')
+        if site_id in cached or now - misses.get(site_id, float('-inf')) < MISS_TTL:
+            continue
+        if prefix in missing:
+            missing[prefix].append(key)
+        else:
+            logger.warning(f"Unrecognized prefix for site ID {site_id}")
+
+    fetchers = {'USGS': get_usgs_coordinates_bulk, 'DWR': get_dwr_coordinates_bulk}
+    fetched = {}
+    not_found = {}
+    for prefix, keys in missing.items():
+        if not keys:
+            continue
+        try:
+            found = fetchers[prefix](keys)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Coordinate lookup failed for {len(keys)} {prefix} sites: {e}")
+            continue
+        fetched.update({f"{prefix}:{key}": coords for key, coords in found.items()})
+        for key in keys:
+            if key not in found:
+                logger.warning(f"No coordinates found for {prefix}:{key}")
+                not_found[f"{prefix}:{key}"] = now
+
+    if fetched:
+        cached.update(fetched)
+        save_cached_coordinates(cached, cache_dir)
+        logger.info(f"Cached coordinates for {len(fetched)} new sites")
+    if not_found or refresh or misses.keys() & fetched.keys():
+        misses = {site_id: t for site_id, t in misses.items() if site_id not in fetched}
+        misses.update(not_found)
+        save_cached_misses(misses, cache_dir)
+    return {site_id: cached[_canonical_site_id(site_id)] for site_id in site_ids
+            if _canonical_site_id(site_id) in cached}
+
 def main():
     parser = argparse.ArgumentParser(description='Fetch latitude and longitude for a given USGS site number.')
     parser.add_argument('site_type', type=str, help='site type (ex: usgs, dwr)')
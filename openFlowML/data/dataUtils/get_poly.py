@@ -1,3 +1,4 @@
+import os
 import requests
 import argparse
 import logging
@@ -8,6 +9,7 @@ import matplotlib.pyplot as plt
 import contextily as ctx
 from matplotlib.collections import PatchCollection
 from matplotlib.patches import Polygon as mplPolygon
+from dataUtils.get_coordinates import resolve_coordinates
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -203,6 +205,34 @@ def perpendicular_distance(p1, p2, p):
         return 0  # or some other default value
     return abs((x2 - x1) * (y1 - y0) - (x1 - x0) * (y2 - y1)) / denominator
 
+def get_site_basins(site_ids):
+    """
+    Resolve 'PREFIX:ID' site entries to their HUC8 basins.
+    Returns ({huc_id: simplified polygon}, {site_id: huc_id}); sites sharing a basin share its polygon.
+    Coordinates come from resolve_coordinates (batched requests, cached across runs).
+    """
+    basin_polygons, site_hucs = {}, {}
+    coordinates = resolve_coordinates(site_ids)
+    for site_id in site_ids:
+        coords = coordinates.get(site_id)
+        if not coords:
+            logger.warning(f"No coordinates found for {site_id}. Skipping...")
+            continue
+        huc8_polygon, huc_id, _ = get_huc_polygon(float(coords['latitude']), float(coords['longitude']), huc_level=8)
+        if not huc8_polygon:
+            logger.warning(f"No HUC8 polygon found for {site_id}. Skipping...")
+            continue
+        if huc_id not in basin_polygons:
+            basin_polygons[huc_id] = simplify_polygon(huc8_polygon)
+        site_hucs[site_id] = huc_id
+    return basin_polygons, site_hucs
+
+def get_site_ids(filename=None):
+    if filename is None:
+        filename = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), '.github', 'site_ids.txt')
+    with open(filename, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
 def main(lat, lon, huc_level, data_bounds=None):
     huc_polygon = get_huc_polygon(lat, lon, huc_level)
     if huc_polygon:
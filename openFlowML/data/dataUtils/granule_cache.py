@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import earthaccess
+from dataUtils.data_utils import get_cache_dir
+
+'''
+Persistent, size-bounded cache for Earthdata granules.
+
+SMAP L3 granules are global, so the same daily file serves every gauge. Files are stored under
+their granule id, checked against the size/checksum published in CMR, and evicted least recently
+used first once the cache grows past its disk budget (OPENFLOW_GRANULE_CACHE_GB, default 20 GB).
+Large requests are downloaded in batches sized from that budget, evicting between batches, so
+a multi-year backfill never holds more than a couple of batches on disk at once.
+'''
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_GB = 20
+# Upper bound on granules per batch when CMR publishes no sizes
+MAX_BATCH_GRANULES = 32
+CHECKSUM_ALGORITHMS = {"MD5": "md5", "SHA-1": "sha1", "SHA-256": "sha256", "SHA-512": "sha512"}
+
+def _granule_file_info(granule):
+    """
+    Return the CMR archive entry (Name, size, checksum) for the granule's data file, if published.
+    """
+    try:
+        entries = granule["umm"]["DataGranule"]["ArchiveAndDistributionInformation"]
+    except (KeyError, TypeError):
+        return {}
+    data_entries = [e for e in entries if e.get("Name", "").endswith((".h5", ".nc", ".tif"))]
+    return (data_entries or entries or [{}])[0]
+
+def granule_id(granule):
+    """
+    Stable identifier for a granule, safe to use as a directory name.
+    """
+    umm = granule.get("umm", {})
+    meta = granule.get("meta", {})
+    raw_id = umm.get("GranuleUR") or meta.get("native-id") or meta.get("concept-id")
+    return re.sub(r"[^A-Za-z0-9._-]", "_", raw_id)
+
+def granule_file_name(granule):
+    """
+    File name the granule is downloaded as.
+    """
+    info = _granule_file_info(granule)
+    if info.get("Name"):
+        return info["Name"]
+    links = granule.data_links() if hasattr(granule, "data_links") else []
+    return os.path.basename(links[0]) if links else granule_id(granule)
+
+def expected_size_bytes(granule):
+    """
+    Size of the data file in bytes as published in CMR, or None when unknown.
+    """
+    info = _granule_file_info(granule)
+    if "SizeInBytes" in info:
+        return int(info["SizeInBytes"])
+    if "Size" in info:
+        unit = info.get("SizeUnit", "MB").upper()
+        scale = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}.get(unit, 1024 ** 2)
+        return int(float(info["Size"]) * scale)
+    return None
+
+def _file_checksum(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def verify_granule_file(path, granule, check_checksum=True):
+    """
+    Check a local file against the CMR checksum (when requested and published) or size.
+    Sizes published in MB are rounded, so they are only compared to within 1%.
+    """
+    if not os.path.exists(path):
+        return False
+    info = _granule_file_info(granule)
+    checksum = info.get("Checksum") or {}
+    algorithm = CHECKSUM_ALGORITHMS.get(str(checksum.get("Algorithm", "")).upper())
+    if check_checksum and algorithm and checksum.get("Value"):
+        return _file_checksum(path, algorithm).lower() == checksum["Value"].lower()
+
+    expected = expected_size_bytes(granule)
+    if expected is None:
+        return os.path.getsize(path) > 0
+    actual = os.path.getsize(path)
+    if "SizeInBytes" in info:
+        return actual == expected
+    return abs(actual - expected) <= 0.01 * expected
+
+class GranuleCache:
+    """
+    Directory of downloaded granules keyed by granule id, with LRU eviction to a disk budget.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or get_cache_dir("granules")
+        if max_bytes is None:
+            max_gb = float(os.getenv("OPENFLOW_GRANULE_CACHE_GB", DEFAULT_CACHE_GB))
+            max_bytes = int(max_gb * 1024 ** 3)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, granule):
+        return os.path.join(self.cache_dir, granule_id(granule), granule_file_name(granule))
+
+    def get(self, granule):
+        """
+        Return the cached path for a granule, or None if it is missing or fails the size check.
+        A hit refreshes the file's modification time, which drives LRU eviction.
+        """
+        path = self.path_for(granule)
+        if verify_granule_file(path, granule, check_checksum=False):
+            os.utime(path, None)
+            return path
+        if os.path.exists(path):
+            logger.warning(f"Discarding cached granule that does not match CMR metadata: {path}")
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        return None
+
+    def batches(self, granules):
+        """
+        Split granules into batches whose published sizes fit in a third of the budget, so the
+        batch being read and the batch being downloaded both stay pinned within the budget.
+        """
+        limit = self.max_bytes // 3
+        batch, batch_bytes = [], 0
+        for granule in granules:
+            size = expected_size_bytes(granule) or 0
+            if batch and (batch_bytes + size > limit or len(batch) >= MAX_BATCH_GRANULES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(granule)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def fetch_batches(self, granules, threads=4):
+        """
+        Yield (granules, local paths) one batch at a time, downloading only what is not cached.
+        Before each download the cache is trimmed to make room, keeping the new batch and the
+        previous one (which the caller may still be reading) pinned. Paths of older batches can
+        be evicted once the next batch is requested.
+        """
+        previous = set()
+        for batch in self.batches(granules):
+            paths = [self.get(g) for g in batch]
+            missing = [g for g, p in zip(batch, paths) if p is None]
+            logger.info(f"Granule cache: {len(batch) - len(missing)} hits, {len(missing)} to download")
+
+            if missing:
+                incoming = sum(expected_size_bytes(g) or 0 for g in missing)
+                self.evict(keep=previous | {p for p in paths if p}, target_bytes=max(0, self.max_bytes - incoming))
+                downloaded = self._download(missing, threads)
+                paths = [p or downloaded.get(granule_id(g)) for g, p in zip(batch, paths)]
+
+            current = {p for p in paths if p}
+            self.evict(keep=previous | current)
+            previous = current
+            yield batch, paths
+
+    def fetch(self, granules, threads=4):
+        """
+        Return local paths for the granules (in the same order, None for failures),
+        downloading only those not already cached. Requests larger than the budget are
+        downloaded batch by batch, so early paths may be evicted by the time the call returns;
+        use fetch_batches to read such ranges as they arrive.
+        """
+        paths = []
+        for _, batch_paths in self.fetch_batches(granules, threads=threads):
+            paths.extend(batch_paths)
+        return paths
+
+    def _download(self, granules, threads):
+        # Stage inside the cache so the final move is an atomic rename on the same filesystem
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.cache_dir)
+        downloaded = {}
+        try:
+            earthaccess.download(granules, local_path=staging_dir, threads=threads)
+            for granule in granules:
+                staged = os.path.join(staging_dir, granule_file_name(granule))
+                if not verify_granule_file(staged, granule):
+                    logger.error(f"Downloaded granule failed verification: {granule_id(granule)}")
+                    continue
+                final_path = self.path_for(granule)
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(staged, final_path)
+                downloaded[granule_id(granule)] = final_path
+        except Exception as e:
+            logger.error(f"Error downloading granules: {e}")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return downloaded
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith(".staging-"):
+                continue
+            for f in os.scandir(entry.path):
+                if f.is_file():
+                    stat = f.stat()
+                    entries.append((stat.st_mtime, stat.st_size, f.path))
+        return entries
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=(), target_bytes=None):
+        """
+        Remove least recently used granules until the cache fits its budget (or target_bytes).
+        Paths in keep (e.g. granules the caller is about to read) are never removed.
+        """
+        target_bytes = self.max_bytes if target_bytes is None else target_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            if path in keep:
+                continue
+            logger.info(f"Evicting cached granule {path}")
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            total -= size
+        return total
+
+_default_cache = None
+
+def get_granule_cache():
+    """
+    Process-wide granule cache shared by every site in a build.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = GranuleCache()
+    return _default_cache
@@ -0,0 +1,25 @@
+'''
+Parser for the USGS RDB (tab-separated) format returned by the NWIS web services.
+
+Kept free of other imports so both the data package and the top-level station scripts can use it.
+'''
+
+def iter_rdb(lines):
+    """
+    Rows of a USGS RDB (tab-separated) reply as dicts, skipping comments and the column-format line.
+    Accepts any iterable of lines, so a streamed reply is parsed as it arrives.
+    """
+    header = None
+    format_line_seen = False
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        if header is None:
+            header = line.split('\t')
+        elif not format_line_seen:
+            format_line_seen = True
+        else:
+            yield dict(zip(header, line.split('\t')))
+
+def parse_rdb(text):
+    return list(iter_rdb(text.splitlines()))
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from functools import lru_cache
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, shape
+from shapely.ops import transform as transform_geometry
+from pyproj import CRS, Transformer
+from dataUtils.data_utils import get_cache_dir
+
+'''
+Raster zonal statistics with cached fractional pixel weights.
+
+A grid is described by its affine transform (a, b, c, d, e, f), shape (rows, cols) and CRS.
+For a polygon on a grid, every pixel it touches gets the share of the pixel's area that the
+polygon covers. Those (rows, cols, weights) cells depend only on the grid and the polygon, so
+they are cached on disk and every raster on the same grid reduces to an indexed weighted average.
+Many polygons can be stacked and reduced against one array in a single vectorized pass.
+'''
+
+logger = logging.getLogger(__name__)
+
+def _coefficients(transform):
+    """
+    (a, b, c, d, e, f) of an affine.Affine or a plain 6-sequence in the same order.
+    """
+    if hasattr(transform, "a"):
+        return tuple(float(v) for v in (transform.a, transform.b, transform.c, transform.d, transform.e, transform.f))
+    return tuple(float(v) for v in list(transform)[:6])
+
+def _as_geometry(polygon):
+    if isinstance(polygon, shapely.Geometry):
+        return polygon
+    if isinstance(polygon, dict):
+        return shape(polygon)
+    return Polygon(polygon)
+
+@lru_cache(maxsize=32)
+def _transformer(src_crs, dst_crs):
+    return Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+def _to_grid_crs(geometry, polygon_crs, grid_crs):
+    src, dst = CRS.from_user_input(polygon_crs), CRS.from_user_input(grid_crs)
+    if src == dst:
+        return geometry
+    return transform_geometry(_transformer(src.to_wkt(), dst.to_wkt()).transform, geometry)
+
+def grid_key(transform, shape, crs):
+    """
+    Short hash identifying a grid by transform, shape and CRS.
+    """
+    grid = {
+        "transform": [round(v, 9) for v in _coefficients(transform)],
+        "shape": [int(n) for n in shape],
+        "crs": CRS.from_user_input(crs).to_wkt(),
+    }
+    return hashlib.sha1(json.dumps(grid, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+def polygon_key(polygon):
+    """
+    Short hash of a polygon's coordinates (rounded to 1e-6).
+    """
+    geometry = shapely.normalize(shapely.set_precision(_as_geometry(polygon), 1e-6))
+    return hashlib.sha1(geometry.wkb).hexdigest()[:12]
+
+def compute_pixel_weights(polygon, transform, shape, crs, polygon_crs="EPSG:4326", fractional=True):
+    """
+    Find the pixels of a north-up grid covered by a polygon (coordinates in polygon_crs).
+    With fractional=True each pixel is weighted by the share of its area covered by the polygon,
+    otherwise pixels whose center lies inside the polygon get a weight of 1. Geometries without
+    area (points, lines) give weight 1 to every pixel they touch.
+    Returns (rows, cols, weights) arrays.
+    """
+    a, b, c, d, e, f = _coefficients(transform)
+    if b or d:
+        raise ValueError("Only north-up grids (no rotation) are supported")
+    n_rows, n_cols = int(shape[0]), int(shape[1])
+
+    geometry = _to_grid_crs(_as_geometry(polygon), polygon_crs, crs)
+    if not geometry.is_valid:
+        geometry = geometry.buffer(0)
+    minx, miny, maxx, maxy = geometry.bounds
+
+    col_edges = sorted(((minx - c) / a, (maxx - c) / a))
+    row_edges = sorted(((miny - f) / e, (maxy - f) / e))
+    col_start = max(int(np.floor(col_edges[0])), 0)
+    col_stop = min(int(np.ceil(col_edges[1])) + 1, n_cols)
+    row_start = max(int(np.floor(row_edges[0])), 0)
+    row_stop = min(int(np.ceil(row_edges[1])) + 1, n_rows)
+    if col_start >= col_stop or row_start >= row_stop:
+        logger.warning("Polygon does not overlap the grid")
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+    rows, cols = np.meshgrid(np.arange(row_start, row_stop), np.arange(col_start, col_stop), indexing="ij")
+    rows = rows.ravel()
+    cols = cols.ravel()
+    x0 = c + cols * a
+    y0 = f + rows * e
+
+    if geometry.area == 0:
+        cells = shapely.box(np.minimum(x0, x0 + a), np.minimum(y0, y0 + e), np.maximum(x0, x0 + a), np.maximum(y0, y0 + e))
+        weights = shapely.intersects(cells, geometry).astype(float)
+    elif fractional:
+        cells = shapely.box(np.minimum(x0, x0 + a), np.minimum(y0, y0 + e), np.maximum(x0, x0 + a), np.maximum(y0, y0 + e))
+        weights = shapely.area(shapely.intersection(cells, geometry)) / abs(a * e)
+    else:
+        weights = shapely.contains_xy(geometry, x0 + a / 2, y0 + e / 2).astype(float)
+
+    keep = weights > 0
+    logger.debug(f"Polygon covers {keep.sum()} pixels")
+    return rows[keep].astype(np.int32), cols[keep].astype(np.int32), weights[keep].astype(np.float32)
+
+def get_pixel_weights(polygon, transform, shape, crs, polygon_crs="EPSG:4326", fractional=True, cache_dir=None, prefix=None):
+    """
+    Return (rows, cols, weights) for a polygon on a grid, loading them from the on-disk cache
+    (keyed by grid and polygon hash) when available.
+    """
+    cache_dir = cache_dir or get_cache_dir("zonal_weights")
+    mode = "frac" if fractional else "center"
+    name = f"{grid_key(transform, shape, crs)}_{polygon_key(polygon)}_{mode}.npz"
+    cache_path = os.path.join(cache_dir, f"{prefix}_{name}" if prefix else name)
+
+    if os.path.exists(cache_path):
+        logger.debug(f"Loading cached pixel weights from {cache_path}")
+        try:
+            with np.load(cache_path) as cached:
+                return cached["rows"], cached["cols"], cached["weights"]
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"Unreadable pixel weights at {cache_path} ({e}); recomputing")
+
+    rows, cols, weights = compute_pixel_weights(polygon, transform, shape, crs, polygon_crs=polygon_crs, fractional=fractional)
+    # Write to a private temp file and rename it into place, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, rows=rows, cols=cols, weights=weights)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    logger.info(f"Cached {len(rows)} pixel weights at {cache_path}")
+    return rows, cols, weights
+
+def cells_window(cells):
+    """
+    Smallest (row_off, col_off, height, width) window holding all cells, for windowed reads.
+    """
+    rows, cols, _ = cells
+    row_off, col_off = int(rows.min()), int(cols.min())
+    return row_off, col_off, int(rows.max()) - row_off + 1, int(cols.max()) - col_off + 1
+
+def offset_cells(cells, row_off, col_off):
+    """
+    Cells re-indexed relative to a window starting at (row_off, col_off).
+    """
+    rows, cols, weights = cells
+    return rows - row_off, cols - col_off, weights
+
+def _valid(values, fill_value):
+    valid = np.isfinite(values)
+    if fill_value is not None:
+        valid &= values != fill_value
+    return valid
+
+def weighted_mean(data, cells, fill_value=-9999.0):
+    """
+    Weighted mean of a 2D array over the given (rows, cols, weights) cells, ignoring fill values.
+    Returns (mean, valid_count); mean is None when no cell holds valid data.
+    """
+    rows, cols, weights = cells
+    values = data[rows, cols]
+    valid = _valid(values, fill_value)
+    if not valid.any():
+        return None, 0
+    w = weights[valid]
+    return float(np.sum(values[valid] * w) / np.sum(w)), int(valid.sum())
+
+def zonal_stats(data, cells, fill_value=None):
+    """
+    Weighted mean, min, max and valid count of a 2D array over the cells.
+    Statistics are NaN (count 0) when no cell holds valid data.
+    """
+    rows, cols, weights = cells
+    values = data[rows, cols]
+    valid = _valid(values, fill_value)
+    if not valid.any():
+        return {"mean": np.nan, "min": np.nan, "max": np.nan, "count": 0}
+    v, w = values[valid], weights[valid]
+    return {"mean": float(np.sum(v * w) / np.sum(w)), "min": float(v.min()), "max": float(v.max()), "count": int(valid.sum())}
+
+def read_cell_values(dataset, cells):
+    """
+    Read only the hyperslab spanning the cells from an h5py dataset (or array) and return the per-cell values.
+    """
+    rows, cols, _ = cells
+    row_start, col_start = int(rows.min()), int(cols.min())
+    slab = dataset[row_start:int(rows.max()) + 1, col_start:int(cols.max()) + 1]
+    return slab[rows - row_start, cols - col_start]
+
+def stack_cell_weights(basin_cells):
+    """
+    Concatenate per-basin (rows, cols, weights) into one cell set so a raster can be read once
+    for all basins. Returns (basin_ids, cells, basin_index) where basin_index maps each cell to
+    the position of its basin in basin_ids.
+    """
+    basin_ids = [b for b in basin_cells if len(basin_cells[b][0]) > 0]
+    if not basin_ids:
+        empty = np.empty(0, dtype=np.int32)
+        return [], (empty, empty, np.empty(0, dtype=np.float32)), empty
+    rows = np.concatenate([basin_cells[b][0] for b in basin_ids]).astype(np.int32)
+    cols = np.concatenate([basin_cells[b][1] for b in basin_ids]).astype(np.int32)
+    weights = np.concatenate([basin_cells[b][2] for b in basin_ids]).astype(np.float32)
+    basin_index = np.concatenate([np.full(len(basin_cells[b][0]), i, dtype=np.int32) for i, b in enumerate(basin_ids)])
+    return basin_ids, (rows, cols, weights), basin_index
+
+def basin_weighted_sums(values, weights, basin_index, n_basins, fill_value=-9999.0):
+    """
+    Per-basin weighted sums, weight totals and valid-cell counts in one vectorized pass.
+    Dividing the first two gives the basin means; keeping them separate lets callers pool retrievals.
+    """
+    valid = _valid(values, fill_value)
+    w = np.where(valid, weights, 0.0)
+    sums = np.bincount(basin_index, weights=np.where(valid, values, 0.0) * w, minlength=n_basins)
+    weight_totals = np.bincount(basin_index, weights=w, minlength=n_basins)
+    counts = np.bincount(basin_index, weights=valid.astype(float), minlength=n_basins).astype(int)
+    return sums, weight_totals, counts
+
+def batch_zonal_stats(data, basin_cells, fill_value=None):
+    """
+    Zonal statistics for many polygons ({id: (rows, cols, weights)}) against one 2D array.
+    Returns {id: {mean, min, max, count}}.
+    """
+    basin_ids, cells, basin_index = stack_cell_weights(basin_cells)
+    results = {basin_id: {"mean": np.nan, "min": np.nan, "max": np.nan, "count": 0} for basin_id in basin_cells}
+    if not basin_ids:
+        return results
+
+    values = data[cells[0], cells[1]].astype(np.float64)
+    valid = _valid(values, fill_value)
+    n = len(basin_ids)
+    sums, weight_totals, counts = basin_weighted_sums(values, cells[2], basin_index, n, fill_value)
+    minima = np.full(n, np.inf)
+    maxima = np.full(n, -np.inf)
+    np.minimum.at(minima, basin_index[valid], values[valid])
+    np.maximum.at(maxima, basin_index[valid], values[valid])
+
+    for i, basin_id in enumerate(basin_ids):
+        if counts[i] > 0:
+            results[basin_id] = {"mean": float(sums[i] / weight_totals[i]), "min": float(minima[i]),
+                                 "max": float(maxima[i]), "count": int(counts[i])}
+    return results
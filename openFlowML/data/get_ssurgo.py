@@ -0,0 +1,164 @@
+import argparse
+import json
+import logging
+import numpy as np
+import pandas as pd
+import requests
+from shapely.geometry import Polygon
+from dataUtils.get_poly import get_huc_polygon, simplify_polygon, validate_polygon, get_site_basins, get_site_ids
+from basin_features import load_static_features, save_static_features, save_site_hucs
+
+'''
+Static SSURGO soil features per HUC from USDA Soil Data Access (SDA).
+
+Soil hydrologic properties do not change over the training period, so they are computed once
+per basin and kept forever: an SDA spatial query clips the SSURGO map units to the HUC polygon
+and returns each map unit's area, a second query fetches the map unit attributes, and the
+area-weighted aggregates are stored in the basin_features cache keyed by HUC id.
+combine_data joins them onto every site in the HUC without touching SDA again.
+'''
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SDA_URL = "https://SDMDataAccess.sc.egov.usda.gov/Tabular/post.rest"
+HSG_GROUPS = ["A", "B", "C", "D"]
+
+def run_sda_query(query, timeout=120):
+    """
+    Run a query against Soil Data Access and return the result as a DataFrame.
+    """
+    payload = {"query": query, "format": "JSON+COLUMNNAME"}
+    response = requests.post(SDA_URL, data=json.dumps(payload), headers={"Content-Type": "application/json"}, timeout=timeout)
+    response.raise_for_status()
+    table = response.json().get("Table", []) if response.text.strip() else []
+    if not table:
+        return pd.DataFrame()
+    return pd.DataFrame(table[1:], columns=table[0])
+
+def mapunit_areas(polygon):
+    """
+    Area (m2) of every SSURGO map unit inside a (lon, lat) polygon, clipped on the SDA server.
+    """
+    wkt = Polygon(polygon).wkt
+    query = f"""
+~DeclareGeometry(@aoi)~
+select @aoi = geometry::STPolyFromText('{wkt}', 4326)
+~DeclareIdGeomTable(@intersectedPolygonGeometries)~
+~GetClippedMapunits(@aoi,polygon,geo,@intersectedPolygonGeometries)~
+~DeclareIdGeogTable(@intersectedPolygonGeographies)~
+~GetGeogFromGeomWgs84(@intersectedPolygonGeometries,@intersectedPolygonGeographies)~
+select id as mukey, sum(geog.STArea()) as area_m2 from @intersectedPolygonGeographies group by id
+"""
+    areas = run_sda_query(query)
+    if areas.empty:
+        return areas
+    areas["mukey"] = areas["mukey"].astype(str)
+    areas["area_m2"] = pd.to_numeric(areas["area_m2"], errors="coerce")
+    return areas
+
+def mapunit_properties(mukeys):
+    """
+    Hydrologic properties of map units: available water storage (0-100 cm), dominant hydrologic
+    soil group, minimum depth to bedrock and shallowest restrictive layer of the major components.
+    """
+    keys = ",".join(f"'{mukey}'" for mukey in mukeys)
+    query = f"""
+select ma.mukey, ma.aws0100wta, ma.hydgrpdcd, ma.brockdepmin,
+    (select min(cr.resdept_r) from component c
+        inner join corestrictions cr on cr.cokey = c.cokey
+        where c.mukey = ma.mukey and c.majcompflag = 'Yes') as resdept_min
+from muaggatt ma
+where ma.mukey in ({keys})
+"""
+    properties = run_sda_query(query)
+    if properties.empty:
+        return properties
+    properties["mukey"] = properties["mukey"].astype(str)
+    for column in ["aws0100wta", "brockdepmin", "resdept_min"]:
+        properties[column] = pd.to_numeric(properties[column], errors="coerce")
+    return properties
+
+def _weighted_mean(values, areas):
+    valid = values.notna() & areas.notna()
+    if not valid.any() or areas[valid].sum() == 0:
+        return np.nan
+    return float(np.average(values[valid], weights=areas[valid]))
+
+def aggregate_features(areas, properties):
+    """
+    Area-weighted basin aggregates of the map unit properties.
+    Hydrologic soil groups become area fractions; dual groups (e.g. A/D) count as their undrained group.
+    """
+    units = areas.merge(properties, on="mukey", how="left")
+    total_area = units["area_m2"].sum()
+    features = {
+        "AWS 0-100cm (cm)": _weighted_mean(units["aws0100wta"], units["area_m2"]),
+        "Depth to Restrictive Layer (cm)": _weighted_mean(units["resdept_min"], units["area_m2"]),
+        "Depth to Bedrock (cm)": _weighted_mean(units["brockdepmin"], units["area_m2"]),
+    }
+    groups = units["hydgrpdcd"].fillna("").astype(str).str.split("/").str[-1].str.strip()
+    for group in HSG_GROUPS:
+        features[f"HSG {group}"] = float(units.loc[groups == group, "area_m2"].sum() / total_area) if total_area else np.nan
+    features["Soil Mapped Area (km2)"] = float(total_area / 1e6)
+    return features
+
+def get_ssurgo_features(huc_id, polygon, cache_dir=None, refresh=False):
+    """
+    Area-weighted SSURGO features for a HUC, computed from SDA once and then read from the cache.
+    """
+    if not refresh:
+        cached = load_static_features(cache_dir).get(str(huc_id))
+        if cached is not None:
+            return cached
+
+    areas = mapunit_areas(polygon)
+    if areas.empty:
+        logging.warning(f"No SSURGO map units found for HUC {huc_id}")
+        return None
+    properties = mapunit_properties(areas["mukey"].unique())
+    features = aggregate_features(areas, properties)
+    save_static_features(huc_id, features, cache_dir)
+    logging.info(f"Cached SSURGO features for HUC {huc_id} from {len(areas)} map units")
+    return features
+
+def main_all_sites(site_ids_file=None, cache_dir=None):
+    """
+    Compute and cache the SSURGO features of every basin in site_ids.txt that is not cached yet,
+    and record each site's HUC so combine_data can join the features.
+    """
+    basin_polygons, site_hucs = get_site_basins(get_site_ids(site_ids_file))
+    save_site_hucs(site_hucs, cache_dir)
+    cached = load_static_features(cache_dir)
+    for huc_id, polygon in basin_polygons.items():
+        if str(huc_id) in cached:
+            continue
+        try:
+            get_ssurgo_features(huc_id, validate_polygon(polygon), cache_dir=cache_dir)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"SDA query failed for HUC {huc_id}: {e}")
+    return load_static_features(cache_dir)
+
+def main(lat, lon):
+    huc8_polygon, huc_id, _ = get_huc_polygon(lat, lon, 8)
+    if not huc8_polygon:
+        logging.error("No HUC8 polygon found")
+        return None
+    polygon = validate_polygon(simplify_polygon(huc8_polygon))
+    features = get_ssurgo_features(huc_id, polygon)
+    logging.info(f"SSURGO features for HUC8 {huc_id}: {features}")
+    return features
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute cached, area-weighted SSURGO soil features for HUC8 basins.')
+    parser.add_argument('--lat', type=float, help='Latitude of a point within the HUC8')
+    parser.add_argument('--lon', type=float, help='Longitude of a point within the HUC8')
+    parser.add_argument('--all-sites', action='store_true', help='Compute features for every basin in site_ids.txt')
+    args = parser.parse_args()
+
+    if args.all_sites:
+        main_all_sites()
+    elif args.lat is None or args.lon is None:
+        parser.error("--lat and --lon are required unless --all-sites is given")
+    else:
+        main(args.lat, args.lon)
@@ -2,53 +2,199 @@ import requests
 import argparse
 import pandas as pd
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from shapely.geometry import Polygon, Point
 import geopandas as gpd
-import rasterio
-from rasterio.mask import mask
-from dataUtils.get_poly import get_huc8_polygon, simplify_polygon
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+from dataUtils.get_poly import get_huc_polygon, simplify_polygon
+from dataUtils.data_utils import get_cache_dir
+from dataUtils.zonal import get_pixel_weights, cells_window, offset_cells, zonal_stats, polygon_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_vegdri_data(geometry, date):
+VEGDRI_IMAGE_SERVER = "https://vegdri.cr.usgs.gov/arcgis/rest/services/VegDRI/VegDRI_Current/ImageServer"
+VEGDRI_RESOLUTION_M = 1000  # native VegDRI pixel size
+METERS_PER_DEGREE = 111320
+MAX_EXPORT_SIZE = 4000      # ImageServer maxImageWidth/maxImageHeight
+VEGDRI_COMPOSITE_WEEKDAY = 6  # weekly composites are dated by the Sunday that ends their period
+EXPORT_TIMEOUT = 120        # seconds per exportImage request and TIFF download
+
+def summarize_vegdri_tiff(tiff_bytes, shape, date, per_pixel=False):
     """
-    Get VegDRI data for a given geometry and date.
+    Zonal statistics of an exported VegDRI TIFF over a geometry, decoded from memory.
+    Returns {date, mean, min, max, count}; with per_pixel=True a sparse DataFrame of the
+    in-geometry, non-nodata pixels (float32 VegDRI, latitude, longitude, weight) instead.
     """
-    if not (geometry and date):
-        logging.error("Missing required parameters")
+    with MemoryFile(tiff_bytes) as memfile, memfile.open() as src:
+        cells = get_pixel_weights(shape, src.transform, src.shape, src.crs)
+        if len(cells[0]) == 0:
+            logging.warning("Geometry does not overlap the VegDRI export")
+            return None if per_pixel else {"date": date, "mean": np.nan, "min": np.nan, "max": np.nan, "count": 0}
+        row_off, col_off, height, width = cells_window(cells)
+        data = src.read(1, window=Window(col_off, row_off, width, height))
+        nodata = src.nodata
+        transform = src.transform
+
+    window_cells = offset_cells(cells, row_off, col_off)
+    if not per_pixel:
+        return {"date": date, **zonal_stats(data, window_cells, fill_value=nodata)}
+
+    rows, cols, weights = cells
+    values = data[window_cells[0], window_cells[1]]
+    valid = np.isfinite(values)
+    if nodata is not None:
+        valid &= values != nodata
+    return pd.DataFrame({
+        'VegDRI': values[valid].astype(np.float32),
+        'latitude': (transform.f + (rows[valid] + 0.5) * transform.e).astype(np.float32),
+        'longitude': (transform.c + (cols[valid] + 0.5) * transform.a).astype(np.float32),
+        'weight': weights[valid],
+    })
+
+def esri_time(date):
+    """
+    ArcGIS time instant (epoch milliseconds, UTC) for a YYYY-MM-DD date.
+    """
+    return int(datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def esri_geometry(shape):
+    """
+    ArcGIS JSON geometry and geometry type for a shapely Point or Polygon in WGS84.
+    """
+    if shape.geom_type == 'Point':
+        return {"x": shape.x, "y": shape.y, "spatialReference": {"wkid": 4326}}, "esriGeometryPoint"
+    return {"rings": [list(map(list, shape.exterior.coords))], "spatialReference": {"wkid": 4326}}, "esriGeometryPolygon"
+
+def get_vegdri_server_stats(shape, date, session=None):
+    """
+    Ask the ImageServer itself for VegDRI statistics over the geometry: computeStatisticsHistograms
+    for polygons, getSamples for points. Returns {date, mean, min, max, count}, or None when the
+    server cannot answer (the caller then falls back to an image export).
+    The server's mean is an unweighted mean over the pixels whose centres fall in the polygon, so it
+    differs from the area-weighted mean of export_vegdri_data along the basin edge.
+    """
+    session = session or requests
+    geometry, geometry_type = esri_geometry(shape)
+    params = {
+        "geometry": json.dumps(geometry),
+        "geometryType": geometry_type,
+        "time": esri_time(date),
+        "f": "json",
+    }
+    if geometry_type == "esriGeometryPoint":
+        endpoint = "getSamples"
+        params.update({"returnFirstValueOnly": "true", "outFields": ""})
+    else:
+        endpoint = "computeStatisticsHistograms"
+
+    try:
+        response = session.get(f"{VEGDRI_IMAGE_SERVER}/{endpoint}", params=params, timeout=60)
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.warning(f"VegDRI {endpoint} request failed: {e}")
+        return None
+    if 'error' in data:
+        logging.warning(f"VegDRI {endpoint} returned an error: {data['error']}")
         return None
 
+    if endpoint == "getSamples":
+        samples = data.get("samples") or []
+        try:
+            value = float(samples[0]["value"])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
+        return {"date": date, "mean": value, "min": value, "max": value, "count": 1}
+
+    statistics = data.get("statistics") or []
+    if not statistics or not statistics[0].get("count"):
+        return None
+    band = statistics[0]
+    return {"date": date, "mean": float(band["mean"]), "min": float(band["min"]),
+            "max": float(band["max"]), "count": int(band["count"])}
+
+def parse_geometry(geometry):
+    """
+    Shapely Point or Polygon from a GeoJSON string, or None if it is not usable.
+    """
     try:
         geometry_json = json.loads(geometry)
     except ValueError:
         logging.error("Invalid geometry. Must be a GeoJSON object")
         return None
 
-    if geometry_json['type'] not in ['Point', 'Polygon']:
+    if not isinstance(geometry_json, dict) or geometry_json.get('type') not in ['Point', 'Polygon']:
         logging.error("Only Point and Polygon geometry types are supported")
         return None
 
     # Convert geometry to shapely object
-    if geometry_json['type'] == 'Point':
-        shape = Point(geometry_json['coordinates'])
-    else:  # Polygon
-        shape = Polygon(geometry_json['coordinates'][0])
+    try:
+        if geometry_json['type'] == 'Point':
+            return Point(geometry_json['coordinates'])
+        return Polygon(geometry_json['coordinates'][0])
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        logging.error(f"Invalid {geometry_json['type']} coordinates: {e}")
+        return None
 
-    # Get the bounding box
+def export_bounds(shape):
+    """
+    Bounds of the geometry, padded to at least one native pixel so points still get an image.
+    """
     minx, miny, maxx, maxy = shape.bounds
+    pad = VEGDRI_RESOLUTION_M / METERS_PER_DEGREE / 2
+    if maxx - minx < 2 * pad:
+        minx, maxx = minx - pad, maxx + pad
+    if maxy - miny < 2 * pad:
+        miny, maxy = miny - pad, maxy + pad
+    return minx, miny, maxx, maxy
+
+def export_size(bounds, resolution_m=VEGDRI_RESOLUTION_M, max_size=MAX_EXPORT_SIZE):
+    """
+    Export width and height (pixels) that sample a WGS84 bounding box at about resolution_m,
+    capped at the server's maximum image size.
+    """
+    minx, miny, maxx, maxy = bounds
+    mid_lat = math.radians((miny + maxy) / 2)
+    width = math.ceil((maxx - minx) * METERS_PER_DEGREE * math.cos(mid_lat) / resolution_m)
+    height = math.ceil((maxy - miny) * METERS_PER_DEGREE / resolution_m)
+    return min(max(width, 1), max_size), min(max(height, 1), max_size)
+
+def export_grid(shape):
+    """
+    (bounds, width, height, transform) of the WGS84 image export_vegdri_data requests for a geometry;
+    transform is the (a, b, c, d, e, f) north-up affine of the exported pixels.
+    """
+    bounds = export_bounds(shape)
+    width, height = export_size(bounds)
+    minx, miny, maxx, maxy = bounds
+    return bounds, width, height, ((maxx - minx) / width, 0.0, minx, 0.0, -(maxy - miny) / height, maxy)
+
+def export_vegdri_data(shape, date, per_pixel=False, session=None):
+    """
+    Export the VegDRI image around the geometry and reduce it locally.
+    """
+    session = session or requests
+
+    # Get the bounding box and an image size matching VegDRI's native resolution
+    (minx, miny, maxx, maxy), width, height, _ = export_grid(shape)
 
     # Set up the request parameters
-    base_url = "https://vegdri.cr.usgs.gov/arcgis/rest/services/VegDRI/VegDRI_Current/ImageServer/exportImage"
+    base_url = f"{VEGDRI_IMAGE_SERVER}/exportImage"
     
     params = {
         "bbox": f"{minx},{miny},{maxx},{maxy}",
         "bboxSR": 4326,
-        "size": "500,500",
+        "size": f"{width},{height}",
         "imageSR": 4326,
-        "time": date,
+        "time": esri_time(date),
         "format": "tiff",
         "pixelType": "F32",
         "noData": "",
@@ -64,8 +210,8 @@ def get_vegdri_data(geometry, date):
 
     logging.info(f"Fetching VegDRI data from: {base_url} with params: {params}")
     try:
-        response = requests.get(base_url, params=params)
-        print(response.url)
+        response = session.get(base_url, params=params, timeout=EXPORT_TIMEOUT)
+        logging.debug(response.url)
     except requests.exceptions.RequestException as e:
         logging.error(f"Error making request: {e}")
         return None
@@ -75,28 +221,14 @@ def get_vegdri_data(geometry, date):
             data = response.json()
             if 'href' in data:
                 # Download the TIFF file
-                tiff_response = requests.get(data['href'])
+                try:
+                    tiff_response = session.get(data['href'], timeout=EXPORT_TIMEOUT)
+                except requests.exceptions.RequestException as e:
+                    logging.error(f"Error downloading TIFF file: {e}")
+                    return None
                 if tiff_response.status_code == 200:
-                    # Save the TIFF file
-                    with open('vegdri_data.tiff', 'wb') as f:
-                        f.write(tiff_response.content)
-                    logging.info("VegDRI data saved as 'vegdri_data.tiff'")
-                    
-                    # Read the TIFF file and extract data for the geometry
-                    with rasterio.open('vegdri_data.tiff') as src:
-                        out_image, out_transform = mask(src, [shape], crop=True)
-                        out_meta = src.meta.copy()
-                        out_meta.update({"driver": "GTiff",
-                                         "height": out_image.shape[1],
-                                         "width": out_image.shape[2],
-                                         "transform": out_transform})
-                    
-                    # Convert the masked data to a pandas DataFrame
-                    df = pd.DataFrame(out_image[0].flatten(), columns=['VegDRI'])
-                    df['latitude'], df['longitude'] = rasterio.transform.xy(out_transform, 
-                                                                            range(out_meta['height']),
-                                                                            range(out_meta['width']))
-                    return df
+                    # Decode the TIFF in memory and reduce it over the geometry
+                    return summarize_vegdri_tiff(tiff_response.content, shape, date, per_pixel=per_pixel)
                 else:
                     logging.error("Failed to download TIFF file")
                     return None
@@ -110,8 +242,125 @@ def get_vegdri_data(geometry, date):
         logging.error(f"Error: {response.status_code} - {response.text}")
         return None
 
-def main(lat, lon, date):
-    huc8_polygon = get_huc8_polygon(lat, lon)
+def get_vegdri_data(geometry, date, per_pixel=False, server_stats=False, session=None):
+    """
+    Get VegDRI zonal statistics ({date, mean, min, max, count}) for a given geometry and date,
+    or the in-geometry pixels as a DataFrame with per_pixel=True.
+    By default the image is exported and reduced locally with fractional pixel weights, the same
+    area-weighted mean the VegDRI cube and the other zonal features use. server_stats=True asks
+    the ImageServer instead (cheaper, but an unweighted pixel-centre mean; see get_vegdri_server_stats)
+    and falls back to the export when the server cannot answer.
+    """
+    if not (geometry and date):
+        logging.error("Missing required parameters")
+        return None
+
+    try:
+        esri_time(date)
+    except (TypeError, ValueError):
+        logging.error("Invalid date. Must be in the format YYYY-MM-DD")
+        return None
+
+    shape = parse_geometry(geometry)
+    if shape is None:
+        return None
+
+    if server_stats and not per_pixel:
+        stats = get_vegdri_server_stats(shape, date, session=session)
+        if stats is not None:
+            return stats
+        logging.info(f"Server-side statistics unavailable for {date}, falling back to image export")
+
+    return export_vegdri_data(shape, date, per_pixel=per_pixel, session=session)
+
+def weekly_dates(start_date, end_date):
+    """
+    YYYY-MM-DD dates of the weekly composites that overlap start_date..end_date, aligned to
+    VEGDRI_COMPOSITE_WEEKDAY so every caller asks for the same composite dates.
+    Used when the ImageServer cannot list its time slices.
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    current = start + timedelta(days=(VEGDRI_COMPOSITE_WEEKDAY - start.weekday()) % 7)
+    dates = []
+    while current < end + timedelta(days=7):
+        dates.append(current.strftime("%Y-%m-%d"))
+        current += timedelta(days=7)
+    return dates
+
+def composite_dates(start_date, end_date, session=None):
+    """
+    YYYY-MM-DD dates of the VegDRI composites that overlap start_date..end_date, read from the
+    ImageServer's own time slices. Falls back to the fixed weekly calendar (weekly_dates) when
+    the server cannot list them.
+    """
+    session = session or requests
+    try:
+        info = session.get(VEGDRI_IMAGE_SERVER, params={"f": "json"}, timeout=60)
+        info.raise_for_status()
+        time_field = info.json()["timeInfo"]["startTimeField"]
+        end_ms = esri_time(end_date) + 7 * 24 * 3600 * 1000
+        response = session.get(f"{VEGDRI_IMAGE_SERVER}/query", params={
+            "where": "1=1",
+            "time": f"{esri_time(start_date)},{end_ms}",
+            "outFields": time_field,
+            "returnGeometry": "false",
+            "f": "json",
+        }, timeout=60)
+        response.raise_for_status()
+        features = response.json()["features"]
+        dates = {datetime.fromtimestamp(f["attributes"][time_field] / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+                 for f in features}
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Could not list VegDRI composites, using the weekly calendar: {e}")
+        return weekly_dates(start_date, end_date)
+
+    # A composite dated after end_date can still cover it, one dated before start_date cannot
+    last = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
+    return sorted(d for d in dates if start_date <= d <= last)
+
+def get_vegdri_series(geometry, start_date, end_date, max_workers=4, server_stats=False, cache_dir=None):
+    """
+    Weekly VegDRI zonal statistics for a geometry between two dates as a DataFrame
+    (date, mean, min, max, count), one row per composite. Composites are fetched concurrently
+    over one session, and each composite's statistics are cached on disk under its own date, so
+    callers with different start dates share the cache and only missing composites are requested.
+    """
+    shape = parse_geometry(geometry)
+    if shape is None:
+        return None
+    cache_dir = cache_dir or get_cache_dir("vegdri")
+    key = polygon_key(shape)
+    session = requests.Session()
+
+    def fetch(date):
+        # Server and export statistics differ (unweighted vs area-weighted), so each mode has its own entries
+        cache_path = os.path.join(cache_dir, f"{key}_{'server' if server_stats else 'export'}_{date}.json")
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                return json.load(f)
+        stats = get_vegdri_data(geometry, date, server_stats=server_stats, session=session)
+        # Composites that are not published yet come back empty; leave them uncached to ask again later
+        if stats is not None and stats["count"] > 0:
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, cache_path)
+        return stats
+
+    dates = composite_dates(start_date, end_date, session=session)
+    # Every export of this geometry shares one grid: compute the pixel weights once up front so the workers only ever read them
+    _, width, height, transform = export_grid(shape)
+    get_pixel_weights(shape, transform, (height, width), "EPSG:4326")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = [stats for stats in executor.map(fetch, dates) if stats is not None]
+
+    logging.info(f"Fetched VegDRI statistics for {len(rows)} of {len(dates)} dates")
+    series = pd.DataFrame(rows, columns=['date', 'mean', 'min', 'max', 'count'])
+    return series.sort_values('date').reset_index(drop=True)
+
+def main(lat, lon, date, per_pixel=False, server_stats=False, end_date=None):
+    huc8_polygon, _, _ = get_huc_polygon(lat, lon, 8)
     if huc8_polygon:
         simplified_polygon = simplify_polygon(huc8_polygon)
         logging.debug(f"Simplified polygon: {simplified_polygon}")
@@ -119,9 +368,12 @@ def main(lat, lon, date):
             "type": "Polygon",
             "coordinates": [simplified_polygon]
         })
-        data = get_vegdri_data(geometry, date)
+        if end_date:
+            data = get_vegdri_series(geometry, date, end_date, server_stats=server_stats)
+        else:
+            data = get_vegdri_data(geometry, date, per_pixel=per_pixel, server_stats=server_stats)
         if data is not None:
-            logging.info(f"Received VegDRI data: {data.head()}")
+            logging.info(f"Received VegDRI data: {data if isinstance(data, dict) else data.head()}")
             return data
         else:
             logging.error("No data received")
@@ -135,5 +387,8 @@ if __name__ == "__main__":
     parser.add_argument('--lat', type=float, required=True, help='Latitude')
     parser.add_argument('--lon', type=float, required=True, help='Longitude')
     parser.add_argument('--date', type=str, required=True, help='Date in the format YYYY-MM-DD')
+    parser.add_argument('--end-date', type=str, help='Fetch the weekly series from --date through this date (YYYY-MM-DD)')
+    parser.add_argument('--per-pixel', action='store_true', help='Return the in-polygon pixels instead of zonal statistics')
+    parser.add_argument('--server-stats', action='store_true', help='Let the ImageServer compute (unweighted, pixel-centre) statistics instead of exporting the image')
     args = parser.parse_args()
-    main(args.lat, args.lon, args.date)
\ No newline at end of file
+    main(args.lat, args.lon, args.date, args.per_pixel, server_stats=args.server_stats, end_date=args.end_date)
\ No newline at end of file
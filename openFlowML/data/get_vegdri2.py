@@ -1,49 +1,56 @@
 import requests
+import argparse
 import json
 import os
-import tempfile
+import sys
+import threading
 import time
-import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from dataUtils.data_utils import load_vars
+from dataUtils.downloads import download_file
+from vegdri_cube import ingest_directory
 import logging
 
-load_vars()
-
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Configuration
 SERVICE_URL = "https://m2m.cr.usgs.gov/api/api/json/stable/"
-USERNAME = os.getenv("EROS_USERNAME")
-PASSWORD = os.getenv("EROS_PASSWORD")
 DATASET_NAME = "VEGDRI"
 MAX_RESULTS = 1  # We only need the latest dataset
+PAGE_SIZE = 500  # Scenes per scene-search page in bulk mode
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
+DOWNLOAD_ATTEMPTS = 3  # Per archive, each resuming the partial file left by the last one
+MANIFEST_FILE = "manifest.json"
+
+# One HTTP session (connection pool) for every M2M call and download of a run
+_session = requests.Session()
+_manifest_lock = threading.Lock()
 
 def send_request(endpoint, data, api_key=None):
     url = SERVICE_URL + endpoint
     headers = {'X-Auth-Token': api_key} if api_key else None
-    
+
     logger.info(f"Sending request to URL: {url}")
     logger.debug(f"Headers: {headers}")
     logger.debug(f"Data: {data}")
-    
+
     for attempt in range(MAX_RETRIES):
         try:
-            response = requests.post(url, json=data, headers=headers)
+            response = _session.post(url, json=data, headers=headers)
             logger.debug(f"Response status code: {response.status_code}")
             logger.debug(f"Response headers: {response.headers}")
             logger.debug(f"Response content: {response.text}")
-            
+
             response.raise_for_status()
             result = response.json()
-            
+
             if result.get('errorCode'):
                 raise Exception(f"{result['errorCode']}: {result['errorMessage']}")
-            
+
             return result['data']
         except requests.exceptions.RequestException as e:
             logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
@@ -55,42 +62,60 @@ def send_request(endpoint, data, api_key=None):
                 raise
 
 def login():
-    if not USERNAME or not PASSWORD:
+    username = os.getenv("EROS_USERNAME")
+    password = os.getenv("EROS_PASSWORD")
+    if not username or not password:
         raise ValueError("EROS_USERNAME and EROS_PASSWORD environment variables must be set")
-    
-    payload = {'username': USERNAME, 'password': PASSWORD}
+
+    payload = {'username': username, 'password': password}
     api_key = send_request("login", payload)
-    logger.info(f"Logged in successfully. API Key: {api_key}")
+    logger.info("Logged in successfully")
     return api_key
 
 def logout(api_key):
     send_request("logout", None, api_key)
     logger.info("Logged out successfully")
 
-def search_scenes(api_key):
-    end_date = datetime.now().strftime("%Y-%m-%d")
-    start_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-    
-    payload = {
-        'datasetName': DATASET_NAME,
-        'maxResults': MAX_RESULTS,
-        'startingNumber': 1,
-        'sceneFilter': {
-            'acquisitionFilter': {
-                'start': start_date,
-                'end': end_date
-            }
-        },
-        'sortOrder': 'DESC'
-    }
-    
-    scenes = send_request("scene-search", payload, api_key)
-    return scenes['results']
+def search_scenes(api_key, start_date=None, end_date=None, max_results=MAX_RESULTS):
+    """
+    Scenes acquired between two YYYY-MM-DD dates (the last 30 days by default), newest first.
+    Pages through scene-search until max_results scenes are found (all of them when max_results is None).
+    """
+    end_date = end_date or datetime.now().strftime("%Y-%m-%d")
+    start_date = start_date or (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+
+    results = []
+    starting_number = 1
+    while True:
+        page_size = PAGE_SIZE if max_results is None else min(PAGE_SIZE, max_results - len(results))
+        payload = {
+            'datasetName': DATASET_NAME,
+            'maxResults': page_size,
+            'startingNumber': starting_number,
+            'sceneFilter': {
+                'acquisitionFilter': {
+                    'start': start_date,
+                    'end': end_date
+                }
+            },
+            'sortOrder': 'DESC'
+        }
+
+        scenes = send_request("scene-search", payload, api_key)
+        results.extend(scenes['results'])
+        next_record = scenes.get('nextRecord')
+        if (not scenes['results'] or not next_record or next_record <= starting_number
+                or next_record > scenes.get('totalHits', 0)
+                or (max_results is not None and len(results) >= max_results)):
+            return results
+        starting_number = next_record
 
-def get_download_options(api_key, entity_id):
+def get_download_options(api_key, entity_ids):
+    if isinstance(entity_ids, str):
+        entity_ids = [entity_ids]
     payload = {
         'datasetName': DATASET_NAME,
-        'entityIds': [entity_id]
+        'entityIds': list(entity_ids)
     }
     try:
         return send_request("download-options", payload, api_key)
@@ -101,66 +126,171 @@ def get_download_options(api_key, entity_id):
         else:
             raise
 
-def request_download(api_key, downloads):
+def request_download(api_key, downloads, label=None):
     payload = {
         'downloads': downloads,
-        'label': f"VEGDRI_download_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        'label': label or f"VEGDRI_download_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     }
     return send_request("download-request", payload, api_key)
 
-def download_file(url, final_filename):
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_file:
-        logger.info(f"Downloading to temporary file: {temp_file.name}")
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        for chunk in response.iter_content(chunk_size=8192):
-            temp_file.write(chunk)
-    
-    try:
-        shutil.move(temp_file.name, final_filename)
-        logger.info(f"File successfully moved to: {final_filename}")
-    except Exception as e:
-        logger.error(f"Failed to move file: {str(e)}")
-        os.unlink(temp_file.name)
-        raise
-
-def main():
+def retrieve_downloads(api_key, label):
+    """
+    Downloads of a request label, split by M2M into 'available' (with a URL) and 'requested' (still staging).
+    """
+    return send_request("download-retrieve", {'label': label}, api_key)
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def record_download(output_dir, entity_id, filename, acquisition_date=None):
+    """
+    Add a finished download to the manifest so later runs skip the scene.
+    """
+    with _manifest_lock:
+        manifest = load_manifest(output_dir)
+        manifest[entity_id] = {'filename': filename, 'acquisitionDate': acquisition_date}
+        path = os.path.join(output_dir, MANIFEST_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+def is_downloaded(manifest, output_dir, entity_id):
+    entry = manifest.get(entity_id)
+    return bool(entry) and os.path.exists(os.path.join(output_dir, entry['filename']))
+
+def scene_filename(scene, entity_id):
+    if scene and scene.get('acquisitionDate'):
+        return f"VEGDRI_{str(scene['acquisitionDate'])[:10]}.zip"
+    return f"VEGDRI_{entity_id}.zip"
+
+def bulk_download(api_key, scenes, output_dir, max_workers=4, poll_interval=30, max_wait=3600):
+    """
+    Request every scene, poll download-retrieve while M2M stages them and download the archives
+    concurrently (resuming partial files with Range requests) as soon as each one is available.
+    Failed downloads are retried DOWNLOAD_ATTEMPTS times. Scenes already in the output directory's
+    manifest are skipped. Returns the downloaded file paths; raises RuntimeError if any accepted
+    request is still missing, after the finished ones have been recorded in the manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    scenes_by_id = {scene['entityId']: scene for scene in scenes}
+    wanted = [entity_id for entity_id in scenes_by_id if not is_downloaded(manifest, output_dir, entity_id)]
+    logger.info(f"{len(scenes_by_id) - len(wanted)} of {len(scenes_by_id)} scenes already downloaded")
+    if not wanted:
+        return []
+
+    download_options = get_download_options(api_key, wanted)
+    if not download_options:
+        logger.info("No download options available.")
+        return []
+
+    downloads = []
+    for option in download_options:
+        if option.get('available', True) and option.get('entityId') in wanted:
+            downloads.append({'entityId': option['entityId'], 'productId': option['id']})
+            wanted.remove(option['entityId'])  # first available product per scene
+    if not downloads:
+        logger.info("None of the scenes has an available product.")
+        return []
+
+    label = f"VEGDRI_bulk_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    request_results = request_download(api_key, downloads, label)
+    failed = request_results.get('failed') or []
+    if failed:
+        logger.warning(f"{len(failed)} download requests failed: {failed}")
+    expected = len(downloads) - len(failed)
+
+    def fetch(item):
+        entity_id = item.get('entityId') or str(item['downloadId'])
+        filename = scene_filename(scenes_by_id.get(entity_id), entity_id)
+        dest_path = os.path.join(output_dir, filename)
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            if download_file(item['url'], dest_path, session=_session, expected_size=item.get('filesize'),
+                             retry_delay=RETRY_DELAY):
+                record_download(output_dir, entity_id, filename, scenes_by_id.get(entity_id, {}).get('acquisitionDate'))
+                return dest_path
+            if attempt < DOWNLOAD_ATTEMPTS - 1:
+                logger.warning(f"Download of {filename} failed, retrying in {RETRY_DELAY} seconds...")
+                time.sleep(RETRY_DELAY)
+        logger.error(f"Giving up on {filename} after {DOWNLOAD_ATTEMPTS} attempts")
+        return None
+
+    started = set()
+    futures = []
+    deadline = time.monotonic() + max_wait
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            retrieved = retrieve_downloads(api_key, label)
+            for item in retrieved.get('available') or []:
+                if item.get('url') and item['downloadId'] not in started:
+                    started.add(item['downloadId'])
+                    futures.append(executor.submit(fetch, item))
+            # M2M can briefly list a download as neither available nor requested while it moves
+            # between the two, so keep polling until every accepted request has been started
+            if len(started) >= expected:
+                break
+            staging = expected - len(started)
+            if time.monotonic() >= deadline:
+                logger.error(f"{staging} downloads still staging after {max_wait} seconds; run again later to pick them up")
+                break
+            logger.info(f"{len(started)} downloads started, {staging} still staging; polling again in {poll_interval} seconds")
+            time.sleep(poll_interval)
+
+        paths = []
+        for future in as_completed(futures):
+            try:
+                path = future.result()
+            except Exception as e:
+                logger.error(f"Download failed: {e}")
+                continue
+            if path:
+                paths.append(path)
+
+    logger.info(f"Downloaded {len(paths)} of {len(downloads)} requested scenes to {output_dir}")
+    if len(paths) < expected:
+        raise RuntimeError(f"{expected - len(paths)} of {expected} requested scenes were not downloaded; "
+                           "run again to resume them")
+    return paths
+
+def main(start_date=None, end_date=None, output_dir=".", max_workers=4, ingest=False):
+    """
+    Download the latest VegDRI scene, or every scene between start_date and end_date.
+    With ingest=True the archives are then added to the local COG cube (see vegdri_cube).
+    If some archives stay missing, the finished ones are still ingested before the
+    RuntimeError from bulk_download is raised.
+    """
+    load_vars()
     api_key = login()
-    
+
     try:
-        scenes = search_scenes(api_key)
+        max_results = None if start_date else MAX_RESULTS
+        scenes = search_scenes(api_key, start_date, end_date, max_results=max_results)
         if not scenes:
             logger.info("No scenes found.")
-            return
-        
-        latest_scene = scenes[0]
-        entity_id = latest_scene['entityId']
-        
-        download_options = get_download_options(api_key, entity_id)
-        if not download_options:
-            logger.info("No download options available.")
-            return
-        
-        downloads = [{
-            'entityId': entity_id,
-            'productId': download_options[0]['id']  # Assuming the first option is the one we want
-        }]
-        
-        download_results = request_download(api_key, downloads)
-        
-        if download_results['availableDownloads']:
-            url = download_results['availableDownloads'][0]['url']
-            filename = f"VEGDRI_{latest_scene['acquisitionDate']}.zip"
-            download_file(url, filename)
-        else:
-            logger.info("Download not immediately available. Please check the USGS Earth Explorer site later.")
-    
-    except Exception as e:
-        logger.exception(f"An error occurred: {str(e)}")
+            return []
+
+        try:
+            return bulk_download(api_key, scenes, output_dir, max_workers=max_workers)
+        finally:
+            if ingest:
+                ingest_directory(output_dir)
     finally:
-        if 'api_key' in locals():
-            logout(api_key)
+        logout(api_key)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Download VegDRI archives from the USGS M2M API.')
+    parser.add_argument('--start-date', type=str, help='Download every scene from this date (YYYY-MM-DD); the latest scene only if omitted')
+    parser.add_argument('--end-date', type=str, help='Last acquisition date (YYYY-MM-DD), today by default')
+    parser.add_argument('--output-dir', type=str, default='.', help='Directory for the archives and their manifest')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent downloads')
+    parser.add_argument('--ingest', action='store_true', help='Add the downloaded scenes to the local COG cube')
+    args = parser.parse_args()
+    try:
+        main(args.start_date, args.end_date, args.output_dir, args.workers, args.ingest)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
@@ -1,17 +1,23 @@
 import datetime
 import numpy as np
 import h5py
-import shutil
-from scipy.spatial import cKDTree
 from shapely.ops import transform
 from shapely.geometry import Polygon
 import logging
 import argparse
 from earthaccess import *
-from dataUtils.get_poly import check_polygon_intersection, get_huc_polygon, validate_polygon, simplify_polygon
+from dataUtils.get_poly import check_polygon_intersection, get_huc_polygon, validate_polygon, simplify_polygon, get_site_basins, get_site_ids
 from dataUtils.data_utils import load_vars, get_earthdata_auth, get_smap_data_bounds
+from dataUtils.ease_grid import get_cell_weights
+from dataUtils.zonal import weighted_mean, read_cell_values, stack_cell_weights, basin_weighted_sums
+from dataUtils.granule_cache import get_granule_cache
+from dataUtils.cmr_cache import get_collection_concept_id, search_granules
+import smap_store
+from basin_features import save_site_hucs
 import os
-import tempfile
+import re
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 # Conditionally import matplotlib
 import importlib.util
 from shapely.ops import transform
@@ -24,164 +30,268 @@ matplotlib_available = matplotlib_spec is not None
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-load_vars()
+# (group, dataset) of each daily retrieval in an SPL3SMP_E granule
+SMAP_RETRIEVALS = {
+    'AM': ('Soil_Moisture_Retrieval_Data_AM', 'soil_moisture'),
+    'PM': ('Soil_Moisture_Retrieval_Data_PM', 'soil_moisture_pm'),
+}
+SMAP_FILL_VALUE = -9999.0
+SMAP_SERIES_COLUMNS = ['Soil Moisture AM', 'Soil Moisture PM', 'Soil Moisture', 'Valid Cells']
 
-def search_and_download_smap_data(start_date, end_date, auth, simplified_polygon):
+def search_smap_granules(start_date, end_date, auth, simplified_polygon):
     """
-    Search for SMAP L3 data between the given dates that intersect with the given polygon,
-    and download the smallest intersecting granule.
+    Search for SMAP L3 granules between the given dates that intersect with the given polygon.
+    Returns a (possibly empty) list of earthaccess granules.
     """
-    try:
-        # Ensure we're authenticated
-        if not auth.authenticated:
-            logging.info("Not logged in, attempting to log in...")
-            if not auth.login(strategy="environment"):
-                raise RuntimeError("Failed to authenticate with NASA Earthdata Login")
-        else:
-            logging.info("Already authenticated, proceeding with search and download")
-
-        # Search for SPL3SMP_E collection
-        collection_query = earthaccess.DataCollections().short_name("SPL3SMP_E").version("006")
-        collections = collection_query.get()
+    # Ensure we're authenticated
+    if not auth.authenticated:
+        logging.info("Not logged in, attempting to log in...")
+        if not auth.login(strategy="environment"):
+            raise RuntimeError("Failed to authenticate with NASA Earthdata Login")
+    else:
+        logging.info("Already authenticated, proceeding with search and download")
 
-        if not collections:
-            logging.error("SMAP L3 SM_P_E collection not found")
-            return None
+    # Collection concept id and monthly granule listings come from the on-disk CMR cache
+    concept_id = get_collection_concept_id("SPL3SMP_E", "006")
 
-        collection = collections[0]
-        concept_id = collection.concept_id()
-        logging.info(f"Found SMAP_L3_SM_P_E collection with concept_id: {concept_id}")
+    if not concept_id:
+        logging.error("SMAP L3 SM_P_E collection not found")
+        return []
 
+    logging.info(f"Found SMAP_L3_SM_P_E collection with concept_id: {concept_id}")
 
-        # Calculate bounding box from simplified_polygon
-        lons, lats = zip(*simplified_polygon)
-        min_lon, max_lon = min(lons), max(lons)
-        min_lat, max_lat = min(lats), max(lats)
+    # Calculate bounding box from simplified_polygon
+    lons, lats = zip(*simplified_polygon)
+    min_lon, max_lon = min(lons), max(lons)
+    min_lat, max_lat = min(lats), max(lats)
 
-        # Now search for granules using DataGranules
-        granule_query = (earthaccess.DataGranules()
-                         .concept_id(concept_id) 
-                         .temporal(start_date, end_date)
-                         .bounding_box(min_lon, min_lat, max_lon, max_lat))
-                
-        granule_hits = granule_query.hits()
-        logging.info(f"Number of granules found: {granule_hits}")
+    granules = search_granules(concept_id, start_date, end_date, (min_lon, min_lat, max_lon, max_lat))
 
-        if granule_hits == 0:
-            logging.warning(f"No SMAP data found from {start_date} to {end_date}")
-            return None
+    if not granules:
+        logging.warning(f"No SMAP data found from {start_date} to {end_date}")
+        return []
 
-        granules = granule_query.get_all()
+    # Log the number of granules found
+    logging.info(f"Retrieved {len(granules)} granules")
+    return granules
 
+def search_and_download_smap_data(start_date, end_date, auth, simplified_polygon, cache=None):
+    """
+    Search for SMAP L3 data between the given dates that intersect with the given polygon,
+    and download the smallest intersecting granule into the shared granule cache.
+    """
+    cache = cache or get_granule_cache()
+    try:
+        granules = search_smap_granules(start_date, end_date, auth, simplified_polygon)
         if not granules:
-            logging.warning(f"No granules retrieved despite positive hit count")
             return None
 
-        # Log the number of granules found
-        logging.info(f"Retrieved {len(granules)} granules")
-
         # Find the smallest granule
         smallest_granule = min(granules, key=lambda g: g.size())
         logging.info(f"Smallest intersecting granule size: {smallest_granule.size()} MB")
 
-        # Create a temporary directory that won't be automatically deleted
-        temp_dir = tempfile.mkdtemp()
-        logging.info(f"Created temporary directory: {temp_dir}")
-
-        # Download only the smallest granule
-        try:
-            downloaded_files = earthaccess.download(smallest_granule, local_path=temp_dir)
-        except Exception as e:
-            logging.error(f"Error during download: {str(e)}")
-            if temp_dir:
-                shutil.rmtree(temp_dir)
-            return None, None
-
-        if downloaded_files:
-            downloaded_file = downloaded_files[0]
-            logging.info(f"Successfully downloaded: {downloaded_file}")
-            
-            # Verify that the file exists
-            if os.path.exists(downloaded_file):
-                logging.info(f"File exists at {downloaded_file}")
-                file_size = os.path.getsize(downloaded_file)
-                logging.info(f"File size: {file_size} bytes")
-            else:
-                logging.error(f"File does not exist at {downloaded_file}")
-                if temp_dir:
-                    shutil.rmtree(temp_dir)
-                return None, None
-            
-            return downloaded_file, temp_dir
+        downloaded_file = cache.fetch([smallest_granule])[0]
+        if downloaded_file:
+            logging.info(f"SMAP granule available at: {downloaded_file}")
+            return downloaded_file
         else:
             logging.error("Failed to download SMAP data")
-            if temp_dir:
-                shutil.rmtree(temp_dir)
-            return None, None
+            return None
 
     except Exception as e:
         logging.error(f"Error searching or downloading SMAP data: {e}")
         logging.error("Traceback: ", exc_info=True)
-        if temp_dir:
-            shutil.rmtree(temp_dir)
-        return None, None
+        return None
 
-def extract_soil_moisture(hdf_file, polygon, max_distance=0.1):
+def extract_soil_moisture(hdf_file, polygon, huc_id=None, cells=None):
+    """
+    Average SMAP soil moisture over the polygon using precomputed EASE-2 cell weights.
+    Pass cells=(rows, cols, weights) to skip the cache lookup entirely.
+    """
     try:
+        if cells is None:
+            cells = get_cell_weights(polygon, huc_id=huc_id)
+
         with h5py.File(hdf_file, 'r') as file:
             for dataset_name in file:
                 if 'Soil_Moisture_Retrieval_Data' in dataset_name:
                     soil_moisture = file[f'{dataset_name}/soil_moisture'][:]
-                    lat = file[f'{dataset_name}/latitude'][:]
-                    lon = file[f'{dataset_name}/longitude'][:]
                     logging.info(f"Found soil moisture data in {dataset_name}")
                     break
             else:
                 logging.error("Could not find soil moisture data in the file")
-                return None
-
-        polygon_obj = Polygon(polygon)
-        minx, miny, maxx, maxy = polygon_obj.bounds
-
-        # Start with the polygon bounds and gradually expand
-        for distance in np.linspace(0, max_distance, 5):
-            expanded_bounds = (minx-distance, miny-distance, maxx+distance, maxy+distance)
-            mask = (lon >= expanded_bounds[0]) & (lon <= expanded_bounds[2]) & \
-                   (lat >= expanded_bounds[1]) & (lat <= expanded_bounds[3])
-            
-            lons = lon[mask]
-            lats = lat[mask]
-            soil_moisture_masked = soil_moisture[mask]
-
-            valid = (soil_moisture_masked != -9999.0) & (lons != -9999.0) & (lats != -9999.0)
-            lons = lons[valid]
-            lats = lats[valid]
-            soil_moisture_valid = soil_moisture_masked[valid]
-
-            logging.info(f"Found {len(lons)} valid points within expanded bounds (distance: {distance})")
-
-            if len(lons) > 0:
-                tree = cKDTree(np.column_stack((lons, lats)))
-                expanded_polygon = polygon_obj.buffer(distance)
-                mask_polygon = tree.query_ball_point(expanded_polygon.exterior.coords, r=0.01)
-                mask_polygon = np.unique(np.concatenate(mask_polygon))
-
-                soil_moisture_in_polygon = soil_moisture_valid[mask_polygon]
-
-                if len(soil_moisture_in_polygon) > 0:
-                    average_moisture = np.mean(soil_moisture_in_polygon)
-                    logging.info(f"Found {len(soil_moisture_in_polygon)} points inside or near the polygon")
-                    logging.info(f"Average soil moisture: {average_moisture:.4f}")
-                    return average_moisture, expanded_polygon
-
-        logging.warning("No valid soil moisture data found within or near the polygon")
-        return None, None
+                return None, None
+
+        average_moisture, valid_count = weighted_mean(soil_moisture, cells)
+        if average_moisture is None:
+            logging.warning("No valid soil moisture data found within the polygon")
+            return None, None
+
+        logging.info(f"Found {valid_count} valid cells inside the polygon")
+        logging.info(f"Average soil moisture: {average_moisture:.4f}")
+        return average_moisture, Polygon(polygon)
 
     except Exception as e:
         logging.error(f"Error extracting soil moisture data: {e}")
         logging.error("Traceback: ", exc_info=True)
         return None, None
 
+def get_granule_date(hdf_file):
+    """
+    Parse the acquisition date from a SMAP L3 file name (e.g. SMAP_L3_SM_P_E_20200101_R18290_001.h5).
+    """
+    match = re.search(r'_(\d{8})_', os.path.basename(hdf_file))
+    if not match:
+        return None
+    return datetime.datetime.strptime(match.group(1), '%Y%m%d').date()
+
+def extract_basin_soil_moisture(hdf_file, basin_ids, cells, basin_index):
+    """
+    Extract AM, PM and combined soil moisture for every basin from a single granule.
+    Each retrieval's union hyperslab is read once and reduced per basin in one vectorized pass;
+    the combined value pools the valid cells of both retrievals, and Valid Cells counts the cells
+    behind it (valid in AM or PM) once each. Runs in a worker process.
+    A granule that cannot be read returns no rows, so its day stays missing and is fetched again;
+    only a readable granule with every cell QA-masked yields NaN rows with Valid Cells == 0.
+    """
+    n_basins = len(basin_ids)
+    date = get_granule_date(hdf_file)
+    _, _, weights = cells
+    results = {}
+    # Cells valid in either retrieval: the cells behind the combined value, each counted once
+    valid_any = np.zeros(len(weights), dtype=bool)
+    try:
+        with h5py.File(hdf_file, 'r') as file:
+            for time_of_day, (group, field) in SMAP_RETRIEVALS.items():
+                if f'{group}/{field}' in file:
+                    values = read_cell_values(file[f'{group}/{field}'], cells)
+                    results[time_of_day] = basin_weighted_sums(values, weights, basin_index, n_basins, SMAP_FILL_VALUE)
+                    valid_any |= np.isfinite(values) & (values != SMAP_FILL_VALUE)
+    except Exception as e:
+        logging.error(f"Error extracting soil moisture from {hdf_file}: {e}")
+        return []
+    if not results:
+        logging.error(f"No soil moisture retrieval found in {hdf_file}")
+        return []
+
+    empty = (np.zeros(n_basins), np.zeros(n_basins), np.zeros(n_basins, dtype=int))
+    sums = {tod: results.get(tod, empty) for tod in SMAP_RETRIEVALS}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = {tod: s / w for tod, (s, w, _) in sums.items()}
+        combined = sum(s for s, _, _ in sums.values()) / sum(w for _, w, _ in sums.values())
+    valid_cells = np.bincount(basin_index, weights=valid_any, minlength=n_basins).astype(int)
+
+    rows = []
+    for i, basin_id in enumerate(basin_ids):
+        row = {'huc_id': basin_id, 'Date': date}
+        for time_of_day in SMAP_RETRIEVALS:
+            row[f'Soil Moisture {time_of_day}'] = float(means[time_of_day][i])
+        row['Soil Moisture'] = float(combined[i])
+        row['Valid Cells'] = int(valid_cells[i])
+        rows.append(row)
+    return rows
+
+def get_daily_soil_moisture_multi(start_date, end_date, auth, basin_polygons, download_threads=4, max_workers=None, cache=None,
+                                  fill_missing_days=True):
+    """
+    Build daily soil moisture series for many basins ({huc_id: simplified polygon}).
+    Each granule is searched, downloaded and opened once for all basins; downloads run in
+    cache-sized batches that overlap with extraction of the previous batch. Returns a long
+    DataFrame with one row per basin and day (only days with a granule when fill_missing_days=False).
+    """
+    columns = ['huc_id', 'Date'] + SMAP_SERIES_COLUMNS
+    basin_cells = {huc_id: get_cell_weights(polygon, huc_id=huc_id) for huc_id, polygon in basin_polygons.items()}
+    if not any(len(c[0]) for c in basin_cells.values()):
+        logging.error("No basin covers any EASE-2 cells")
+        return pd.DataFrame(columns=columns)
+    basin_ids, cells, basin_index = stack_cell_weights(basin_cells)
+
+    # One search over the combined extent of all basins
+    all_points = [point for polygon in basin_polygons.values() for point in polygon]
+    granules = search_smap_granules(start_date, end_date, auth, all_points)
+    if not granules:
+        return pd.DataFrame(columns=columns)
+
+    # Download batch by batch and extract each batch while the next one downloads; the cache
+    # keeps the batch being extracted pinned, so disk use stays within its budget
+    cache = cache or get_granule_cache()
+    rows = []
+    available = 0
+    pending = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for _, paths in cache.fetch_batches(granules, threads=download_threads):
+            files = [f for f in paths if f]
+            available += len(files)
+            submitted = [executor.submit(extract_basin_soil_moisture, f, basin_ids, cells, basin_index) for f in files]
+            for future in pending:
+                rows.extend(future.result())
+            pending = submitted
+        for future in pending:
+            rows.extend(future.result())
+    logging.info(f"{available} of {len(granules)} granules available locally and extracted")
+
+    return build_daily_series(rows, basin_ids, start_date, end_date, fill_missing_days=fill_missing_days)
+
+def get_daily_soil_moisture(start_date, end_date, auth, simplified_polygon, huc_id=None, download_threads=4, max_workers=None, cache=None):
+    """
+    Build a daily basin-mean soil moisture series for a single polygon.
+    Returns a DataFrame with one row per day in the range.
+    """
+    huc_id = huc_id or 'basin'
+    series = get_daily_soil_moisture_multi(start_date, end_date, auth, {huc_id: simplified_polygon},
+                                           download_threads=download_threads, max_workers=max_workers, cache=cache)
+    return series.drop(columns=['huc_id'])
+
+def build_daily_series(rows, basin_ids, start_date, end_date, fill_missing_days=True):
+    """
+    Collapse per-granule rows into one row per basin and day. With fill_missing_days the full
+    date range is returned (days without a granule are NaN); otherwise only granule days are.
+    """
+    series = pd.DataFrame(rows, columns=['huc_id', 'Date'] + SMAP_SERIES_COLUMNS).dropna(subset=['Date'])
+    series['Date'] = pd.to_datetime(series['Date'])
+    # Reprocessed granules can share a date; keep the mean of their values
+    series = series.groupby(['huc_id', 'Date']).mean()
+    dates = pd.date_range(start_date, end_date, freq='D') if fill_missing_days else series.index.get_level_values('Date').unique().sort_values()
+    full_index = pd.MultiIndex.from_product([basin_ids, dates], names=['huc_id', 'Date'])
+    series = series.reindex(full_index)
+    series['Valid Cells'] = series['Valid Cells'].fillna(0).astype(int)
+    return series.reset_index()
+
+def missing_date_runs(dates):
+    """
+    Group dates into contiguous (first, last) runs.
+    """
+    runs = []
+    for date in sorted(dates):
+        if runs and date - runs[-1][1] == datetime.timedelta(days=1):
+            runs[-1][1] = date
+        else:
+            runs.append([date, date])
+    return [tuple(run) for run in runs]
+
+def update_soil_moisture_store(start_date, end_date, auth, basin_polygons, **kwargs):
+    """
+    Bring the derived per-HUC soil moisture store up to date over the date range.
+    Only the contiguous runs of days missing for some basin are searched and extracted; days
+    whose granule was fully QA-masked are stored too, so they are not fetched again. The granules
+    themselves are not kept beyond the shared cache. Returns the number of rows added.
+    """
+    wanted = set(pd.date_range(start_date, end_date, freq='D').date)
+    missing = set()
+    for huc_id in basin_polygons:
+        missing |= wanted - smap_store.stored_dates(huc_id)
+    if not missing:
+        logging.info("Soil moisture store is already up to date")
+        return 0
+
+    runs = missing_date_runs(missing)
+    logging.info(f"Updating soil moisture store for {len(missing)} missing days in {len(runs)} runs")
+    written = 0
+    for first, last in runs:
+        series = get_daily_soil_moisture_multi(first, last, auth, basin_polygons, fill_missing_days=False, **kwargs)
+        written += smap_store.append_series(series)
+    return written
+
 # Add this function to check data availability in the polygon area
 def check_data_availability(hdf_file, polygon):
     try:
@@ -283,10 +393,29 @@ def visualize_smap_and_polygon(hdf_file, polygon):
     except Exception as e:
         logging.error(f"Error visualizing SMAP data and polygon: {e}")
 
-def main(start_date, end_date, lat, lon, visual):
+def main_all_sites(start_date, end_date, site_ids_file=None):
+    """
+    Daily soil moisture for every basin in site_ids.txt, reading each granule once.
+    Results are kept in the per-HUC store that combine_data joins from.
+    """
+    load_vars()
+    auth = get_earthdata_auth()
+    basin_polygons, site_hucs = get_site_basins(get_site_ids(site_ids_file))
+    if not basin_polygons:
+        logging.error("No basins resolved for the configured sites")
+        return None
+    logging.info(f"Resolved {len(site_hucs)} sites to {len(basin_polygons)} HUC8 basins")
+    save_site_hucs(site_hucs)
+    update_soil_moisture_store(start_date, end_date, auth, basin_polygons)
+    series = smap_store.read_soil_moisture(list(basin_polygons), start_date, end_date)
+    logging.info(f"Daily soil moisture for all basins:\n{series}")
+    return series
+
+def main(start_date, end_date, lat, lon, visual, daily=False):
+    load_vars()
     auth = get_earthdata_auth()
 
-    huc8_polygon = get_huc_polygon(lat, lon, huc_level=8)
+    huc8_polygon, huc_id, _ = get_huc_polygon(lat, lon, huc_level=8)
     if not huc8_polygon:
         logging.error("Failed to retrieve HUC8 polygon")
         return
@@ -294,37 +423,44 @@ def main(start_date, end_date, lat, lon, visual):
     simplified_polygon = simplify_polygon(huc8_polygon)
     logging.info(f"Simplified polygon coordinates: {simplified_polygon}")
 
-    downloaded_file, temp_dir = search_and_download_smap_data(start_date, end_date, auth, simplified_polygon)
+    if daily:
+        series = get_daily_soil_moisture(start_date, end_date, auth, simplified_polygon, huc_id=huc_id)
+        logging.info(f"Daily soil moisture for HUC8 {huc_id}:\n{series}")
+        return series
+
+    # The granule stays in the shared cache for other sites and later runs
+    downloaded_file = search_and_download_smap_data(start_date, end_date, auth, simplified_polygon)
     
-    if downloaded_file and temp_dir:
-        try:
-            # Visualize SMAP data and polygon
-            visualize_smap_and_polygon(downloaded_file, simplified_polygon)
-            
-            # Extract soil moisture data
-            average_soil_moisture, used_polygon = extract_soil_moisture(downloaded_file, simplified_polygon)
-            
-            if average_soil_moisture is not None:
-                logging.info(f"Average soil moisture: {average_soil_moisture:.4f}")
-                if visual and matplotlib_available:
-                    pass
-                    #visualize_soil_moisture_simple(used_polygon, average_soil_moisture)
-            else:
-                logging.error("Failed to calculate soil moisture.")
-            
-        finally:
-            # Clean up: remove the temporary directory
-            shutil.rmtree(temp_dir)
-            logging.info(f"Removed temporary directory: {temp_dir}")
+    if downloaded_file:
+        # Visualize SMAP data and polygon
+        visualize_smap_and_polygon(downloaded_file, simplified_polygon)
+        
+        # Extract soil moisture data
+        average_soil_moisture, used_polygon = extract_soil_moisture(downloaded_file, simplified_polygon, huc_id=huc_id)
+        
+        if average_soil_moisture is not None:
+            logging.info(f"Average soil moisture: {average_soil_moisture:.4f}")
+            if visual and matplotlib_available:
+                pass
+                #visualize_soil_moisture_simple(used_polygon, average_soil_moisture)
+        else:
+            logging.error("Failed to calculate soil moisture.")
     else:
         logging.error("Failed to find or download SMAP data")
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Calculate average soil moisture for a HUC8 polygon from SMAP L3 data.')
     parser.add_argument('--start-date', type=lambda d: datetime.datetime.strptime(d, '%Y-%m-%d').date(), required=True, help='Start Date in YYYY-MM-DD format')
     parser.add_argument('--end-date', type=lambda d: datetime.datetime.strptime(d, '%Y-%m-%d').date(), required=True, help='End Date in YYYY-MM-DD format')
-    parser.add_argument('--lat', type=float, required=True, help='Latitude of the point within the desired HUC8 polygon')
-    parser.add_argument('--lon', type=float, required=True, help='Longitude of the point within the desired HUC8 polygon')
+    parser.add_argument('--lat', type=float, help='Latitude of the point within the desired HUC8 polygon')
+    parser.add_argument('--lon', type=float, help='Longitude of the point within the desired HUC8 polygon')
     parser.add_argument('--visual', action='store_true', help='Enable matplotlib visualization')
+    parser.add_argument('--daily', action='store_true', help='Build a daily soil moisture series from every granule in the range')
+    parser.add_argument('--all-sites', action='store_true', help='Daily series for every basin in site_ids.txt (ignores --lat/--lon)')
     args = parser.parse_args()
 
-    main(args.start_date, args.end_date, args.lat, args.lon, args.visual)
\ No newline at end of file
+    if args.all_sites:
+        main_all_sites(args.start_date, args.end_date)
+    elif args.lat is None or args.lon is None:
+        parser.error("--lat and --lon are required unless --all-sites is given")
+    else:
+        main(args.start_date, args.end_date, args.lat, args.lon, args.visual, args.daily)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import logging
+import os
+import uuid
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dataUtils.data_utils import get_cache_dir
+
+'''
+Append-only store of derived daily soil moisture per HUC.
+
+Once a granule has been reduced to basin means there is no reason to keep the HDF5 around.
+Values are kept as float32 in Parquet files partitioned by huc_id (huc_id=<id>/part-*.parquet),
+together with the number of valid EASE-2 cells behind each value. New days are appended as new
+part files, and combine_data reads any date range from here without touching HDF5 again.
+'''
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STORE_SCHEMA = pa.schema([
+    ("Date", pa.date32()),
+    ("Soil Moisture AM", pa.float32()),
+    ("Soil Moisture PM", pa.float32()),
+    ("Soil Moisture", pa.float32()),
+    ("Valid Cells", pa.int32()),
+])
+
+def get_store_dir(store_dir=None):
+    return store_dir or get_cache_dir("smap_store")
+
+def _huc_dir(store_dir, huc_id):
+    return os.path.join(store_dir, f"huc_id={huc_id}")
+
+def stored_dates(huc_id, store_dir=None):
+    """
+    Dates already present in the store for a HUC.
+    """
+    huc_dir = _huc_dir(get_store_dir(store_dir), huc_id)
+    if not os.path.isdir(huc_dir):
+        return set()
+    table = pq.read_table(huc_dir, columns=["Date"], memory_map=True)
+    return set(table.column("Date").to_pylist())
+
+def append_series(series, store_dir=None):
+    """
+    Append a long daily series (huc_id, Date, soil moisture columns) to the store.
+    Days whose granule had no valid cell over the basin (QA-masked, e.g. frozen ground) are kept
+    as NaN rows with Valid Cells == 0 so they count as covered. Days already stored are skipped,
+    so re-running over an overlapping range never duplicates rows. Returns the number of rows written.
+    """
+    store_dir = get_store_dir(store_dir)
+    if series.empty:
+        return 0
+
+    series = series.dropna(subset=["Date"]).copy()
+    series["Date"] = pd.to_datetime(series["Date"]).dt.date
+    written = 0
+    for huc_id, rows in series.groupby("huc_id"):
+        rows = rows[~rows["Date"].isin(stored_dates(huc_id, store_dir))]
+        if rows.empty:
+            continue
+        table = pa.Table.from_pandas(rows[STORE_SCHEMA.names], schema=STORE_SCHEMA, preserve_index=False)
+        huc_dir = _huc_dir(store_dir, huc_id)
+        os.makedirs(huc_dir, exist_ok=True)
+        part_name = f"part-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        pq.write_table(table, os.path.join(huc_dir, part_name), compression="zstd")
+        written += len(rows)
+        logging.info(f"Stored {len(rows)} new days of soil moisture for HUC {huc_id}")
+    return written
+
+def read_soil_moisture(huc_ids=None, start_date=None, end_date=None, store_dir=None):
+    """
+    Read stored daily soil moisture as a DataFrame (huc_id, Date, ...), optionally limited to
+    some HUCs and a date range. The filters are pushed down to the Parquet reader.
+    """
+    store_dir = get_store_dir(store_dir)
+    columns = ["huc_id"] + STORE_SCHEMA.names
+    if not any(name.startswith("huc_id=") for name in os.listdir(store_dir)):
+        return pd.DataFrame(columns=columns)
+
+    filters = []
+    if huc_ids is not None:
+        filters.append(("huc_id", "in", [str(h) for h in huc_ids]))
+    if start_date is not None:
+        filters.append(("Date", ">=", pd.Timestamp(start_date).date()))
+    if end_date is not None:
+        filters.append(("Date", "<=", pd.Timestamp(end_date).date()))
+
+    partitioning = ds.partitioning(pa.schema([("huc_id", pa.string())]), flavor="hive")
+    table = pq.read_table(store_dir, filters=filters or None, memory_map=True, partitioning=partitioning)
+    frame = table.to_pandas()
+    frame["huc_id"] = frame["huc_id"].astype(str)
+    frame["Date"] = pd.to_datetime(frame["Date"])
+    return frame[columns].sort_values(["huc_id", "Date"]).reset_index(drop=True)
+
+def compact(huc_id, store_dir=None):
+    """
+    Rewrite a HUC's part files as a single sorted file (optional housekeeping for long-lived stores).
+    """
+    huc_dir = _huc_dir(get_store_dir(store_dir), huc_id)
+    parts = [os.path.join(huc_dir, f) for f in os.listdir(huc_dir) if f.endswith(".parquet")]
+    if len(parts) <= 1:
+        return
+    table = pq.read_table(huc_dir, schema=STORE_SCHEMA).sort_by("Date")
+    compacted = os.path.join(huc_dir, f"part-{datetime.now().strftime('%Y%m%d%H%M%S')}-compact.parquet")
+    pq.write_table(table, compacted, compression="zstd")
+    for part in parts:
+        os.remove(part)
@@ -21,6 +21,7 @@ def fetch_all_table_names():
     else:
         return f"Failed to fetch table names: {response.text}"
 
-# Execute the function to get all table names
-result = fetch_all_table_names()
-print(result)
+if __name__ == "__main__":
+    # Execute the function to get all table names
+    result = fetch_all_table_names()
+    print(result)
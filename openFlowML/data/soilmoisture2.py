@@ -1,91 +1,229 @@
-import asyncio
+import os
+import re
+import calendar
 import xarray as xr
 import pandas as pd
+import numpy as np
 from shapely.geometry import Polygon
-from pyproj import CRS
 import fsspec
 import dask
-from dask.distributed import Client
 import argparse
 import logging
-from dataUtils.get_poly import get_huc8_polygon, simplify_polygon
+from contextlib import ExitStack, contextmanager
+from dataUtils.get_poly import get_huc_polygon, simplify_polygon
+from dataUtils.data_utils import get_cache_dir
+from dataUtils.zonal import compute_pixel_weights, polygon_key
+
+'''
+Lazy loader for CPC soil moisture over a HUC polygon.
+
+Files of a local or fsspec-mounted mirror are selected by the dates in their names before any
+of them is opened, then opened together with open_mfdataset (chunked, nothing read yet). The
+dataset is cut to the polygon's bounding box first and reduced with fractional pixel weights, so
+only that small window is ever read, using dask's threaded scheduler. Per-HUC series are cached
+in Zarr and extended incrementally: later calls only load the dates that are not cached yet,
+including gaps left inside the cached span by an earlier failed fetch.
+Reading the default gs:// mirror needs gcsfs.
+'''
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-async def fetch_soil_moisture_data(polygon: Polygon, date_range: pd.date_range) -> xr.Dataset:
-    """
-    Asynchronously fetch CPC soil moisture data for a given polygon and date range.
-    
-    Args:
-    polygon (Polygon): Shapely Polygon object defining the area of interest
-    date_range (pd.date_range): Date range for data retrieval
-    
-    Returns:
-    xr.Dataset: Dataset containing soil moisture data for the specified region and time
-    """
-    # CPC soil moisture data is available via Google Cloud Storage
-    gcs_url = "gs://noaa-cpc-pds/soil-moisture/"
-    
-    async with fsspec.open_files(gcs_url + "*.nc", mode='rb') as files:
-        datasets = [xr.open_dataset(file, engine='h5netcdf', chunks={'time': 'auto'}) 
-                    for file in files if file.start.date() in date_range]
-    
-    combined_data = xr.concat(datasets, dim='time')
-    
-    # Ensure CRS matches the polygon CRS (assuming WGS84)
-    data_crs = CRS.from_epsg(4326)
-    combined_data = combined_data.rio.write_crs(data_crs)
-    
-    # Clip data to polygon
-    clipped_data = combined_data.rio.clip([polygon], all_touched=True)
-    
-    return clipped_data
-
-async def process_soil_moisture_data(data: xr.Dataset) -> pd.DataFrame:
-    """
-    Process the retrieved soil moisture data.
-    
-    Args:
-    data (xr.Dataset): Dataset containing soil moisture data
-    
-    Returns:
-    pd.DataFrame: Processed soil moisture data
-    """
-    # Example processing - adjust as needed
-    mean_moisture = data['soilw'].mean(dim=['lat', 'lon'])
-    return mean_moisture.to_dataframe()
-
-async def main(lat: float, lon: float, start_date: str, end_date: str):
-    # Set up dask client for parallel processing
-    client = Client(n_workers=4, threads_per_worker=2, memory_limit='4GB')
-    
+# CPC soil moisture mirror (public bucket, listed through gcsfs); a local directory works too
+DEFAULT_SOURCE = os.getenv("OPENFLOW_CPC_SOIL_MOISTURE_URL", "gs://noaa-cpc-pds/soil-moisture/")
+VARIABLE = "soilw"
+
+def file_period(path):
+    """
+    (first_day, last_day) covered by a file according to the YYYYMMDD, YYYYMM or YYYY in its name,
+    or None when the name carries no date.
+    """
+    name = os.path.basename(path)
+    match = re.search(r"(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)", name)
+    if match:
+        day = pd.Timestamp(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        return day, day
+    match = re.search(r"(?<!\d)(\d{4})[-_]?(\d{2})(?!\d)", name)
+    if match and 1 <= int(match.group(2)) <= 12:
+        year, month = int(match.group(1)), int(match.group(2))
+        return pd.Timestamp(year, month, 1), pd.Timestamp(year, month, calendar.monthrange(year, month)[1])
+    match = re.search(r"(?<!\d)(\d{4})(?!\d)", name)
+    if match:
+        year = int(match.group(1))
+        return pd.Timestamp(year, 1, 1), pd.Timestamp(year, 12, 31)
+    return None
+
+def select_files(source, start_date, end_date):
+    """
+    NetCDF files under source whose dates overlap [start_date, end_date], found by listing only.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    # The public NOAA bucket needs no credentials; skip gcsfs's credential lookup
+    storage_options = {"token": "anon"} if str(source).startswith("gs://") else {}
+    fs, _, (root,) = fsspec.get_fs_token_paths(source, storage_options=storage_options)
+    paths = sorted(fs.glob(root.rstrip("/") + "/**/*.nc"))
+    selected = []
+    for path in paths:
+        period = file_period(path)
+        if period is None or (period[0] <= end and period[1] >= start):
+            selected.append(path)
+    logging.info(f"Selected {len(selected)} of {len(paths)} files for {start_date} - {end_date}")
+    return fs, selected
+
+@contextmanager
+def open_soil_moisture(source, start_date, end_date):
+    """
+    Lazily open the selected files as one dataset restricted to the date range (None when no
+    file matches). The dataset and any remote file handles are closed when the block exits.
+    """
+    fs, paths = select_files(source, start_date, end_date)
+    if not paths:
+        yield None
+        return
+    protocols = fs.protocol if isinstance(fs.protocol, tuple) else (fs.protocol,)
+    with ExitStack() as stack:
+        if "file" in protocols:
+            files = paths
+        else:
+            files = [stack.enter_context(fs.open(path, mode="rb")) for path in paths]
+        ds = stack.enter_context(xr.open_mfdataset(files, engine="h5netcdf", combine="by_coords", chunks={"time": "auto"},
+                                                   data_vars="minimal", coords="minimal", compat="override"))
+        yield ds.sel(time=slice(pd.Timestamp(start_date), pd.Timestamp(end_date)))
+
+def subset_bbox(ds, polygon, pad=1):
+    """
+    Cut the dataset to the polygon's bounding box (plus pad cells) before any pixel is read.
+    Handles 0-360 longitudes and descending latitudes. Returns (subset, polygon in dataset longitudes).
+    """
+    coords = [(float(x), float(y)) for x, y in Polygon(polygon).exterior.coords]
+    if float(ds.lon.max()) > 180:
+        coords = [(x % 360, y) for x, y in coords]
+    minx, miny, maxx, maxy = Polygon(coords).bounds
+    dlon = abs(float(ds.lon[1] - ds.lon[0]))
+    dlat = abs(float(ds.lat[1] - ds.lat[0]))
+    lat_slice = slice(miny - pad * dlat, maxy + pad * dlat)
+    if ds.lat[0] > ds.lat[-1]:
+        lat_slice = slice(lat_slice.stop, lat_slice.start)
+    return ds.sel(lon=slice(minx - pad * dlon, maxx + pad * dlon), lat=lat_slice), coords
+
+def polygon_mean(da, polygon_coords):
+    """
+    Area-weighted mean over the polygon for every time step of a (time, lat, lon) DataArray.
+    """
+    lon, lat = da.lon.values, da.lat.values
+    dlon, dlat = float(lon[1] - lon[0]), float(lat[1] - lat[0])
+    transform = (dlon, 0.0, float(lon[0]) - dlon / 2, 0.0, dlat, float(lat[0]) - dlat / 2)
+    rows, cols, weights = compute_pixel_weights(polygon_coords, transform, (len(lat), len(lon)), "EPSG:4326")
+    if len(rows) == 0:
+        logging.warning("Polygon does not overlap the soil moisture grid")
+        return pd.Series(np.nan, index=pd.DatetimeIndex(da.time.values), name=da.name)
+
+    values = da.transpose("time", "lat", "lon").values[:, rows, cols]
+    valid = np.isfinite(values)
+    w = np.where(valid, weights, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (np.where(valid, values, 0.0) * w).sum(axis=1) / w.sum(axis=1)
+    return pd.Series(means, index=pd.DatetimeIndex(da.time.values), name=da.name)
+
+def load_polygon_series(polygon, start_date, end_date, source=None, variable=VARIABLE, scheduler="threads"):
+    """
+    Polygon-mean soil moisture between two dates, loaded lazily from the mirror.
+    """
+    with open_soil_moisture(source or DEFAULT_SOURCE, start_date, end_date) as ds:
+        if ds is None:
+            return pd.Series(dtype="float64", name=variable)
+        subset, coords = subset_bbox(ds[[variable]], polygon)
+        with dask.config.set(scheduler=scheduler):
+            da = subset[variable].load()
+    return polygon_mean(da, coords)
+
+def _cache_path(polygon, huc_id, cache_dir):
+    return os.path.join(cache_dir or get_cache_dir("cpc_soil_moisture"), f"{huc_id or polygon_key(polygon)}.zarr")
+
+def _write_span(store, new):
+    """
+    Add newly loaded days to the Zarr store. Days after the cached span are appended; earlier
+    days cannot be (append_dim only adds at the end), so the store is merged, sorted and rewritten.
+    """
+    if not os.path.exists(store):
+        new.to_zarr(store, mode="w")
+        return
+    with xr.open_zarr(store) as cached:
+        append = new.time.values.min() > cached.time.values.max()
+        if not append:
+            cached = cached.load()
+    if append:
+        new.to_zarr(store, append_dim="time")
+        return
+    merged = xr.concat([cached, new], dim="time").sortby("time")
+    merged = merged.isel(time=~merged.get_index("time").duplicated())
+    for var in merged.variables.values():
+        var.encoding = {}
+    merged.to_zarr(store, mode="w")
+
+def missing_spans(cached_dates, start, end):
+    """
+    (first, last) spans of [start, end] the cache does not cover: before and after the cached
+    dates, and gaps inside them (e.g. from an earlier failed fetch), i.e. consecutive cached
+    dates more than one and a half of the series' usual step apart.
+    """
+    one_day = pd.Timedelta(days=1)
+    if len(cached_dates) == 0:
+        return [(start, end)]
+    dates = pd.DatetimeIndex(cached_dates).sort_values()
+    spans = [(start, dates[0] - one_day)]
+    if len(dates) > 1:
+        steps = dates[1:] - dates[:-1]
+        for previous, step, following in zip(dates[:-1], steps, dates[1:]):
+            if step > 1.5 * steps.median():
+                spans.append((previous + one_day, following - one_day))
+    spans.append((dates[-1] + one_day, end))
+    spans = [(max(start, s), min(end, e)) for s, e in spans]
+    return [(s, e) for s, e in spans if s <= e]
+
+def get_soil_moisture_series(polygon, start_date, end_date, huc_id=None, source=None, variable=VARIABLE,
+                             scheduler="threads", cache_dir=None):
+    """
+    Polygon-mean CPC soil moisture as a Series indexed by date. Results are cached per HUC in
+    Zarr; only dates the cache does not cover (see missing_spans) are loaded from the mirror.
+    """
+    store = _cache_path(polygon, huc_id, cache_dir)
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    cached_dates = []
+    if os.path.exists(store):
+        with xr.open_zarr(store) as ds:
+            cached_dates = ds.get_index("time")
+
+    missing = missing_spans(cached_dates, start, end)
+    for span_start, span_end in missing:
+        series = load_polygon_series(polygon, span_start, span_end, source=source, variable=variable, scheduler=scheduler)
+        if series.empty:
+            continue
+        new = series.rename_axis("time").to_frame(variable).to_xarray()
+        _write_span(store, new)
+        logging.info(f"Cached {len(series)} new days in {store}")
+
+    if not os.path.exists(store):
+        return pd.Series(dtype="float64", name=variable)
+    with xr.open_zarr(store) as ds:
+        result = ds[variable].to_series().sort_index()
+    result = result[~result.index.duplicated()]
+    return result.loc[start:end]
+
+def main(lat: float, lon: float, start_date: str, end_date: str, source=None):
     # Get HUC8 polygon
-    huc8_polygon = get_huc8_polygon(lat, lon)
+    huc8_polygon, huc_id, _ = get_huc_polygon(lat, lon, 8)
     if not huc8_polygon:
         logging.error("No HUC8 polygon found")
-        await client.close()
-        return
+        return None
 
     # Simplify the polygon
     simplified_polygon = simplify_polygon(huc8_polygon)
     logging.info(f"Simplified polygon: {simplified_polygon}")
 
-    # Conve
-    # rt to Shapely Polygon
-    polygon = Polygon(simplified_polygon)
-
-    date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-    
-    data = await fetch_soil_moisture_data(polygon, date_range)
-    
-    # Process data using dask for parallelization
-    processed_data = await dask.compute(process_soil_moisture_data(data))[0]
-    
-    print(processed_data)
-    
-    # Clean up dask client
-    await client.close()
+    series = get_soil_moisture_series(simplified_polygon, start_date, end_date, huc_id=huc_id, source=source)
+    logging.info(f"Soil moisture for HUC8 {huc_id}:\n{series}")
+    return series
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Fetch soil moisture data for HUC8 polygon based on lat/lon.')
@@ -93,6 +231,7 @@ if __name__ == "__main__":
     parser.add_argument('--lon', type=float, required=True, help='Longitude')
     parser.add_argument('--start_date', type=str, required=True, help='Start date (YYYY-MM-DD)')
     parser.add_argument('--end_date', type=str, required=True, help='End date (YYYY-MM-DD)')
+    parser.add_argument('--source', type=str, help='Local directory or fsspec URL of the CPC soil moisture mirror')
     args = parser.parse_args()
 
-    asyncio.run(main(args.lat, args.lon, args.start_date, args.end_date))
\ No newline at end of file
+    main(args.lat, args.lon, args.start_date, args.end_date, args.source)
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+from rasterio.warp import reproject, Resampling
+from rasterio.windows import Window
+from affine import Affine
+from dataUtils.data_utils import get_cache_dir
+from dataUtils.zonal import get_pixel_weights, cells_window, offset_cells, zonal_stats
+
+'''
+Local cube of VegDRI scenes as Cloud-Optimized GeoTIFFs.
+
+Each downloaded VEGDRI_<date>.zip is unpacked once, resampled onto one fixed 1 km CONUS Albers
+grid and written as a tiled, DEFLATE-compressed COG (one file per date). A JSON date index maps
+dates to files. Because every scene shares the grid, a HUC's pixel weights are computed once and
+a zonal query over any date range is a series of small windowed reads against local files.
+'''
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Fixed CONUS Albers (EPSG:5070) grid at VegDRI's native 1 km
+CUBE_CRS = "EPSG:5070"
+CUBE_RESOLUTION = 1000.0
+CUBE_ORIGIN_X = -2400000.0
+CUBE_ORIGIN_Y = 3200000.0
+CUBE_SHAPE = (3000, 4700)
+CUBE_TRANSFORM = Affine(CUBE_RESOLUTION, 0.0, CUBE_ORIGIN_X, 0.0, -CUBE_RESOLUTION, CUBE_ORIGIN_Y)
+CUBE_NODATA = -9999.0
+CUBE_BLOCK_SIZE = 512
+INDEX_FILE = "index.json"
+RASTER_EXTENSIONS = (".tif", ".tiff", ".img")
+
+def get_cube_dir(cube_dir=None):
+    return cube_dir or get_cache_dir("vegdri_cube")
+
+def load_index(cube_dir=None):
+    """
+    {YYYY-MM-DD: COG file name} for every ingested scene.
+    """
+    path = os.path.join(get_cube_dir(cube_dir), INDEX_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def register_scene(date, filename, cube_dir=None):
+    cube_dir = get_cube_dir(cube_dir)
+    index = load_index(cube_dir)
+    index[date] = filename
+    path = os.path.join(cube_dir, INDEX_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def scene_date(zip_path):
+    """
+    Acquisition date (YYYY-MM-DD) from a VEGDRI_<date>.zip file name.
+    """
+    match = re.search(r"(\d{4}-\d{2}-\d{2})", os.path.basename(zip_path))
+    return match.group(1) if match else None
+
+def write_cog(data, path):
+    """
+    Write a grid-shaped float32 array as a tiled, compressed COG on the cube grid.
+    """
+    profile = {
+        "driver": "GTiff", "height": CUBE_SHAPE[0], "width": CUBE_SHAPE[1], "count": 1, "dtype": "float32",
+        "crs": CUBE_CRS, "transform": CUBE_TRANSFORM, "nodata": CUBE_NODATA,
+    }
+    tmp_path = path + ".tmp"
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data.astype(np.float32), 1)
+        rasterio.shutil.copy(memfile.name, tmp_path, driver="COG", compress="DEFLATE", predictor=2,
+                             blocksize=CUBE_BLOCK_SIZE, overviews="NONE")
+    os.replace(tmp_path, path)
+
+def ingest_scene(zip_path, date=None, cube_dir=None):
+    """
+    Unpack one VegDRI archive, resample its raster onto the cube grid and write it as a COG.
+    Returns the COG path, or None if the archive holds no raster.
+    """
+    cube_dir = get_cube_dir(cube_dir)
+    date = date or scene_date(zip_path)
+    if date is None:
+        logging.error(f"Cannot tell the acquisition date of {zip_path}")
+        return None
+
+    with zipfile.ZipFile(zip_path) as archive:
+        members = [name for name in archive.namelist() if name.lower().endswith(RASTER_EXTENSIONS)]
+    if not members:
+        logging.error(f"No raster found in {zip_path}")
+        return None
+
+    data = np.full(CUBE_SHAPE, CUBE_NODATA, dtype=np.float32)
+    with rasterio.open(f"zip://{os.path.abspath(zip_path)}!/{members[0]}") as src:
+        reproject(
+            source=rasterio.band(src, 1),
+            destination=data,
+            src_nodata=src.nodata,
+            dst_transform=CUBE_TRANSFORM,
+            dst_crs=CUBE_CRS,
+            dst_nodata=CUBE_NODATA,
+            resampling=Resampling.nearest,
+        )
+
+    filename = f"vegdri_{date}.tif"
+    write_cog(data, os.path.join(cube_dir, filename))
+    register_scene(date, filename, cube_dir)
+    logging.info(f"Ingested {os.path.basename(zip_path)} as {filename}")
+    return os.path.join(cube_dir, filename)
+
+def ingest_directory(download_dir, cube_dir=None):
+    """
+    Ingest every VegDRI archive in a download directory that is not in the date index yet.
+    Dates come from get_vegdri2's manifest when present, otherwise from the file names.
+    """
+    cube_dir = get_cube_dir(cube_dir)
+    indexed = load_index(cube_dir)
+    manifest_path = os.path.join(download_dir, "manifest.json")
+    dates = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for entry in json.load(f).values():
+                if entry.get("acquisitionDate"):
+                    dates[entry["filename"]] = str(entry["acquisitionDate"])[:10]
+
+    ingested = []
+    for filename in sorted(os.listdir(download_dir)):
+        if not filename.lower().endswith(".zip"):
+            continue
+        date = dates.get(filename) or scene_date(filename)
+        if date in indexed:
+            continue
+        try:
+            path = ingest_scene(os.path.join(download_dir, filename), date=date, cube_dir=cube_dir)
+        except Exception as e:
+            logging.error(f"Failed to ingest {filename}: {e}")
+            continue
+        if path:
+            ingested.append(path)
+    logging.info(f"Ingested {len(ingested)} new VegDRI scenes into {cube_dir}")
+    return ingested
+
+def query_cube(polygon, start_date, end_date, cube_dir=None, max_workers=4):
+    """
+    VegDRI zonal statistics (date, mean, min, max, count) for a (lon, lat) polygon over every
+    ingested scene between two YYYY-MM-DD dates, read from the local COGs.
+    """
+    cube_dir = get_cube_dir(cube_dir)
+    index = load_index(cube_dir)
+    dates = sorted(date for date in index if start_date <= date <= end_date)
+    columns = ["date", "mean", "min", "max", "count"]
+    if not dates:
+        logging.warning(f"No ingested VegDRI scenes between {start_date} and {end_date}")
+        return pd.DataFrame(columns=columns)
+
+    cells = get_pixel_weights(polygon, CUBE_TRANSFORM, CUBE_SHAPE, CUBE_CRS)
+    if len(cells[0]) == 0:
+        logging.warning("Polygon does not overlap the VegDRI grid")
+        return pd.DataFrame(columns=columns)
+    row_off, col_off, height, width = cells_window(cells)
+    window = Window(col_off, row_off, width, height)
+    window_cells = offset_cells(cells, row_off, col_off)
+
+    def read(date):
+        with rasterio.open(os.path.join(cube_dir, index[date])) as src:
+            data = src.read(1, window=window)
+        return {"date": date, **zonal_stats(data, window_cells, fill_value=CUBE_NODATA)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(read, dates))
+    return pd.DataFrame(rows, columns=columns)
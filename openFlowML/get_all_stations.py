@@ -1,6 +1,10 @@
-import json
+import argparse
+import ijson
 import requests
 import logging
+from datetime import datetime, timedelta, timezone
+import station_catalog
+from data.dataUtils.rdb import iter_rdb
 
 # Check if the root logger already has handlers (configured in another module)
 if not logging.getLogger().hasHandlers():
@@ -10,101 +14,172 @@ if not logging.getLogger().hasHandlers():
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
-def fetch_and_parse_station_data(url, data_source):
-    # Fetch the JSON data from the URL
-    response = requests.get(url)
-    json_data = response.text
-    
-    # Parse the JSON data
-    data = json.loads(json_data)
-    
-    # Create a list to store the parsed station data
-    parsed_stations = []
-    
-    if data_source == 'DWR':
-        stations = data['ResultList']
-        for station in stations:
-            parsed_station = {
-                'id': station.get('stationNum'),
-                'abbreviation': station.get('abbrev'),
-                'name': station.get('stationName'),
-                'latitude': station.get('latitude'),
-                'longitude': station.get('longitude'),
-                'usgs_site_id': station.get('usgsSiteId'),
-                'county': station.get('county'),
-                'state': station.get('state'),
-                'division': station.get('division'),
-                'water_district': station.get('waterDistrict'),
-                'data_source': station.get('dataSource'),
-                'start_date': station.get('startDate'),
-                'end_date': station.get('endDate'),
-                'measurement_unit': station.get('measUnit'),
-                'last_reading': None,
-                'last_reading_date': None
-            }
-            parsed_stations.append(parsed_station)
-    
-    elif data_source == 'USGS':
-        time_series_list = data['value']['timeSeries']
-        for time_series in time_series_list:
-            source_info = time_series['sourceInfo']
-            variable = time_series['variable']
-            values = time_series['values'][0]
-            
-            site_code = next((code['value'] for code in source_info['siteCode'] if code['agencyCode'] == 'USGS'), None)
-            
-            parsed_station = {
-                'id': site_code,
-                'abbreviation': None,
-                'name': source_info.get('siteName'),
-                'latitude': source_info['geoLocation']['geogLocation'].get('latitude'),
-                'longitude': source_info['geoLocation']['geogLocation'].get('longitude'),
-                'usgs_site_id': site_code,
-                'county': next((prop['value'] for prop in source_info['siteProperty'] if prop['name'] == 'countyCd'), None),
-                'state': next((prop['value'] for prop in source_info['siteProperty'] if prop['name'] == 'stateCd'), None),
-                'division': None,
-                'water_district': None,
-                'data_source': 'USGS',
-                'start_date': None,
-                'end_date': None,
-                'measurement_unit': variable['unit']['unitCode'],
-                'last_reading': values['value'][0]['value'] if values['value'] else None,
-                'last_reading_date': values['value'][0]['dateTime'] if values['value'] else None
-            }
-            parsed_stations.append(parsed_station)
-    
-    else:
-        logger.error(f"Unsupported data source: {data_source}. Use 'DWR' or 'USGS'.")
-        raise ValueError("Unsupported data source. Use 'DWR' or 'USGS'.")
-    
-    logger.info(f"Parsed {len(parsed_stations)} stations from {data_source}")
-    return parsed_stations
-
-def main():
-    dwr_url = "https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations/?format=json"
-    usgs_url = "https://waterservices.usgs.gov/nwis/iv/?format=json&stateCd=CO&parameterCd=00060&siteStatus=active"
-
-    logger.info("Fetching DWR station data...")
-    dwr_stations = fetch_and_parse_station_data(dwr_url, 'DWR')
-    logger.info("Fetching USGS station data...")
-    usgs_stations = fetch_and_parse_station_data(usgs_url, 'USGS')
-
-    # Combine the lists
-    all_stations = dwr_stations + usgs_stations
-
-    # Log examples and total count
-    logger.info("Example DWR station:")
-    logger.info(json.dumps(dwr_stations[0], indent=2))
-    logger.info("Example USGS station:")
-    logger.info(json.dumps(usgs_stations[0], indent=2))
-    logger.info(f"Total number of stations: {len(all_stations)}")
+# Fields kept per station; parsers fill one list per field instead of a dict per station
+STATION_COLUMNS = [
+    'id', 'abbreviation', 'name', 'latitude', 'longitude', 'usgs_site_id', 'county', 'state',
+    'division', 'water_district', 'data_source', 'start_date', 'end_date', 'measurement_unit',
+    'modified',
+]
+
+DWR_FIELDS = {
+    'stationNum': 'id',
+    'abbrev': 'abbreviation',
+    'stationName': 'name',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'usgsSiteId': 'usgs_site_id',
+    'county': 'county',
+    'state': 'state',
+    'division': 'division',
+    'waterDistrict': 'water_district',
+    'dataSource': 'data_source',
+    'startDate': 'start_date',
+    'endDate': 'end_date',
+    'measUnit': 'measurement_unit',
+    'modified': 'modified',
+}
+
+def new_columns():
+    return {column: [] for column in STATION_COLUMNS}
+
+def _start_row(columns, **values):
+    for column in STATION_COLUMNS:
+        columns[column].append(values.get(column))
+
+def column_rows(columns):
+    """
+    Iterate over parsed station columns one station dict at a time.
+    """
+    for values in zip(*(columns[column] for column in STATION_COLUMNS)):
+        yield dict(zip(STATION_COLUMNS, values))
+
+def parse_dwr_stream(events):
+    """
+    Station columns from the ijson events of a DWR surfacewaterstations reply.
+    """
+    columns = new_columns()
+    for prefix, event, value in events:
+        if prefix == 'ResultList.item' and event == 'start_map':
+            _start_row(columns)
+        elif prefix.startswith('ResultList.item.') and event not in ('start_map', 'start_array', 'end_map', 'end_array', 'map_key'):
+            field = DWR_FIELDS.get(prefix[len('ResultList.item.'):])
+            if field:
+                columns[field][-1] = value
+    return columns
+
+def fetch_and_parse_station_data(url, data_source='DWR'):
+    """
+    Stream a DWR station listing and return its stations as column lists (see STATION_COLUMNS).
+    The reply is parsed incrementally and never held in memory whole. USGS stations come from
+    the NWIS site service instead (see fetch_usgs_stations).
+    """
+    parsers = {'DWR': parse_dwr_stream}
+    if data_source not in parsers:
+        logger.error(f"Unsupported data source: {data_source}. Use 'DWR'; USGS stations come from fetch_usgs_stations.")
+        raise ValueError("Unsupported data source. Use 'DWR'.")
+
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        columns = parsers[data_source](ijson.parse(response.raw, use_float=True))
+
+    logger.info(f"Parsed {len(columns['id'])} stations from {data_source}")
+    return columns
 
-    # You can now work with the all_stations list
-    # For example, you can iterate through all stations:
+DWR_STATIONS_URL = "https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations/"
+USGS_SITE_URL = "https://waterservices.usgs.gov/nwis/site/"
+USGS_STATE = "CO"
+# Overlap each incremental window so an edit made during the previous refresh is not missed
+REFRESH_OVERLAP = timedelta(days=1)
+
+def fetch_dwr_stations(modified_since=None):
+    """
+    DWR surface-water stations, only those modified since a datetime when one is given.
+    """
+    params = {'format': 'json'}
+    if modified_since is not None:
+        params['min-modified'] = modified_since.strftime('%m/%d/%Y %H:%M')
+    url = requests.Request('GET', DWR_STATIONS_URL, params=params).prepare().url
+    return fetch_and_parse_station_data(url, 'DWR')
+
+def _as_float(value):
+    return float(value) if value else None
+
+def fetch_usgs_stations(modified_since=None, state=USGS_STATE):
+    """
+    Active USGS discharge sites of a state from the NWIS site service (no readings) as station
+    columns, only those modified since a datetime when one is given.
+    """
+    params = {
+        'format': 'rdb',
+        'stateCd': state,
+        'parameterCd': '00060',
+        'siteStatus': 'active',
+        'siteOutput': 'expanded',
+    }
+    if modified_since is not None:
+        days = max(1, (datetime.now(timezone.utc) - modified_since).days + 1)
+        params['modifiedSince'] = f'P{days}D'
+
+    columns = new_columns()
+    with requests.get(USGS_SITE_URL, params=params, stream=True) as response:
+        if response.status_code == 404:
+            # NWIS answers 404 when no site matches, e.g. nothing modified in the window
+            return columns
+        response.raise_for_status()
+        for row in iter_rdb(response.iter_lines(decode_unicode=True)):
+            _start_row(
+                columns,
+                id=row.get('site_no'),
+                name=row.get('station_nm'),
+                latitude=_as_float(row.get('dec_lat_va')),
+                longitude=_as_float(row.get('dec_long_va')),
+                usgs_site_id=row.get('site_no'),
+                county=row.get('county_cd'),
+                state=row.get('state_cd'),
+                data_source='USGS',
+                measurement_unit='ft3/s',
+            )
+    logger.info(f"Parsed {len(columns['id'])} stations from the USGS site service")
+    return columns
+
+def refresh_catalog(conn, full=False):
+    """
+    Bring the local station catalog up to date. Sources refreshed before only fetch the
+    stations modified since then; full=True (or an empty catalog) downloads everything.
+    """
+    fetchers = {'DWR': fetch_dwr_stations, 'USGS': fetch_usgs_stations}
+    for source, fetch in fetchers.items():
+        last = None if full else station_catalog.last_refresh(conn, source)
+        started = datetime.now(timezone.utc)
+        logger.info(f"Fetching {source} stations" + (f" modified since {last:%Y-%m-%d}" if last else ""))
+        columns = fetch(last - REFRESH_OVERLAP if last else None)
+        written = station_catalog.upsert_stations(conn, source, column_rows(columns))
+        station_catalog.mark_refreshed(conn, source, started)
+        logger.info(f"Stored {written} {source} stations")
+
+def main(db_path=None, full=False, refresh=True):
+    """
+    Refresh the persistent station catalog and return every station as a dict.
+    With refresh=False the catalog is read as is, without touching the network.
+    """
+    conn = station_catalog.connect(db_path)
+    try:
+        if refresh:
+            refresh_catalog(conn, full=full)
+        all_stations = station_catalog.all_stations(conn)
+    finally:
+        conn.close()
+
+    logger.info(f"Total number of stations: {len(all_stations)}")
     for station in all_stations:
         logger.debug(f"Station: {station['name']}, ID: {station['id']}, Lat: {station['latitude']}, Long: {station['longitude']}, Source: {station['data_source']}")
 
     return all_stations
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Refresh the local DWR/USGS station catalog.')
+    parser.add_argument('--full', action='store_true', help='Download the full station lists instead of only modified stations')
+    parser.add_argument('--db', type=str, help='Catalog database path (defaults to the cache directory)')
+    args = parser.parse_args()
+    main(args.db, args.full)
@@ -40,9 +40,16 @@ def normalize_date_to_year_fraction(date_series):
     year_fraction = (day_of_year - 1) / (365 + date_series.dt.is_leap_year.astype(int))
     return year_fraction
 
-def normalize_data(file_path, data):
+def load_data(file_path):
+    # Read combined data written by combine_data: a Parquet file or partitioned directory, or a CSV
+    if file_path.endswith('.csv'):
+        return pd.read_csv(file_path)
+    return pd.read_parquet(file_path)
+
+def normalize_data(data=None, file_path=None):
+    # Normalizes the in-memory combined frame; file_path is only read when no frame is given
     try:
-        data = pd.read_csv(file_path)
+        data = load_data(file_path) if data is None else data.copy()
 
         # Interpolate temperatures first
         data = interpolate_temperatures(data)
@@ -85,9 +92,9 @@ def normalize_data(file_path, data):
 
         return data
     except Exception as e:
-        print(f"Error processing file {file_path}: {e}")
+        print(f"Error normalizing {file_path or 'combined data'}: {e}")
         return None
 
 if __name__ == "__main__":
-    file_path = 'combined_data_all_sites.csv'
-    normalized_data = normalize_data(file_path)
\ No newline at end of file
+    file_path = 'combined_data'
+    normalized_data = normalize_data(file_path=file_path)
\ No newline at end of file
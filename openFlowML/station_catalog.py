@@ -0,0 +1,192 @@
+import logging
+import math
+import os
+import sqlite3
+from datetime import datetime, timezone
+from data.dataUtils.cache import get_cache_dir
+
+'''
+Local SQLite catalog of DWR and USGS stream gauges with an R-tree index on lat/lon.
+
+get_all_stations fills and incrementally refreshes the catalog; everything else (coordinate,
+bounding-box and nearest-station lookups) is answered from the local file without touching
+the network.
+'''
+
+if not logging.getLogger().hasHandlers():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = "stations.sqlite"
+STATION_FIELDS = [
+    "id", "abbreviation", "name", "latitude", "longitude", "usgs_site_id", "county", "state",
+    "division", "water_district", "data_source", "start_date", "end_date", "measurement_unit", "modified",
+]
+EARTH_RADIUS_KM = 6371.0
+
+def get_catalog_path(db_path=None):
+    return db_path or os.path.join(get_cache_dir("stations"), CATALOG_FILE)
+
+def connect(db_path=None):
+    """
+    Open (creating if needed) the catalog database.
+    """
+    conn = sqlite3.connect(get_catalog_path(db_path))
+    conn.row_factory = sqlite3.Row
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS stations (
+            rowid INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            site_key TEXT NOT NULL,
+            {", ".join(f"{field} {'REAL' if field in ('latitude', 'longitude') else 'TEXT'}" for field in STATION_FIELDS)},
+            UNIQUE (source, site_key)
+        );
+        CREATE INDEX IF NOT EXISTS stations_usgs_site_id ON stations (usgs_site_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS stations_rtree USING rtree(rowid, min_lon, max_lon, min_lat, max_lat);
+        CREATE TABLE IF NOT EXISTS refresh_log (source TEXT PRIMARY KEY, refreshed_at TEXT NOT NULL);
+    """)
+    return conn
+
+def site_key(source, station):
+    """
+    Key a station is requested by in site_ids.txt: the abbreviation for DWR, the site number for USGS.
+    """
+    return station.get("abbreviation") if source == "DWR" else station.get("id")
+
+def upsert_stations(conn, source, stations):
+    """
+    Insert or update parsed station dicts and keep the spatial index in step. Returns the number written.
+    """
+    written = 0
+    with conn:
+        for station in stations:
+            key = site_key(source, station)
+            if not key:
+                continue
+            values = [station.get(field) for field in STATION_FIELDS]
+            conn.execute(f"""
+                INSERT INTO stations (source, site_key, {", ".join(STATION_FIELDS)})
+                VALUES (?, ?, {", ".join("?" for _ in STATION_FIELDS)})
+                ON CONFLICT (source, site_key) DO UPDATE SET
+                {", ".join(f"{field} = excluded.{field}" for field in STATION_FIELDS)}
+            """, [source, key] + values)
+            rowid = conn.execute("SELECT rowid FROM stations WHERE source = ? AND site_key = ?", (source, key)).fetchone()[0]
+            conn.execute("DELETE FROM stations_rtree WHERE rowid = ?", (rowid,))
+            lat, lon = _as_float(station.get("latitude")), _as_float(station.get("longitude"))
+            if lat is not None and lon is not None:
+                conn.execute("INSERT INTO stations_rtree VALUES (?, ?, ?, ?, ?)", (rowid, lon, lon, lat, lat))
+            written += 1
+    return written
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def last_refresh(conn, source):
+    row = conn.execute("SELECT refreshed_at FROM refresh_log WHERE source = ?", (source,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def mark_refreshed(conn, source, when=None):
+    when = when or datetime.now(timezone.utc)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO refresh_log VALUES (?, ?)", (source, when.isoformat()))
+
+def _to_dict(row):
+    station = {field: row[field] for field in STATION_FIELDS}
+    station["source"] = row["source"]
+    station["site_key"] = row["site_key"]
+    return station
+
+def all_stations(conn, source=None):
+    query = "SELECT * FROM stations" + (" WHERE source = ?" if source else "") + " ORDER BY source, site_key"
+    return [_to_dict(row) for row in conn.execute(query, (source,) if source else ())]
+
+def get_station(conn, source, key):
+    row = conn.execute("SELECT * FROM stations WHERE source = ? AND site_key = ?", (source, key)).fetchone()
+    return _to_dict(row) if row else None
+
+def get_coordinates(conn, source, key):
+    """
+    {'latitude', 'longitude'} of a station from the catalog, or None.
+    """
+    station = get_station(conn, source, key)
+    if station is None or station["latitude"] is None or station["longitude"] is None:
+        return None
+    return {"latitude": station["latitude"], "longitude": station["longitude"]}
+
+def stations_in_bbox(conn, min_lon, min_lat, max_lon, max_lat, source=None):
+    """
+    Stations inside a lon/lat bounding box, found through the R-tree.
+    """
+    query = """
+        SELECT s.* FROM stations_rtree r JOIN stations s ON s.rowid = r.rowid
+        WHERE r.min_lon >= ? AND r.max_lon <= ? AND r.min_lat >= ? AND r.max_lat <= ?
+    """
+    params = [min_lon, max_lon, min_lat, max_lat]
+    if source:
+        query += " AND s.source = ?"
+        params.append(source)
+    return [_to_dict(row) for row in conn.execute(query, params)]
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def nearest_stations(conn, lat, lon, k=1, source=None, max_radius_deg=10.0):
+    """
+    The k stations closest to a point, searching R-tree boxes of growing size.
+    Each result carries its great-circle 'distance_km'.
+    """
+    radius = 0.1
+    while True:
+        candidates = stations_in_bbox(conn, lon - radius, lat - radius, lon + radius, lat + radius, source=source)
+        # A box of half-width r only guarantees the nearest k when they lie within r of the point
+        for station in candidates:
+            station["distance_km"] = haversine_km(lat, lon, station["latitude"], station["longitude"])
+        candidates.sort(key=lambda station: station["distance_km"])
+        inside = [s for s in candidates if s["distance_km"] <= radius * 111.0 * math.cos(math.radians(min(abs(lat) + radius, 89.0)))]
+        if len(inside) >= k or radius >= max_radius_deg:
+            return (inside if len(inside) >= k else candidates)[:k]
+        radius *= 2
+
+def _split_site(site_id):
+    prefix, _, key = site_id.partition(":")
+    return prefix, key
+
+def resolve_sites(conn, site_ids, prefer="USGS"):
+    """
+    Map requested PREFIX:ID entries to one feed per physical gauge.
+
+    DWR stations cross-linked to a USGS gauge (usgs_site_id) and that gauge are the same river;
+    such a group is fetched once, from the USGS daily-value service by default (one request for
+    the whole record) as long as the gauge is an active discharge site in the catalog, otherwise
+    from DWR. Returns {feed PREFIX:ID: requested PREFIX:ID used as the station label}, in request order.
+    """
+    groups = {}
+    for site_id in site_ids:
+        prefix, key = _split_site(site_id)
+        group = site_id
+        if prefix == "DWR":
+            station = get_station(conn, "DWR", key)
+            if station and station["usgs_site_id"]:
+                group = f"USGS:{station['usgs_site_id']}"
+        groups.setdefault(group, []).append(site_id)
+
+    resolved = {}
+    for group, requested in groups.items():
+        prefix, key = _split_site(group)
+        dwr_requests = [site_id for site_id in requested if site_id.startswith("DWR:")]
+        if prefix != "USGS" or not dwr_requests:
+            feed = requested[0]
+        elif prefer == "USGS" and (group in requested or get_station(conn, "USGS", key)):
+            feed = group
+        else:
+            feed = dwr_requests[0]
+        resolved[feed] = requested[0]
+        if len(requested) > 1 or feed != requested[0]:
+            logger.info(f"{', '.join(requested)} resolved to a single {feed} feed")
+    return resolved
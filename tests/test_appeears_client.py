@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import requests_mock
+from dataUtils.appeears_client import AppEEARSClient, APPEEARS_API, parse_expiration
+
+def expiration_in(delta):
+    return (datetime.now(timezone.utc) + delta).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+@pytest.fixture
+def client():
+    return AppEEARSClient(username="user", password="pass")
+
+def test_parse_expiration():
+    assert parse_expiration("2024-07-30T18:04:12Z") == datetime(2024, 7, 30, 18, 4, 12, tzinfo=timezone.utc)
+    assert parse_expiration("2024-07-30T18:04:12.123Z") == datetime(2024, 7, 30, 18, 4, 12, tzinfo=timezone.utc)
+
+def test_token_is_reused_until_expiration(client):
+    with requests_mock.Mocker() as m:
+        login = m.post(f"{APPEEARS_API}/login", json={"token": "abc", "expiration": expiration_in(timedelta(hours=2))})
+        m.get(f"{APPEEARS_API}/task/1", json={"status": "done"})
+        for _ in range(3):
+            client.get("task/1")
+        assert login.call_count == 1
+        assert m.last_request.headers["Authorization"] == "Bearer abc"
+
+def test_token_is_refreshed_before_it_expires(client):
+    with requests_mock.Mocker() as m:
+        login = m.post(f"{APPEEARS_API}/login", [
+            {"json": {"token": "old", "expiration": expiration_in(timedelta(minutes=1))}},
+            {"json": {"token": "new", "expiration": expiration_in(timedelta(hours=2))}},
+        ])
+        assert client.token == "old"
+        assert client.token == "new"
+        assert login.call_count == 2
+
+def test_product_metadata_is_fetched_once(client):
+    with requests_mock.Mocker() as m:
+        m.post(f"{APPEEARS_API}/login", json={"token": "abc", "expiration": expiration_in(timedelta(hours=2))})
+        catalog = m.get(f"{APPEEARS_API}/product", json=[{"ProductAndVersion": "SPL3SMP_E.006"}])
+        layers = m.get(f"{APPEEARS_API}/product/SPL3SMP_E.006", json={"Soil_Moisture_Retrieval_Data_AM_soil_moisture": {}})
+        for _ in range(3):
+            client.products()
+            client.product_layers("SPL3SMP_E.006")
+        assert catalog.call_count == 1
+        assert layers.call_count == 1
+
+def test_logout_clears_token(client):
+    with requests_mock.Mocker() as m:
+        m.post(f"{APPEEARS_API}/login", json={"token": "abc", "expiration": expiration_in(timedelta(hours=2))})
+        m.post(f"{APPEEARS_API}/logout", status_code=204)
+        assert client.token == "abc"
+        assert client.logout()
+        assert client._token is None
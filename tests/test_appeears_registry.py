@@ -0,0 +1,44 @@
+import pytest
+from dataUtils.appeears_registry import (task_fingerprint, register_task, mark_task_downloaded,
+                                         get_registered_task, get_downloaded_bundle, forget_task)
+
+@pytest.fixture
+def params():
+    return {
+        "dates": [{"startDate": "01-01-2020", "endDate": "12-31-2020"}],
+        "layers": [{"product": "SPL3SMP_E.006", "layer": "Soil_Moisture_Retrieval_Data_AM_soil_moisture"}],
+        "output": {"format": {"type": "geotiff"}, "projection": "geographic"},
+        "geo": {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [[[-105.0, 39.5], [-104.5, 39.5], [-104.5, 40.0], [-105.0, 39.5]]]}}
+        ]},
+    }
+
+def test_fingerprint_ignores_formatting(params):
+    echoed = {
+        "geo": params["geo"],
+        "output": {"projection": "geographic", "format": {"type": "geotiff"}},
+        "layers": params["layers"],
+        "dates": [{"startDate": "2020-01-01", "endDate": "2020-12-31"}],
+    }
+    assert task_fingerprint("area", params) == task_fingerprint("area", echoed)
+
+def test_fingerprint_changes_with_request(params):
+    other = dict(params, dates=[{"startDate": "01-01-2021", "endDate": "12-31-2021"}])
+    assert task_fingerprint("area", params) != task_fingerprint("area", other)
+    assert task_fingerprint("area", params) != task_fingerprint("point", params)
+
+def test_registry_tracks_downloaded_bundle(params, tmp_path):
+    cache_dir = str(tmp_path)
+    fingerprint = task_fingerprint("area", params)
+    register_task(fingerprint, "task-1", cache_dir=cache_dir)
+    assert get_registered_task(fingerprint, cache_dir=cache_dir)["task_id"] == "task-1"
+    assert get_downloaded_bundle("task-1", cache_dir=cache_dir) is None
+
+    bundle_dir = tmp_path / "bundle"
+    bundle_dir.mkdir()
+    (bundle_dir / "SPL3SMP_E.006_doy2020001.tif").write_bytes(b"tif")
+    mark_task_downloaded("task-1", str(bundle_dir), cache_dir=cache_dir)
+    assert get_downloaded_bundle("task-1", cache_dir=cache_dir) == str(bundle_dir)
+
+    forget_task(fingerprint, cache_dir=cache_dir)
+    assert get_registered_task(fingerprint, cache_dir=cache_dir) is None
@@ -0,0 +1,116 @@
+import datetime
+import threading
+import time
+import pytest
+import requests
+import appeears
+
+class StubResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+class StubClient:
+    """
+    Serves scripted task/<id> replies; an Exception in the script is raised instead of returned.
+    """
+
+    def __init__(self, scripts):
+        self.scripts = {task_id: list(replies) for task_id, replies in scripts.items()}
+        self.polls = {task_id: [] for task_id in scripts}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        task_id = path.split("/")[-1]
+        with self.lock:
+            self.polls[task_id].append(time.monotonic())
+            reply = self.scripts[task_id].pop(0) if len(self.scripts[task_id]) > 1 else self.scripts[task_id][0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+def status(value):
+    return StubResponse(200, {"status": value})
+
+@pytest.fixture
+def scheduler(monkeypatch, tmp_path):
+    downloads = {}
+
+    def submit(client, polygon, start_date, end_date):
+        return polygon
+
+    def download(client, task_id, output_dir):
+        started = time.monotonic()
+        time.sleep(0.6 if task_id == "slow" else 0.0)
+        downloads[task_id] = (started, time.monotonic())
+        return True
+
+    monkeypatch.setattr(appeears, "submit_appears_task", submit)
+    monkeypatch.setattr(appeears, "get_downloaded_bundle", lambda task_id: None)
+    monkeypatch.setattr(appeears, "download_task_results", download)
+
+    def run(client, sites, **kwargs):
+        day = datetime.date(2020, 1, 1)
+        return appeears.run_appeears_tasks(client, sites, day, day, str(tmp_path), chunk_days=1, **kwargs)
+    return run, downloads
+
+def test_transient_errors_are_retried_and_polls_do_not_wait_for_downloads(scheduler):
+    run, downloads = scheduler
+    client = StubClient({
+        "slow": [status("done")],
+        "flaky": [requests.ConnectionError("reset"), StubResponse(500), status("processing"),
+                  status("processing"), status("done")],
+    })
+
+    results = run(client, {"a": "slow", "b": "flaky"}, max_downloads=1,
+                  initial_poll=0.05, max_poll=0.1, max_wait=5)
+
+    day = datetime.date(2020, 1, 1)
+    assert results[("a", day, day)] and results[("b", day, day)]
+    # The flaky task kept being polled while the only download slot was busy with the slow bundle
+    slow_start, slow_end = downloads["slow"]
+    assert sum(slow_start < t < slow_end for t in client.polls["flaky"]) >= 3
+    assert len(client.polls["flaky"]) == 5
+
+def test_backoff_schedule(scheduler):
+    run, _ = scheduler
+    client = StubClient({"queued": [status("queued")] * 5 + [status("done")]})
+
+    run(client, {"a": "queued"}, initial_poll=0.05, max_poll=0.12, max_wait=5)
+
+    gaps = [b - a for a, b in zip(client.polls["queued"], client.polls["queued"][1:])]
+    expected = [0.05, 0.075, 0.1125, 0.12, 0.12]
+    assert len(gaps) == len(expected)
+    for gap, want in zip(gaps, expected):
+        assert want - 0.01 <= gap <= want + 0.05
+
+@pytest.mark.parametrize("final", ["error", "expired", "deleted"])
+def test_unusable_status_is_terminal(scheduler, monkeypatch, tmp_path, final):
+    monkeypatch.setenv("OPENFLOW_CACHE_DIR", str(tmp_path))
+    appeears.register_task("f" * 64, "broken")
+    run, downloads = scheduler
+    client = StubClient({"broken": [status(final)]})
+    results = run(client, {"a": "broken"}, initial_poll=0.01, max_wait=5)
+    assert list(results.values()) == [None] and not downloads
+    assert len(client.polls["broken"]) == 1
+    # Dropped from the registry so the next run submits a fresh task
+    assert appeears.get_registered_task("f" * 64) is None
+
+@pytest.mark.parametrize("reply, kept", [
+    (requests.ConnectionError("reset"), True),
+    (StubResponse(503), True),
+    (status("processing"), True),
+    (status("expired"), False),
+    (status("error"), False),
+])
+def test_registry_entry_survives_transient_errors(monkeypatch, tmp_path, reply, kept):
+    monkeypatch.setenv("OPENFLOW_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(appeears, "get_user_tasks", lambda client: [])
+    appeears.register_task("f" * 64, "registered")
+    client = StubClient({"registered": [reply]})
+
+    assert appeears.find_existing_task(client, "f" * 64) == ("registered" if kept else None)
+    assert (appeears.get_registered_task("f" * 64) is not None) == kept
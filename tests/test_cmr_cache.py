@@ -0,0 +1,62 @@
+from datetime import date
+import pytest
+import dataUtils.cmr_cache as cmr_cache
+
+def make_granule(day):
+    return {
+        "meta": {"concept-id": f"G-{day}"},
+        "umm": {"GranuleUR": f"SMAP_{day:%Y%m%d}", "TemporalExtent": {"RangeDateTime": {"BeginningDateTime": f"{day:%Y-%m-%d}T00:00:00Z"}}},
+    }
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    calls = []
+
+    def _search_month(concept_id, bbox, month_start, month_end):
+        calls.append(month_start)
+        return [make_granule(month_start.replace(day=d)) for d in (1, 15, 28)]
+
+    monkeypatch.setattr(cmr_cache, "_search_month", _search_month)
+    return calls
+
+def test_month_ranges():
+    months = list(cmr_cache.month_ranges(date(2020, 1, 20), date(2020, 3, 2)))
+    assert months == [
+        (date(2020, 1, 1), date(2020, 1, 31)),
+        (date(2020, 2, 1), date(2020, 2, 29)),
+        (date(2020, 3, 1), date(2020, 3, 31)),
+    ]
+
+def test_closed_months_are_not_searched_again(tmp_path, fake_search):
+    bbox = (-105.0, 39.5, -104.5, 40.0)
+    today = date(2020, 3, 5)
+    first = cmr_cache.search_granules("C1", date(2020, 1, 10), date(2020, 3, 1), bbox, cache_dir=str(tmp_path), today=today)
+    assert len(fake_search) == 3
+    # Results are clipped to the requested days
+    assert [g["umm"]["GranuleUR"] for g in first] == ["SMAP_20200115", "SMAP_20200128", "SMAP_20200201", "SMAP_20200215", "SMAP_20200228", "SMAP_20200301"]
+
+    second = cmr_cache.search_granules("C1", date(2020, 1, 10), date(2020, 3, 1), bbox, cache_dir=str(tmp_path), today=today)
+    # January is final; February is still within the processing lag, March is current
+    assert fake_search[3:] == [date(2020, 2, 1), date(2020, 3, 1)]
+    assert [g["umm"]["GranuleUR"] for g in second] == [g["umm"]["GranuleUR"] for g in first]
+
+def test_concept_id_is_cached(tmp_path, monkeypatch):
+    lookups = []
+
+    class FakeCollection:
+        def concept_id(self):
+            return "C2021957295-NSIDC_CPRD"
+
+    class FakeQuery:
+        def short_name(self, name):
+            lookups.append(name)
+            return self
+        def version(self, version):
+            return self
+        def get(self):
+            return [FakeCollection()]
+
+    monkeypatch.setattr(cmr_cache.earthaccess, "DataCollections", FakeQuery)
+    for _ in range(2):
+        assert cmr_cache.get_collection_concept_id("SPL3SMP_E", "006", cache_dir=str(tmp_path)) == "C2021957295-NSIDC_CPRD"
+    assert lookups == ["SPL3SMP_E"]
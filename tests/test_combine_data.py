@@ -0,0 +1,130 @@
+import importlib
+import sys
+import time
+import types
+import pandas as pd
+import pytest
+import requests_mock
+import basin_features
+import get_ssurgo
+from test_ssurgo import POLYGON, sda_response
+
+SITES = ["USGS:09163500", "DWR:PLAKERCO", "USGS:07094500", "DWR:NODATA", "USGS:06754000"]
+# Earlier sites answer more slowly, so concurrent builds finish in the reverse of site_ids.txt order
+FLOW_DELAYS = {site.split(":")[1]: 0.05 * (len(SITES) - i) for i, site in enumerate(SITES)}
+
+@pytest.fixture
+def combine_module(monkeypatch):
+    # MLutils is not shipped with the repository; only preview_data is used
+    ml_utils = types.ModuleType("MLutils.ml_utils")
+    ml_utils.preview_data = lambda data: None
+    mlutils = types.ModuleType("MLutils")
+    mlutils.ml_utils = ml_utils
+    monkeypatch.setitem(sys.modules, "MLutils", mlutils)
+    monkeypatch.setitem(sys.modules, "MLutils.ml_utils", ml_utils)
+    return importlib.import_module("combine_data")
+
+@pytest.fixture
+def combine_data(combine_module, monkeypatch):
+    module = combine_module
+
+    def flow(site, start_date, end_date):
+        time.sleep(FLOW_DELAYS[site])
+        dates = pd.date_range("2020-01-01", periods=3)
+        return pd.DataFrame({"Date": dates.strftime("%Y-%m-%d"), "Min Flow": [1.0, 2.0, 3.0], "Max Flow": [2.0, 3.0, 4.0]})
+
+    def noaa(latitude, longitude, start_date, end_date):
+        if latitude is None:
+            return None, pd.DataFrame()
+        dates = pd.date_range("2020-01-01", periods=3)
+        return "GHCND:X", pd.DataFrame({"Date": dates.strftime("%Y-%m-%d"), "TMAX": [10, 11, 12], "TMIN": [0, 1, 2]})
+
+    monkeypatch.setattr(module, "get_site_ids", lambda filename=None: SITES)
+    monkeypatch.setattr(module.basin_features, "load_site_hucs", lambda: {})
+    monkeypatch.setattr(module.basin_features, "load_static_features", lambda: {})
+    monkeypatch.setattr(module.station_catalog, "connect", lambda: types.SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(module.station_catalog, "resolve_sites", lambda conn, site_ids: {s: s for s in site_ids})
+    monkeypatch.setattr(module.get_coordinates, "resolve_coordinates", lambda feeds: {
+        feed: {"latitude": None if feed == "DWR:NODATA" else 40.0, "longitude": -105.0} for feed in feeds})
+    monkeypatch.setattr(module.get_flow, "main", flow)
+    monkeypatch.setattr(module.get_CODWR_flow, "main", flow)
+    monkeypatch.setattr(module.get_noaa, "main", noaa)
+    monkeypatch.setattr(module, "save_combined_data", lambda all_data, base_path, write_csv=False: pd.concat(list(all_data.values()), ignore_index=True))
+    return module
+
+def test_parallel_build_matches_serial(combine_data):
+    serial = combine_data.main(max_workers=1)
+    parallel = combine_data.main(max_workers=4)
+
+    # The site without NOAA data is skipped, the rest keep site_ids.txt order
+    assert serial["stationID"].unique().tolist() == [s for s in SITES if s != "DWR:NODATA"]
+    pd.testing.assert_frame_equal(serial, parallel)
+
+def test_site_without_weather_is_skipped_cleanly(combine_data):
+    noaa = combine_data.fetch_and_process_data("DWR", "NODATA", None, None, pd.DataFrame({"Date": ["2020-01-01"]}),
+                                               {"latitude": None, "longitude": -105.0})
+    assert isinstance(noaa, pd.DataFrame) and noaa.empty
+    assert combine_data.build_site_data("DWR:NODATA", "DWR:NODATA", None, None,
+                                        {"latitude": None, "longitude": -105.0}, None, {}) is None
+
+def test_ssurgo_features_joined_after_all_sites_run(combine_data, tmp_path, monkeypatch):
+    # Read the real caches that get_ssurgo --all-sites writes, not the fixture's empty ones
+    monkeypatch.setenv("OPENFLOW_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(combine_data.basin_features, "load_site_hucs", basin_features.load_site_hucs)
+    monkeypatch.setattr(combine_data.basin_features, "load_static_features", basin_features.load_static_features)
+    monkeypatch.setattr(get_ssurgo, "get_site_ids", lambda filename=None: SITES)
+    monkeypatch.setattr(get_ssurgo, "get_site_basins", lambda site_ids: (
+        {"10190002": POLYGON}, {"USGS:09163500": "10190002", "DWR:PLAKERCO": "10190002"}))
+    with requests_mock.Mocker() as m:
+        m.post(get_ssurgo.SDA_URL, json=sda_response)
+        get_ssurgo.main_all_sites()
+
+    combined = combine_data.main()
+    with_features = combined[combined["stationID"].isin(["USGS:09163500", "DWR:PLAKERCO"])]
+    assert set(combine_data.basin_features.STATIC_FEATURE_COLUMNS) <= set(combined.columns)
+    assert with_features["AWS 0-100cm (cm)"].tolist() == pytest.approx([12.5] * len(with_features))
+    assert with_features["HSG B"].tolist() == pytest.approx([0.75] * len(with_features))
+    assert combined.loc[combined["stationID"] == "USGS:07094500", "AWS 0-100cm (cm)"].isna().all()
+
+def site_frame(station_id, flows):
+    dates = pd.date_range("2020-01-01", periods=len(flows))
+    return pd.DataFrame({
+        "Date": dates.strftime("%Y-%m-%d"), "stationID": station_id,
+        "TMAX": [10.0, 11.0, 12.0][:len(flows)], "TMIN": [0.0, 1.0, 2.0][:len(flows)],
+        # Flow values arrive as text, with a blank for a missing reading
+        "Min Flow": flows, "Max Flow": [str(float(f or 0) + 1) for f in flows],
+    })
+
+def test_save_writes_partitioned_parquet(combine_module, tmp_path, monkeypatch):
+    import normalize_data
+    (tmp_path / "openFlowML" / "combined_data" / "stationID=STALE").mkdir(parents=True)
+    seen = []
+    real_normalize = normalize_data.normalize_data
+
+    def recording_normalize(data=None, file_path=None):
+        seen.append((data, file_path))
+        return real_normalize(data=data, file_path=file_path)
+
+    monkeypatch.setattr(combine_module.normalize_data, "normalize_data", recording_normalize)
+    all_data = {"USGS:09163500": site_frame("USGS:09163500", ["1.5", "", "2.5"]),
+                "DWR:PLAKERCO": site_frame("DWR:PLAKERCO", ["3", "4", "5"])}
+    normalized = combine_module.save_combined_data(all_data, str(tmp_path))
+
+    output = tmp_path / "openFlowML" / "combined_data"
+    assert sorted(p.name for p in output.iterdir()) == ["stationID=DWR%3APLAKERCO", "stationID=USGS%3A09163500"]
+    combined = normalize_data.load_data(str(output))
+    assert len(combined) == 6
+    assert pd.api.types.is_datetime64_any_dtype(combined["Date"])
+    assert pd.api.types.is_float_dtype(combined["Min Flow"]) and combined["Min Flow"].isna().sum() == 1
+    assert pd.api.types.is_float_dtype(combined["Max Flow"])
+
+    # Normalization is handed the concatenated frame, not a path to re-read
+    assert len(seen) == 1 and seen[0][1] is None and len(seen[0][0]) == 6
+    assert normalized is not None and (tmp_path / "openFlowML" / "normalized_data.parquet").exists()
+    assert not list(tmp_path.rglob("*.csv"))
+
+def test_save_writes_csv_on_request(combine_module, tmp_path):
+    all_data = {"DWR:PLAKERCO": site_frame("DWR:PLAKERCO", ["3", "4", "5"])}
+    combine_module.save_combined_data(all_data, str(tmp_path), write_csv=True)
+    assert sorted(p.name for p in (tmp_path / "openFlowML").glob("*.csv")) == [
+        "combined_data_all_sites.csv", "normalized_data.csv"]
@@ -1,6 +1,8 @@
 import pytest
 import requests_mock
-from data.utils.get_coordinates import get_usgs_coordinates, get_dwr_coordinates, main
+from dataUtils.get_coordinates import (DWR_STATIONS_URL, USGS_SITE_URL, MISS_TTL, get_usgs_coordinates,
+                                      get_dwr_coordinates, load_cached_misses, main, resolve_coordinates,
+                                      save_cached_misses)
 
 @pytest.fixture
 def mock_requests():
@@ -13,18 +15,14 @@ def usgs_mock_response():
 # comment line
 # another comment line
 site_no	station_nm	dec_lat_va	dec_long_va
+5s	15s	16s	16s
 12345678	Test Station	40.123456	-105.654321
 07094500	ARKANSAS RIVER AT PARKDALE, CO	38.4872189	-105.373604
 '''
 
 @pytest.fixture
 def dwr_mock_response():
-    return '''
-# comment line
-# another comment line
-abbrev	latitude	longitude
-TESTABBR	39.987654	-104.123456
-'''
+    return {"PageCount": 1, "ResultList": [{"abbrev": "TESTABBR", "latitude": 39.987654, "longitude": -104.123456}]}
 
 @pytest.fixture
 def mock_sys_argv(monkeypatch):
@@ -33,49 +31,52 @@ def mock_sys_argv(monkeypatch):
     return _mock_argv
 
 def test_get_usgs_coordinates(mock_requests, usgs_mock_response):
-    mock_requests.get('https://waterdata.usgs.gov/nwis/inventory', text=usgs_mock_response)
+    mock_requests.get(USGS_SITE_URL, text=usgs_mock_response)
 
     result = get_usgs_coordinates('12345678')
     expected = {
-        'latitude': '40.123456',
-        'longitude': '-105.654321'
+        'latitude': 40.123456,
+        'longitude': -105.654321
     }
     assert result == expected
+    assert mock_requests.last_request.qs['sites'] == ['12345678']
 
 def test_get_usgs_coordinates_specific_station(mock_requests, usgs_mock_response):
-    mock_requests.get('https://waterdata.usgs.gov/nwis/inventory', text=usgs_mock_response)
+    mock_requests.get(USGS_SITE_URL, text=usgs_mock_response)
 
     result = get_usgs_coordinates('07094500')
     expected = {
-        'latitude': '38.4872189',
-        'longitude': '-105.373604'
+        'latitude': 38.4872189,
+        'longitude': -105.373604
     }
     assert result == expected
 
 def test_get_usgs_coordinates_invalid_station(mock_requests):
-    mock_requests.get('https://waterdata.usgs.gov/nwis/inventory', text='')
+    # NWIS answers 404 when none of the requested sites exist
+    mock_requests.get(USGS_SITE_URL, status_code=404)
 
     result = get_usgs_coordinates('invalid_station')
     assert result is None
 
 def test_get_usgs_coordinates_api_error(mock_requests):
-    mock_requests.get('https://waterdata.usgs.gov/nwis/inventory', status_code=500)
+    mock_requests.get(USGS_SITE_URL, status_code=500)
 
     result = get_usgs_coordinates('12345678')
     assert result is None
 
 def test_get_dwr_coordinates(mock_requests, dwr_mock_response):
-    mock_requests.get('https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations', text=dwr_mock_response)
+    mock_requests.get('https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations', json=dwr_mock_response)
 
     result = get_dwr_coordinates('TESTABBR')
     expected = {
-        'latitude': '39.987654',
-        'longitude': '-104.123456'
+        'latitude': 39.987654,
+        'longitude': -104.123456
     }
     assert result == expected
+    assert mock_requests.last_request.qs['abbrev'] == ['testabbr']
 
 def test_get_dwr_coordinates_invalid_abbrev(mock_requests):
-    mock_requests.get('https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations', text='')
+    mock_requests.get('https://dwr.state.co.us/Rest/GET/api/v2/surfacewater/surfacewaterstations', json={"ResultList": []})
 
     result = get_dwr_coordinates('INVALID')
     assert result is None
@@ -92,7 +93,7 @@ def test_main_usgs(mock_sys_argv, monkeypatch, capsys):
     def mock_get_usgs_coordinates(site_number):
         return {'latitude': '38.4872189', 'longitude': '-105.373604'}
     
-    monkeypatch.setattr('utils.get_coordinates.get_usgs_coordinates', mock_get_usgs_coordinates)
+    monkeypatch.setattr('dataUtils.get_coordinates.get_usgs_coordinates', mock_get_usgs_coordinates)
     
     main()
     
@@ -105,7 +106,7 @@ def test_main_dwr(mock_sys_argv, monkeypatch, capsys):
     def mock_get_dwr_coordinates(abbrev):
         return {'latitude': '39.987654', 'longitude': '-104.123456'}
     
-    monkeypatch.setattr('utils.get_coordinates.get_dwr_coordinates', mock_get_dwr_coordinates)
+    monkeypatch.setattr('dataUtils.get_coordinates.get_dwr_coordinates', mock_get_dwr_coordinates)
     
     main()
     
@@ -128,7 +129,70 @@ def test_main_missing_arguments(mock_sys_argv, capsys):
         main()
     
     captured = capsys.readouterr()
-    assert "error: the following arguments are required: site_type, site_number" in captured.err
+    assert "error: the following arguments are required: site_type, site" in captured.err
+
+def test_resolve_coordinates_batches_and_caches(mock_requests, usgs_mock_response, tmp_path):
+    mock_requests.get(USGS_SITE_URL, text=usgs_mock_response)
+    mock_requests.get(DWR_STATIONS_URL, json={"ResultList": [
+        {"abbrev": "TESTABBR", "latitude": 39.987654, "longitude": -104.123456},
+        {"abbrev": "OTHER", "latitude": 40.0, "longitude": -105.0},
+    ]})
+    site_ids = ["USGS:12345678", "DWR:TESTABBR", "USGS:07094500", "DWR:OTHER", "DWR:MISSING"]
+
+    result = resolve_coordinates(site_ids, cache_dir=str(tmp_path))
+    assert result["USGS:07094500"] == {'latitude': 38.4872189, 'longitude': -105.373604}
+    assert result["DWR:TESTABBR"] == {'latitude': 39.987654, 'longitude': -104.123456}
+    assert "DWR:MISSING" not in result
+    # One request per source for the whole list
+    assert mock_requests.call_count == 2
+    assert mock_requests.request_history[0].qs['sites'] == ['12345678,07094500']
+
+    # Cached sites are answered without a request
+    assert resolve_coordinates(site_ids[:4], cache_dir=str(tmp_path)) == {k: result[k] for k in site_ids[:4]}
+    assert mock_requests.call_count == 2
+
+def test_resolve_coordinates_remembers_misses(mock_requests, tmp_path):
+    mock_requests.get(USGS_SITE_URL, status_code=404)
+    mock_requests.get(DWR_STATIONS_URL, json={"ResultList": []})
+    site_ids = ["USGS:00000000", "DWR:MISSING"]
+
+    assert resolve_coordinates(site_ids, cache_dir=str(tmp_path)) == {}
+    assert mock_requests.call_count == 2
+    # Within the TTL the misses are answered from the cache
+    assert resolve_coordinates(site_ids, cache_dir=str(tmp_path)) == {}
+    assert mock_requests.call_count == 2
+    # Once they expire, or on refresh, they are looked up again
+    misses = load_cached_misses(str(tmp_path))
+    save_cached_misses({site_id: t - MISS_TTL for site_id, t in misses.items()}, str(tmp_path))
+    resolve_coordinates(site_ids, cache_dir=str(tmp_path))
+    assert mock_requests.call_count == 4
+    resolve_coordinates(site_ids, cache_dir=str(tmp_path), refresh=True)
+    assert mock_requests.call_count == 6
+
+def test_resolve_coordinates_ignores_dwr_case(mock_requests, dwr_mock_response, tmp_path):
+    mock_requests.get(DWR_STATIONS_URL, json=dwr_mock_response)
+
+    result = resolve_coordinates(["DWR:TestAbbr"], cache_dir=str(tmp_path))
+    assert result == {"DWR:TestAbbr": {'latitude': 39.987654, 'longitude': -104.123456}}
+    assert resolve_coordinates(["DWR:TESTABBR"], cache_dir=str(tmp_path)) == {"DWR:TESTABBR": result["DWR:TestAbbr"]}
+    assert mock_requests.call_count == 1
+
+def test_site_basins_resolve_coordinates_once(monkeypatch):
+    import dataUtils.get_poly as get_poly
+    calls = []
+
+    def fake_resolve(site_ids):
+        calls.append(list(site_ids))
+        return {"USGS:07094500": {'latitude': 38.49, 'longitude': -105.37}, "DWR:TESTABBR": {'latitude': 38.5, 'longitude': -105.4}}
+
+    square = [(-106.0, 38.0), (-105.0, 38.0), (-105.0, 39.0), (-106.0, 39.0), (-106.0, 38.0)]
+    monkeypatch.setattr(get_poly, "resolve_coordinates", fake_resolve)
+    monkeypatch.setattr(get_poly, "get_huc_polygon", lambda lat, lon, huc_level: (square, "11020001", None))
+
+    basins, site_hucs = get_poly.get_site_basins(["USGS:07094500", "DWR:TESTABBR", "DWR:MISSING"])
+    assert calls == [["USGS:07094500", "DWR:TESTABBR", "DWR:MISSING"]]
+    assert site_hucs == {"USGS:07094500": "11020001", "DWR:TESTABBR": "11020001"}
+    assert list(basins) == ["11020001"]
 
 if __name__ == "__main__":
     pytest.main()
\ No newline at end of file
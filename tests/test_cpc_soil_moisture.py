@@ -0,0 +1,112 @@
+import fsspec
+import numpy as np
+import pandas as pd
+import xarray as xr
+import soilmoisture2
+from soilmoisture2 import file_period, select_files, load_polygon_series, get_soil_moisture_series, missing_spans
+
+POLYGON = [(-120.5, 39.5), (-119.5, 39.5), (-119.5, 40.5), (-120.5, 40.5)]
+
+def write_month(directory, year, month):
+    # Descending latitudes and 0-360 longitudes, like the CPC files; every cell holds the day of month
+    time = pd.date_range(f"{year}-{month:02d}-01", periods=pd.Timestamp(year, month, 1).days_in_month)
+    lat = np.arange(42.0, 37.0, -1.0)
+    lon = np.arange(237.0, 243.0, 1.0)
+    values = np.broadcast_to(time.day.values[:, None, None], (len(time), len(lat), len(lon))).astype("float32")
+    ds = xr.Dataset({"soilw": (("time", "lat", "lon"), values)}, coords={"time": time, "lat": lat, "lon": lon})
+    ds.to_netcdf(directory / f"soilw.{year}{month:02d}.nc", engine="h5netcdf")
+
+def test_file_period():
+    assert file_period("soilw.20220105.nc") == (pd.Timestamp("2022-01-05"), pd.Timestamp("2022-01-05"))
+    assert file_period("soilw.2021-02.nc") == (pd.Timestamp("2021-02-01"), pd.Timestamp("2021-02-28"))
+    assert file_period("/data/1999/soilw.mon.mean.1999.nc") == (pd.Timestamp("1999-01-01"), pd.Timestamp("1999-12-31"))
+    assert file_period("soilw.mon.mean.nc") is None
+
+def test_select_files_by_name(tmp_path):
+    for name in ["soilw.2019.nc", "soilw.202003.nc", "soilw.20200105.nc", "soilw.20200201.nc", "soilw.ltm.nc", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    _, paths = select_files(str(tmp_path), "2020-01-01", "2020-01-31")
+    # Undated files are kept, since their period is unknown
+    assert sorted(p.split("/")[-1] for p in paths) == ["soilw.20200105.nc", "soilw.ltm.nc"]
+
+def test_polygon_series_from_files(tmp_path):
+    write_month(tmp_path, 2020, 1)
+    write_month(tmp_path, 2020, 2)
+    series = load_polygon_series(POLYGON, "2020-01-30", "2020-02-02", source=str(tmp_path))
+    assert series.index.tolist() == list(pd.date_range("2020-01-30", "2020-02-02"))
+    np.testing.assert_allclose(series.values, [30, 31, 1, 2])
+
+def test_remote_file_handles_are_closed(tmp_path, monkeypatch):
+    write_month(tmp_path, 2020, 1)
+    memory = fsspec.filesystem("memory")
+    memory.pipe("/cpc/soilw.202001.nc", (tmp_path / "soilw.202001.nc").read_bytes())
+    opened, closed = [], []
+    real_open = type(memory).open
+
+    def recording_open(self, path, *args, **kwargs):
+        # MemoryFile.close leaves the buffer open, so record the call itself
+        handle = real_open(self, path, *args, **kwargs)
+        real_close = handle.close
+        handle.close = lambda: (closed.append(path), real_close())
+        opened.append(path)
+        return handle
+
+    monkeypatch.setattr(type(memory), "open", recording_open)
+    series = load_polygon_series(POLYGON, "2020-01-02", "2020-01-03", source="memory://cpc/")
+    np.testing.assert_allclose(series.values, [2, 3])
+    assert opened and closed == opened
+
+def test_missing_spans():
+    day = pd.Timestamp
+    daily = pd.DatetimeIndex(list(pd.date_range("2020-01-05", "2020-01-09")) + list(pd.date_range("2020-01-13", "2020-01-20")))
+    assert missing_spans(daily, day("2020-01-01"), day("2020-01-25")) == [
+        (day("2020-01-01"), day("2020-01-04")), (day("2020-01-10"), day("2020-01-12")), (day("2020-01-21"), day("2020-01-25"))]
+    # Gaps outside the requested window are left alone
+    assert missing_spans(daily, day("2020-01-14"), day("2020-01-18")) == []
+    # Monthly files are not mistaken for gaps between month starts
+    monthly = pd.date_range("2020-01-01", "2020-06-01", freq="MS")
+    assert missing_spans(monthly, day("2020-01-01"), day("2020-06-01")) == []
+    assert missing_spans([], day("2020-01-01"), day("2020-01-02")) == [(day("2020-01-01"), day("2020-01-02"))]
+
+def test_cache_loads_only_missing_spans_and_stays_sorted(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_load(polygon, start_date, end_date, **kwargs):
+        calls.append((str(pd.Timestamp(start_date).date()), str(pd.Timestamp(end_date).date())))
+        index = pd.date_range(start_date, end_date)
+        return pd.Series(index.day.values.astype("float64"), index=index, name="soilw")
+
+    monkeypatch.setattr(soilmoisture2, "load_polygon_series", fake_load)
+    cache = str(tmp_path)
+    get_soil_moisture_series(POLYGON, "2020-01-10", "2020-01-20", huc_id="14010001", cache_dir=cache)
+    series = get_soil_moisture_series(POLYGON, "2020-01-01", "2020-01-25", huc_id="14010001", cache_dir=cache)
+
+    assert calls == [("2020-01-10", "2020-01-20"), ("2020-01-01", "2020-01-09"), ("2020-01-21", "2020-01-25")]
+    assert series.index.tolist() == list(pd.date_range("2020-01-01", "2020-01-25"))
+    np.testing.assert_allclose(series.values, np.arange(1, 26))
+    # The prepended days were merged into the store in date order, not appended after it
+    stored = xr.open_zarr(tmp_path / "14010001.zarr").get_index("time")
+    assert stored.is_monotonic_increasing and stored.is_unique and len(stored) == 25
+
+    get_soil_moisture_series(POLYGON, "2020-01-05", "2020-01-15", huc_id="14010001", cache_dir=cache)
+    assert len(calls) == 3
+
+def test_gap_from_failed_fetch_is_refilled(tmp_path, monkeypatch):
+    calls = []
+    failing = {"2020-01-05"}
+
+    def flaky_load(polygon, start_date, end_date, **kwargs):
+        calls.append((str(pd.Timestamp(start_date).date()), str(pd.Timestamp(end_date).date())))
+        index = pd.date_range(start_date, end_date)
+        index = index[~index.strftime("%Y-%m-%d").isin(failing)]
+        return pd.Series(index.day.values.astype("float64"), index=index, name="soilw")
+
+    monkeypatch.setattr(soilmoisture2, "load_polygon_series", flaky_load)
+    cache = str(tmp_path)
+    first = get_soil_moisture_series(POLYGON, "2020-01-01", "2020-01-10", huc_id="14010001", cache_dir=cache)
+    assert pd.Timestamp("2020-01-05") not in first.index
+
+    failing.clear()
+    second = get_soil_moisture_series(POLYGON, "2020-01-01", "2020-01-10", huc_id="14010001", cache_dir=cache)
+    assert calls[1:] == [("2020-01-05", "2020-01-05")]
+    assert second.index.tolist() == list(pd.date_range("2020-01-01", "2020-01-10"))
@@ -0,0 +1,60 @@
+import hashlib
+import pytest
+import requests_mock
+from dataUtils.downloads import download_file
+
+URL = "https://example.com/bundle/file.tif"
+PAYLOAD = bytes(range(256)) * 40
+
+def range_response(request, context):
+    range_header = request.headers.get("Range")
+    if range_header:
+        start = int(range_header.split("=")[1].rstrip("-"))
+        context.status_code = 206
+        return PAYLOAD[start:]
+    context.status_code = 200
+    return PAYLOAD
+
+@pytest.fixture
+def mock_server():
+    with requests_mock.Mocker() as m:
+        m.get(URL, content=range_response)
+        yield m
+
+def test_download_verifies_checksum(tmp_path, mock_server):
+    dest = tmp_path / "file.tif"
+    assert download_file(URL, str(dest), expected_size=len(PAYLOAD), sha256=hashlib.sha256(PAYLOAD).hexdigest(), chunk_size=1000)
+    assert dest.read_bytes() == PAYLOAD
+    assert not (tmp_path / "file.tif.part").exists()
+
+def test_resume_uses_range(tmp_path, mock_server):
+    dest = tmp_path / "file.tif"
+    (tmp_path / "file.tif.part").write_bytes(PAYLOAD[:3000])
+    assert download_file(URL, str(dest), expected_size=len(PAYLOAD))
+    assert mock_server.last_request.headers["Range"] == "bytes=3000-"
+    assert dest.read_bytes() == PAYLOAD
+
+def test_truncated_body_is_resumed(tmp_path):
+    with requests_mock.Mocker() as m:
+        m.get(URL, [{"content": PAYLOAD[:3000]}, {"content": range_response}])
+        dest = tmp_path / "file.tif"
+        assert download_file(URL, str(dest), expected_size=len(PAYLOAD), retry_delay=0)
+        assert m.last_request.headers["Range"] == "bytes=3000-"
+        assert dest.read_bytes() == PAYLOAD
+
+def test_complete_file_is_not_downloaded_again(tmp_path, mock_server):
+    dest = tmp_path / "file.tif"
+    dest.write_bytes(PAYLOAD)
+    assert download_file(URL, str(dest), expected_size=len(PAYLOAD))
+    assert mock_server.call_count == 0
+
+def test_checksum_mismatch_is_discarded(tmp_path, mock_server):
+    dest = tmp_path / "file.tif"
+    assert not download_file(URL, str(dest), sha256="0" * 64)
+    assert not dest.exists() and not (tmp_path / "file.tif.part").exists()
+
+def test_server_error_gives_up(tmp_path):
+    with requests_mock.Mocker() as m:
+        m.get(URL, status_code=500)
+        assert not download_file(URL, str(tmp_path / "file.tif"), max_retries=2, retry_delay=0)
+        assert m.call_count == 2
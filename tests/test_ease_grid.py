@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pytest
+from dataUtils.ease_grid import compute_cell_weights, get_cell_weights, EASE2_ROWS, EASE2_COLS
+from dataUtils.zonal import weighted_mean, read_cell_values, stack_cell_weights, basin_weighted_sums
+
+@pytest.fixture
+def square_polygon():
+    # Roughly half a degree square near Denver
+    return [(-105.0, 39.5), (-104.5, 39.5), (-104.5, 40.0), (-105.0, 40.0), (-105.0, 39.5)]
+
+def test_fractional_weights_cover_polygon(square_polygon):
+    rows, cols, weights = compute_cell_weights(square_polygon, fractional=True)
+    assert len(rows) == len(cols) == len(weights) > 0
+    assert np.all((weights > 0) & (weights <= 1.0001))
+    assert rows.max() < EASE2_ROWS and cols.max() < EASE2_COLS
+    # Interior cells are fully covered, edge cells only partially
+    assert np.isclose(weights.max(), 1.0, atol=1e-4)
+    assert weights.min() < 1.0
+
+def test_center_weights_are_subset(square_polygon):
+    frac = compute_cell_weights(square_polygon, fractional=True)
+    center = compute_cell_weights(square_polygon, fractional=False)
+    frac_cells = set(zip(frac[0].tolist(), frac[1].tolist()))
+    center_cells = set(zip(center[0].tolist(), center[1].tolist()))
+    assert center_cells and center_cells <= frac_cells
+    assert np.all(center[2] == 1.0)
+
+def test_weights_are_cached(square_polygon, tmp_path):
+    first = get_cell_weights(square_polygon, huc_id="10190002", cache_dir=str(tmp_path))
+    cached_files = os.listdir(tmp_path)
+    assert len(cached_files) == 1 and cached_files[0].startswith("10190002_")
+    second = get_cell_weights(square_polygon, huc_id="10190002", cache_dir=str(tmp_path))
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+def test_weighted_mean_ignores_fill():
+    data = np.full((4, 4), -9999.0, dtype=np.float32)
+    data[0, 0] = 0.2
+    data[0, 1] = 0.4
+    cells = (np.array([0, 0, 1]), np.array([0, 1, 1]), np.array([1.0, 0.5, 1.0], dtype=np.float32))
+    mean, count = weighted_mean(data, cells)
+    assert count == 2
+    assert mean == pytest.approx((0.2 * 1.0 + 0.4 * 0.5) / 1.5)
+
+def test_weighted_mean_no_valid_cells():
+    data = np.full((2, 2), -9999.0)
+    mean, count = weighted_mean(data, (np.array([0]), np.array([0]), np.array([1.0])))
+    assert mean is None and count == 0
+
+def test_read_cell_values_matches_full_read():
+    data = np.arange(100, dtype=np.float32).reshape(10, 10)
+    cells = (np.array([2, 3, 5]), np.array([7, 4, 6]), np.ones(3, dtype=np.float32))
+    np.testing.assert_array_equal(read_cell_values(data, cells), data[cells[0], cells[1]])
+
+def test_basin_weighted_sums_match_single_basin_means():
+    data = np.full((5, 5), -9999.0, dtype=np.float32)
+    data[0, :] = [0.1, 0.2, 0.3, 0.4, 0.5]
+    data[2, 2] = 0.9
+    basins = {
+        "a": (np.array([0, 0, 1]), np.array([0, 1, 1]), np.array([1.0, 0.5, 1.0], dtype=np.float32)),
+        "b": (np.array([0, 2]), np.array([4, 2]), np.array([0.25, 1.0], dtype=np.float32)),
+        "empty": (np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=np.float32)),
+    }
+    basin_ids, cells, basin_index = stack_cell_weights(basins)
+    assert basin_ids == ["a", "b"]
+
+    values = read_cell_values(data, cells)
+    sums, weight_totals, counts = basin_weighted_sums(values, cells[2], basin_index, len(basin_ids))
+    for i, basin_id in enumerate(basin_ids):
+        mean, count = weighted_mean(data, basins[basin_id])
+        assert sums[i] / weight_totals[i] == pytest.approx(mean)
+        assert counts[i] == count
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import pytest
+import dataUtils.granule_cache as granule_cache
+from dataUtils.granule_cache import GranuleCache, verify_granule_file
+
+def make_granule(name, payload, with_checksum=True):
+    info = {"Name": name, "SizeInBytes": len(payload)}
+    if with_checksum:
+        info["Checksum"] = {"Value": hashlib.md5(payload).hexdigest(), "Algorithm": "MD5"}
+    return {
+        "meta": {"concept-id": f"G-{name}"},
+        "umm": {"GranuleUR": name, "DataGranule": {"ArchiveAndDistributionInformation": [info]}},
+    }
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    payloads = {}
+    calls = []
+
+    def _download(granules, local_path=None, threads=8):
+        calls.append([g["umm"]["GranuleUR"] for g in granules])
+        paths = []
+        for g in granules:
+            name = g["umm"]["GranuleUR"]
+            path = os.path.join(local_path, name)
+            with open(path, "wb") as f:
+                f.write(payloads[name])
+            paths.append(path)
+        return paths
+
+    monkeypatch.setattr(granule_cache.earthaccess, "download", _download)
+    return payloads, calls
+
+def test_fetch_downloads_once(tmp_path, fake_download):
+    payloads, calls = fake_download
+    payloads["SMAP_L3_SM_P_E_20200101_R1_001.h5"] = b"a" * 100
+    granule = make_granule("SMAP_L3_SM_P_E_20200101_R1_001.h5", payloads["SMAP_L3_SM_P_E_20200101_R1_001.h5"])
+    cache = GranuleCache(cache_dir=str(tmp_path), max_bytes=10_000)
+
+    first = cache.fetch([granule])
+    second = cache.fetch([granule])
+    assert first == second and os.path.exists(first[0])
+    assert first[0].endswith("SMAP_L3_SM_P_E_20200101_R1_001.h5")
+    assert len(calls) == 1
+
+def test_failed_checksum_is_not_cached(tmp_path, fake_download):
+    payloads, _ = fake_download
+    granule = make_granule("bad.h5", b"expected-bytes")
+    payloads["bad.h5"] = b"corrupt-bytes!"
+    cache = GranuleCache(cache_dir=str(tmp_path), max_bytes=10_000)
+
+    assert cache.fetch([granule]) == [None]
+    assert cache.get(granule) is None
+
+def test_lru_eviction_keeps_recent(tmp_path, fake_download):
+    payloads, _ = fake_download
+    granules = []
+    for i in range(3):
+        name = f"g{i}.h5"
+        payloads[name] = bytes([i]) * 400
+        granules.append(make_granule(name, payloads[name], with_checksum=False))
+    cache = GranuleCache(cache_dir=str(tmp_path), max_bytes=1000)
+
+    first, second = cache.fetch(granules[:2])
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    third = cache.fetch([granules[2]])[0]
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second) and os.path.exists(third)
+    assert cache.size_bytes() <= 1000
+
+def test_verify_with_rounded_megabytes(tmp_path):
+    path = tmp_path / "file.h5"
+    path.write_bytes(b"x" * (1024 * 1024))
+    granule = {"umm": {"DataGranule": {"ArchiveAndDistributionInformation": [{"Name": "file.h5", "Size": 1.0, "SizeUnit": "MB"}]}}}
+    assert verify_granule_file(str(path), granule)
+
+def test_budget_holds_within_one_request(tmp_path, fake_download, monkeypatch):
+    payloads, calls = fake_download
+    granules = []
+    for i in range(6):
+        name = f"g{i}.h5"
+        payloads[name] = bytes([i]) * 400
+        granules.append(make_granule(name, payloads[name], with_checksum=False))
+    cache = GranuleCache(cache_dir=str(tmp_path), max_bytes=1000)
+
+    peaks = []
+    download = granule_cache.earthaccess.download
+    def measuring_download(granules, local_path=None, threads=8):
+        paths = download(granules, local_path=local_path, threads=threads)
+        peaks.append(sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(tmp_path) for f in files))
+        return paths
+    monkeypatch.setattr(granule_cache.earthaccess, "download", measuring_download)
+
+    seen = []
+    for batch, paths in cache.fetch_batches(granules):
+        # The batch just yielded is readable until the next one is requested
+        assert all(os.path.exists(p) for p in paths)
+        seen.extend(paths)
+    assert len(calls) == 6 and len(seen) == 6
+    assert max(peaks) <= 1000
+    assert cache.size_bytes() <= 1000
@@ -1,4 +1,5 @@
-from utils.get_poly import get_huc8_polygon, simplify_polygon, main  # type: ignore
+import dataUtils.get_poly as get_poly
+from dataUtils.get_poly import get_huc_polygon, simplify_polygon, main
 import pytest
 import requests_mock
 from shapely.geometry import Polygon
@@ -10,6 +11,7 @@ def mock_response():
     return {
         "features": [
             {
+                "attributes": {"huc8": "10190003"},
                 "geometry": {
                     "rings": [
                         [[0, 0], [1, 0], [1, 1], [0, 1]]
@@ -22,27 +24,30 @@ def mock_response():
 def test_get_huc8_polygon(mock_response):
     with requests_mock.Mocker() as m:
         m.get("https://hydro.nationalmap.gov/arcgis/rest/services/wbd/MapServer/4/query", json=mock_response)
-        polygon = get_huc8_polygon(37.7749, -122.4194)
+        polygon, huc_id, _ = get_huc_polygon(37.7749, -122.4194, 8)
         assert polygon == [[0, 0], [1, 0], [1, 1], [0, 1]]
+        assert huc_id == "10190003"
 
 def test_get_huc8_polygon_error():
     with requests_mock.Mocker() as m:
         m.get("https://hydro.nationalmap.gov/arcgis/rest/services/wbd/MapServer/4/query", status_code=500)
-        polygon = get_huc8_polygon(37.7749, -122.4194)
-        assert polygon is None
+        polygon, huc_id, _ = get_huc_polygon(37.7749, -122.4194, 8)
+        assert polygon is None and huc_id is None
 
 def test_simplify_polygon(mock_response):
     with requests_mock.Mocker() as m:
         m.get("https://hydro.nationalmap.gov/arcgis/rest/services/wbd/MapServer/4/query", json=mock_response)
-        polygon = get_huc8_polygon(37.7749, -122.4194)
+        polygon, _, _ = get_huc_polygon(37.7749, -122.4194, 8)
         simplified = simplify_polygon(polygon)
         assert len(simplified) <= 100
 
-def test_main(mock_response):
+def test_main(mock_response, monkeypatch):
+    # main also draws the polygon over web map tiles; keep the test offline
+    monkeypatch.setattr(get_poly, "visualize_polygon", lambda *args: None)
     with requests_mock.Mocker() as m:
         m.get("https://hydro.nationalmap.gov/arcgis/rest/services/wbd/MapServer/4/query", json=mock_response)
-        simplified_polygon = main(37.7749, -122.4194)
-        assert simplified_polygon == [[0, 0], [1, 0], [1, 1], [0, 1]]
+        simplified_polygon = main(37.7749, -122.4194, 8)
+        assert simplified_polygon == [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
 def calculate_iou(polygon1, polygon2):
     """Calculate the Intersection over Union (IoU) of two polygons."""
     poly1 = Polygon(polygon1)
@@ -96,7 +101,7 @@ def test_simplify_colorado_huc8_polygon(mock_colorado_response):
         lat, lon = 39.7392, -104.9903
 
         # Get the full HUC8 polygon
-        original_polygon = get_huc8_polygon(lat, lon)
+        original_polygon, _, _ = get_huc_polygon(lat, lon, 8)
         assert original_polygon is not None, "Failed to fetch HUC8 polygon"
 
         # Simplify the polygon
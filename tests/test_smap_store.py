@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+import smap_store
+
+def make_series(huc_id, start, days, valid_cells=5):
+    dates = pd.date_range(start, periods=days, freq='D')
+    return pd.DataFrame({
+        'huc_id': huc_id,
+        'Date': dates,
+        'Soil Moisture AM': np.linspace(0.1, 0.2, days),
+        'Soil Moisture PM': np.linspace(0.2, 0.3, days),
+        'Soil Moisture': np.linspace(0.15, 0.25, days),
+        'Valid Cells': valid_cells,
+    })
+
+def test_append_and_read_range(tmp_path):
+    store = str(tmp_path)
+    assert smap_store.append_series(make_series('10190002', '2020-01-01', 10), store_dir=store) == 10
+    assert smap_store.append_series(make_series('14010001', '2020-01-01', 10), store_dir=store) == 10
+
+    frame = smap_store.read_soil_moisture(['10190002'], '2020-01-03', '2020-01-05', store_dir=store)
+    assert frame['huc_id'].unique().tolist() == ['10190002']
+    assert frame['Date'].tolist() == list(pd.date_range('2020-01-03', '2020-01-05'))
+    assert frame['Soil Moisture'].dtype == np.float32
+
+def test_append_skips_stored_days_and_keeps_masked_days(tmp_path):
+    store = str(tmp_path)
+    smap_store.append_series(make_series('10190002', '2020-01-01', 5), store_dir=store)
+    overlap = make_series('10190002', '2020-01-04', 5)
+    masked = overlap['Date'] == '2020-01-08'
+    overlap.loc[masked, 'Valid Cells'] = 0
+    overlap.loc[masked, ['Soil Moisture AM', 'Soil Moisture PM', 'Soil Moisture']] = np.nan
+
+    assert smap_store.append_series(overlap, store_dir=store) == 3
+    assert len(smap_store.stored_dates('10190002', store_dir=store)) == 8
+    frame = smap_store.read_soil_moisture(['10190002'], '2020-01-08', '2020-01-08', store_dir=store)
+    assert frame['Valid Cells'].tolist() == [0] and frame['Soil Moisture'].isna().all()
+
+def test_update_with_no_new_data_does_nothing(tmp_path, monkeypatch):
+    import nasa_moisture
+    monkeypatch.setenv('OPENFLOW_CACHE_DIR', str(tmp_path))
+    calls = []
+
+    def fake_daily(start_date, end_date, auth, basin_polygons, fill_missing_days=True, **kwargs):
+        calls.append((start_date, end_date))
+        series = make_series('10190002', start_date, (end_date - start_date).days + 1)
+        # A frozen-ground day: the granule exists but QA masks every cell
+        frozen = series['Date'] == pd.Timestamp('2020-01-03')
+        series.loc[frozen, 'Valid Cells'] = 0
+        series.loc[frozen, ['Soil Moisture AM', 'Soil Moisture PM', 'Soil Moisture']] = np.nan
+        return series
+
+    monkeypatch.setattr(nasa_moisture, 'get_daily_soil_moisture_multi', fake_daily)
+    basins = {'10190002': [(0, 0), (1, 0), (1, 1)]}
+    assert nasa_moisture.update_soil_moisture_store('2020-01-01', '2020-01-05', None, basins) == 5
+    assert nasa_moisture.update_soil_moisture_store('2020-01-01', '2020-01-05', None, basins) == 0
+    assert len(calls) == 1
+
+    # Extending the range only fetches the new days
+    nasa_moisture.update_soil_moisture_store('2020-01-01', '2020-01-07', None, basins)
+    assert [(str(a), str(b)) for a, b in calls[1:]] == [('2020-01-06', '2020-01-07')]
+
+def test_missing_date_runs():
+    from nasa_moisture import missing_date_runs
+    dates = set(pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-05', '2020-01-07', '2020-01-08']).date)
+    assert [(str(a), str(b)) for a, b in missing_date_runs(dates)] == [
+        ('2020-01-01', '2020-01-02'), ('2020-01-05', '2020-01-05'), ('2020-01-07', '2020-01-08')]
+
+def test_valid_cells_counts_each_cell_once(tmp_path):
+    import h5py
+    from nasa_moisture import extract_basin_soil_moisture, SMAP_RETRIEVALS
+    from dataUtils.zonal import stack_cell_weights
+    am = np.full((4, 4), 0.2, dtype=np.float32)
+    pm = np.full((4, 4), 0.3, dtype=np.float32)
+    pm[1, 1] = -9999.0  # one cell masked in the PM pass only
+    path = str(tmp_path / 'SMAP_L3_SM_P_E_20200101_R18290_001.h5')
+    with h5py.File(path, 'w') as f:
+        for (group, field), data in zip(SMAP_RETRIEVALS.values(), (am, pm)):
+            f.create_dataset(f'{group}/{field}', data=data)
+
+    square = (np.array([0, 0, 1, 1]), np.array([0, 1, 0, 1]), np.ones(4, dtype=np.float32))
+    basin_ids, cells, basin_index = stack_cell_weights({'10190002': square})
+    row, = extract_basin_soil_moisture(path, basin_ids, cells, basin_index)
+
+    # Four cells behind the combined value, not the 4 + 3 valid retrievals
+    assert row['Valid Cells'] == 4
+    assert row['Soil Moisture'] == pytest.approx((4 * 0.2 + 3 * 0.3) / 7)
+
+def test_unreadable_granule_stays_missing(tmp_path, monkeypatch):
+    import nasa_moisture
+    from dataUtils.zonal import stack_cell_weights
+    square = (np.array([0, 0, 1, 1]), np.array([0, 1, 0, 1]), np.ones(4, dtype=np.float32))
+    basin_ids, cells, basin_index = stack_cell_weights({'10190002': square})
+    path = tmp_path / 'SMAP_L3_SM_P_E_20200102_R18290_001.h5'
+    path.write_bytes(b'truncated download')
+    assert nasa_moisture.extract_basin_soil_moisture(str(path), basin_ids, cells, basin_index) == []
+
+    # The day is not written to the store, so the next update asks for it again
+    monkeypatch.setenv('OPENFLOW_CACHE_DIR', str(tmp_path))
+    series = nasa_moisture.build_daily_series([], basin_ids, '2020-01-02', '2020-01-02', fill_missing_days=False)
+    assert smap_store.append_series(series) == 0
+    assert smap_store.stored_dates('10190002') == set()
+
+def test_compact_keeps_rows(tmp_path):
+    store = str(tmp_path)
+    smap_store.append_series(make_series('10190002', '2020-01-01', 3), store_dir=store)
+    smap_store.append_series(make_series('10190002', '2020-01-04', 3), store_dir=store)
+    smap_store.compact('10190002', store_dir=store)
+    assert len(list((tmp_path / 'huc_id=10190002').iterdir())) == 1
+    assert len(smap_store.read_soil_moisture(store_dir=store)) == 6
+
+def test_read_empty_store(tmp_path):
+    assert smap_store.read_soil_moisture(store_dir=str(tmp_path)).empty
@@ -1,86 +1,80 @@
-import pytest
-import requests_mock
-from nasa_moisture import search_smap_data, get_smap_soil_moisture_data, process_smap_data, get_smap_timeseries, main
+import types
+import h5py
+import numpy as np
 import pandas as pd
+import pytest
+import nasa_moisture
+from nasa_moisture import SMAP_RETRIEVALS
 
-@pytest.fixture
-def mock_cmr_response():
-    with requests_mock.Mocker() as m:
-        url = 'https://cmr.earthdata.nasa.gov/search/granules.json'
-        latitude = 45.0
-        longitude = -120.0
-        bounding_box = f"{longitude-0.1},{latitude-0.1},{longitude+0.1},{latitude+0.1}"
-        params = {
-            'short_name': 'SPL2SMP_E',
-            'version': '006',
-            'temporal': '2020-01-01T00:00:00Z,2020-01-31T23:59:59Z',
-            'bounding_box': bounding_box,
-            'page_size': '100',
-            'page_num': '1'
-        }
-        query_string = '&'.join(f'{k}={v}' for k, v in params.items())
-        m.get(f'{url}?{query_string}', json={'feed': {'entry': [{'links': [{'href': 'https://example.com/granule'}]}]}})
-        yield m
+POLYGON = [(-105.0, 39.5), (-104.5, 39.5), (-104.5, 40.0), (-105.0, 40.0), (-105.0, 39.5)]
+# A 2x2 block of EASE-2 cells standing in for the basin's precomputed weights
+CELLS = (np.array([0, 0, 1, 1]), np.array([0, 1, 0, 1]), np.ones(4, dtype=np.float32))
+
+def write_granule(directory, date, am, pm):
+    path = str(directory / f"SMAP_L3_SM_P_E_{date.replace('-', '')}_R18290_001.h5")
+    with h5py.File(path, 'w') as f:
+        for (group, field), value in zip(SMAP_RETRIEVALS.values(), (am, pm)):
+            f.create_dataset(f'{group}/{field}', data=np.full((4, 4), value, dtype=np.float32))
+    return path
+
+class FakeCache:
+    def __init__(self, paths):
+        self.paths = paths
+
+    def fetch_batches(self, granules, threads=4):
+        yield granules, [self.paths[g] for g in granules]
 
 @pytest.fixture
-def mock_granule_response():
-    with requests_mock.Mocker() as m:
-        m.get('https://example.com/granule', json={
-            'Soil_Moisture_Retrieval_Data': {
-                'soil_moisture_option3': 'example_data',
-                'latitude': 45.0,
-                'longitude': -120.0,
-                'tb_time_utc': '2020-01-01T00:00:00Z',
-                'retrieval_qual_flag': 'example_quality_flag'
-            }
-        })
-        yield m
+def smap(monkeypatch):
+    monkeypatch.setattr(nasa_moisture, 'get_cell_weights', lambda polygon, huc_id=None: CELLS)
+
+def test_search_smap_granules(monkeypatch):
+    searched = []
+    monkeypatch.setattr(nasa_moisture, 'get_collection_concept_id', lambda short_name, version: 'C123-NSIDC_ECS')
+    monkeypatch.setattr(nasa_moisture, 'search_granules', lambda concept_id, start, end, bbox: searched.append(bbox) or ['g1', 'g2'])
+    auth = types.SimpleNamespace(authenticated=True)
+    assert nasa_moisture.search_smap_granules('2020-01-01', '2020-01-31', auth, POLYGON) == ['g1', 'g2']
+    assert searched == [(-105.0, 39.5, -104.5, 40.0)]
+
+def test_search_without_collection(monkeypatch):
+    monkeypatch.setattr(nasa_moisture, 'get_collection_concept_id', lambda short_name, version: None)
+    auth = types.SimpleNamespace(authenticated=True)
+    assert nasa_moisture.search_smap_granules('2020-01-01', '2020-01-31', auth, POLYGON) == []
+
+def test_extract_soil_moisture(tmp_path):
+    path = write_granule(tmp_path, '2020-01-01', 0.25, 0.35)
+    average, polygon = nasa_moisture.extract_soil_moisture(path, POLYGON, cells=CELLS)
+    assert average == pytest.approx(0.25)
+    assert polygon.bounds == (-105.0, 39.5, -104.5, 40.0)
+
+def test_daily_series_covers_every_day(tmp_path, smap, monkeypatch):
+    paths = {'g1': write_granule(tmp_path, '2020-01-01', 0.2, 0.4), 'g3': write_granule(tmp_path, '2020-01-03', 0.1, -9999.0)}
+    monkeypatch.setattr(nasa_moisture, 'search_smap_granules', lambda start, end, auth, polygon: list(paths))
+    series = nasa_moisture.get_daily_soil_moisture('2020-01-01', '2020-01-03', None, POLYGON, huc_id='10190002',
+                                                   max_workers=1, cache=FakeCache(paths))
 
-def test_search_smap_data(mock_cmr_response):
-    result = search_smap_data('2020-01-01', '2020-01-31', '-180,-90,180,90', 'bearer_token')
-    assert result == {
-        'feed': {
-            'entry': [
-                {'links': [{'href': 'https://example.com/granule'}]}
-            ]
-        }
-    }
+    assert series['Date'].tolist() == list(pd.date_range('2020-01-01', '2020-01-03'))
+    assert series['Soil Moisture'].tolist()[0] == pytest.approx(0.3)
+    # No granule on the second day, and only the AM pass is valid on the third
+    assert np.isnan(series['Soil Moisture'].iloc[1]) and series['Valid Cells'].tolist() == [4, 0, 4]
+    assert series['Soil Moisture'].iloc[2] == pytest.approx(0.1) and np.isnan(series['Soil Moisture PM'].iloc[2])
 
-def test_get_smap_soil_moisture_data(mock_granule_response):
-    result = get_smap_soil_moisture_data('https://example.com/granule', 'bearer_token')
-    assert result == {
-        'Soil_Moisture_Retrieval_Data': {
-            'soil_moisture_option3': 'example_data',
-            'latitude': 45.0,
-            'longitude': -120.0,
-            'tb_time_utc': '2020-01-01T00:00:00Z',
-            'retrieval_qual_flag': 'example_quality_flag'
-        }
-    }
+def test_main_daily(smap, monkeypatch):
+    monkeypatch.setattr(nasa_moisture, 'load_vars', lambda: None)
+    monkeypatch.setattr(nasa_moisture, 'get_earthdata_auth', lambda: None)
+    monkeypatch.setattr(nasa_moisture, 'get_huc_polygon', lambda lat, lon, huc_level: (POLYGON, '10190002', {}))
+    requested = []
 
-def test_process_smap_data():
-    data = {
-        'Soil_Moisture_Retrieval_Data': {
-            'soil_moisture_option3': 'example_data',
-            'latitude': 45.0,
-            'longitude': -120.0,
-            'tb_time_utc': '2020-01-01T00:00:00Z',
-            'retrieval_qual_flag': 'example_quality_flag'
-        }
-    }
-    result = process_smap_data(data)
-    assert isinstance(result, pd.DataFrame)
-    assert result.shape == (1, 5)
-    assert result.columns.tolist() == ['date', 'latitude', 'longitude', 'soil_moisture', 'quality_flag']
+    def daily(start_date, end_date, auth, polygon, huc_id=None):
+        requested.append(huc_id)
+        return pd.DataFrame({'Date': pd.date_range(start_date, end_date), 'Soil Moisture': 0.2})
 
-def test_get_smap_timeseries(mock_cmr_response, mock_granule_response):
-    result = get_smap_timeseries('bearer_token', '2020-01-01', '2020-01-31', 45.0, -120.0)
-    assert isinstance(result, pd.DataFrame)
-    assert result.shape == (1, 5)
-    assert result.columns.tolist() == ['date', 'latitude', 'longitude', 'soil_moisture', 'quality_flag']
+    monkeypatch.setattr(nasa_moisture, 'get_daily_soil_moisture', daily)
+    series = nasa_moisture.main('2020-01-01', '2020-01-05', 39.7, -104.8, False, daily=True)
+    assert len(series) == 5 and requested == ['10190002']
 
-def test_main(mock_cmr_response, mock_granule_response):
-    result = main('bearer_token', '2020-01-01', '2020-01-31', 45.0, -120.0)
-    assert isinstance(result, pd.DataFrame)
-    assert result.shape == (1, 5)
-    assert result.columns.tolist() == ['date', 'latitude', 'longitude', 'soil_moisture', 'quality_flag']
\ No newline at end of file
+def test_main_without_basin(monkeypatch):
+    monkeypatch.setattr(nasa_moisture, 'load_vars', lambda: None)
+    monkeypatch.setattr(nasa_moisture, 'get_earthdata_auth', lambda: None)
+    monkeypatch.setattr(nasa_moisture, 'get_huc_polygon', lambda lat, lon, huc_level: (None, None, None))
+    assert nasa_moisture.main('2020-01-01', '2020-01-05', 39.7, -104.8, False, daily=True) is None
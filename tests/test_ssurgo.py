@@ -0,0 +1,63 @@
+import json
+import pandas as pd
+import pytest
+import requests_mock
+import get_ssurgo
+from basin_features import load_site_hucs, save_site_hucs
+from get_ssurgo import SDA_URL, aggregate_features, get_ssurgo_features, load_static_features
+
+POLYGON = [(-105.0, 39.5), (-104.5, 39.5), (-104.5, 40.0), (-105.0, 40.0), (-105.0, 39.5)]
+
+AREAS = {"Table": [["mukey", "area_m2"], ["1", "3000000"], ["2", "1000000"]]}
+PROPERTIES = {"Table": [
+    ["mukey", "aws0100wta", "hydgrpdcd", "brockdepmin", "resdept_min"],
+    ["1", "10.0", "B", "150", None],
+    ["2", "20.0", "A/D", None, "50"],
+]}
+
+def sda_response(request, context):
+    query = json.loads(request.body)["query"]
+    return AREAS if "GetClippedMapunits" in query else PROPERTIES
+
+def test_aggregates_are_area_weighted():
+    areas = pd.DataFrame({"mukey": ["1", "2"], "area_m2": [3e6, 1e6]})
+    properties = pd.DataFrame({"mukey": ["1", "2"], "aws0100wta": [10.0, 20.0], "hydgrpdcd": ["B", "A/D"],
+                               "brockdepmin": [150.0, None], "resdept_min": [None, 50.0]})
+    features = aggregate_features(areas, properties)
+    assert features["AWS 0-100cm (cm)"] == pytest.approx(12.5)
+    # Map units without a value do not dilute the average
+    assert features["Depth to Bedrock (cm)"] == pytest.approx(150.0)
+    assert features["Depth to Restrictive Layer (cm)"] == pytest.approx(50.0)
+    assert features["HSG B"] == pytest.approx(0.75) and features["HSG D"] == pytest.approx(0.25)
+    assert features["HSG A"] == 0 and features["Soil Mapped Area (km2)"] == pytest.approx(4.0)
+
+def test_features_are_cached_per_huc(tmp_path):
+    with requests_mock.Mocker() as m:
+        sda = m.post(SDA_URL, json=sda_response)
+        first = get_ssurgo_features("10190002", POLYGON, cache_dir=str(tmp_path))
+        assert sda.call_count == 2
+        second = get_ssurgo_features("10190002", POLYGON, cache_dir=str(tmp_path))
+        assert sda.call_count == 2
+    assert first == second
+    assert load_static_features(str(tmp_path))["10190002"]["AWS 0-100cm (cm)"] == pytest.approx(12.5)
+
+def test_no_map_units(tmp_path):
+    with requests_mock.Mocker() as m:
+        m.post(SDA_URL, json={})
+        assert get_ssurgo_features("10190002", POLYGON, cache_dir=str(tmp_path)) is None
+    assert load_static_features(str(tmp_path)) == {}
+
+def test_site_hucs_round_trip(tmp_path):
+    save_site_hucs({"USGS:09163500": "14010005"}, cache_dir=str(tmp_path))
+    save_site_hucs({"DWR:ARKCANCO": 11020001}, cache_dir=str(tmp_path))
+    assert load_site_hucs(str(tmp_path)) == {"USGS:09163500": "14010005", "DWR:ARKCANCO": "11020001"}
+
+def test_all_sites_records_site_hucs(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_ssurgo, "get_site_ids", lambda filename=None: ["USGS:09163500", "DWR:PLAKERCO"])
+    monkeypatch.setattr(get_ssurgo, "get_site_basins", lambda site_ids: (
+        {"10190002": POLYGON}, {site_id: "10190002" for site_id in site_ids}))
+    with requests_mock.Mocker() as m:
+        m.post(SDA_URL, json=sda_response)
+        features = get_ssurgo.main_all_sites(cache_dir=str(tmp_path))
+    assert set(features) == {"10190002"}
+    assert load_site_hucs(str(tmp_path)) == {"USGS:09163500": "10190002", "DWR:PLAKERCO": "10190002"}
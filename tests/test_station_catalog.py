@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+import pytest
+import requests_mock
+import station_catalog
+from get_all_stations import DWR_STATIONS_URL, USGS_SITE_URL, column_rows, fetch_and_parse_station_data, main
+from dataUtils.rdb import parse_rdb
+
+DWR_RESPONSE = {"ResultList": [
+    {"stationNum": 1, "abbrev": "PLAKERCO", "stationName": "SOUTH PLATTE RIVER AT KERSEY", "latitude": 40.41,
+     "longitude": -104.56, "usgsSiteId": "06754000", "modified": "2024-01-02T00:00:00"},
+    {"stationNum": 2, "abbrev": "CLAFTCCO", "stationName": "CACHE LA POUDRE AT CANYON MOUTH", "latitude": 40.66,
+     "longitude": -105.22, "usgsSiteId": None, "modified": "2024-01-03T00:00:00"},
+]}
+
+USGS_RDB = """# comment
+agency_cd\tsite_no\tstation_nm\tdec_lat_va\tdec_long_va\tstate_cd\tcounty_cd
+5s\t15s\t50s\t16s\t16s\t2s\t3s
+USGS\t06754000\tSOUTH PLATTE RIVER NEAR KERSEY, CO\t40.4122\t-104.5636\t08\t123
+USGS\t07094500\tARKANSAS RIVER AT PARKDALE, CO\t38.4872\t-105.3736\t08\t043
+"""
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "stations.sqlite")
+
+def test_parse_rdb_skips_comments_and_format_line():
+    rows = parse_rdb(USGS_RDB)
+    assert [row["site_no"] for row in rows] == ["06754000", "07094500"]
+    assert rows[1]["dec_lat_va"] == "38.4872"
+
+def test_refresh_then_offline_lookups(db_path):
+    with requests_mock.Mocker() as m:
+        m.get(DWR_STATIONS_URL, json=DWR_RESPONSE)
+        m.get(USGS_SITE_URL, text=USGS_RDB)
+        stations = main(db_path=db_path)
+        assert len(stations) == 4
+        assert "min-modified" not in m.request_history[0].qs
+
+    # Everything below runs against the local file only
+    with requests_mock.Mocker() as m:
+        conn = station_catalog.connect(db_path)
+        assert station_catalog.get_coordinates(conn, "DWR", "PLAKERCO") == {"latitude": 40.41, "longitude": -104.56}
+        assert station_catalog.get_station(conn, "USGS", "07094500")["name"] == "ARKANSAS RIVER AT PARKDALE, CO"
+        in_box = station_catalog.stations_in_bbox(conn, -105.5, 40.0, -104.0, 41.0)
+        assert {s["site_key"] for s in in_box} == {"PLAKERCO", "CLAFTCCO", "06754000"}
+        nearest = station_catalog.nearest_stations(conn, 38.5, -105.4, k=2)
+        assert nearest[0]["site_key"] == "07094500"
+        assert nearest[0]["distance_km"] < nearest[1]["distance_km"]
+        assert station_catalog.nearest_stations(conn, 40.41, -104.56, source="USGS")[0]["site_key"] == "06754000"
+        conn.close()
+        assert not m.called
+
+def test_incremental_refresh_only_requests_modified_stations(db_path):
+    with requests_mock.Mocker() as m:
+        m.get(DWR_STATIONS_URL, json=DWR_RESPONSE)
+        m.get(USGS_SITE_URL, text=USGS_RDB)
+        main(db_path=db_path)
+
+        moved = {"ResultList": [dict(DWR_RESPONSE["ResultList"][0], latitude=40.5)]}
+        m.get(DWR_STATIONS_URL, json=moved)
+        m.get(USGS_SITE_URL, status_code=404)
+        stations = main(db_path=db_path)
+
+        assert "min-modified" in m.request_history[2].qs
+        assert "modifiedsince" in m.request_history[3].qs
+    assert len(stations) == 4
+    conn = station_catalog.connect(db_path)
+    assert station_catalog.get_coordinates(conn, "DWR", "PLAKERCO")["latitude"] == 40.5
+    # The spatial index follows the update
+    assert station_catalog.stations_in_bbox(conn, -104.6, 40.45, -104.5, 40.55)[0]["site_key"] == "PLAKERCO"
+    conn.close()
+
+def test_dwr_stream_fills_column_arrays():
+    with requests_mock.Mocker() as m:
+        m.get(DWR_STATIONS_URL, json=DWR_RESPONSE)
+        dwr = fetch_and_parse_station_data(DWR_STATIONS_URL, "DWR")
+
+    assert dwr["abbreviation"] == ["PLAKERCO", "CLAFTCCO"] and dwr["usgs_site_id"] == ["06754000", None]
+    assert dwr["latitude"] == [40.41, 40.66] and isinstance(dwr["latitude"][0], float)
+    assert next(column_rows(dwr))["name"] == "SOUTH PLATTE RIVER AT KERSEY"
+    with pytest.raises(ValueError):
+        fetch_and_parse_station_data(USGS_SITE_URL, "USGS")
+
+def test_resolve_sites_fetches_cross_linked_gauges_once(db_path):
+    with requests_mock.Mocker() as m:
+        m.get(DWR_STATIONS_URL, json=DWR_RESPONSE)
+        m.get(USGS_SITE_URL, text=USGS_RDB)
+        main(db_path=db_path)
+    conn = station_catalog.connect(db_path)
+
+    requested = ["DWR:PLAKERCO", "USGS:06754000", "DWR:CLAFTCCO", "USGS:07094500"]
+    assert station_catalog.resolve_sites(conn, requested) == {
+        "USGS:06754000": "DWR:PLAKERCO",
+        "DWR:CLAFTCCO": "DWR:CLAFTCCO",
+        "USGS:07094500": "USGS:07094500",
+    }
+    assert station_catalog.resolve_sites(conn, requested, prefer="DWR")["DWR:PLAKERCO"] == "DWR:PLAKERCO"
+    # A cross-linked DWR station alone still goes to the USGS feed when the gauge is catalogued
+    assert station_catalog.resolve_sites(conn, ["DWR:PLAKERCO"]) == {"USGS:06754000": "DWR:PLAKERCO"}
+    conn.close()
+
+def test_script_runs_without_the_data_package(tmp_path):
+    # get_all_stations is run as a script from openFlowML/, where only station_catalog is importable
+    root = os.path.join(os.path.dirname(__file__), "..", "openFlowML")
+    env = {**os.environ, "OPENFLOW_CACHE_DIR": str(tmp_path), "PYTHONPATH": ""}
+    check = "import sys, station_catalog; print(station_catalog.get_catalog_path()); print('dataUtils.data_utils' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", check], cwd=root, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == [str(tmp_path / "stations" / "stations.sqlite"), "False"]
+    script = subprocess.run([sys.executable, "get_all_stations.py", "--help"], cwd=root, env=env, capture_output=True, text=True)
+    assert script.returncode == 0, script.stderr
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+import requests_mock
+from affine import Affine
+from rasterio.io import MemoryFile
+from shapely.geometry import Polygon
+from get_vegdri import summarize_vegdri_tiff, get_vegdri_data, get_vegdri_series, export_size, weekly_dates, composite_dates
+
+@pytest.fixture
+def tiff_bytes():
+    data = np.arange(400, dtype=np.float32).reshape(20, 20)
+    data[2, 2] = -9999
+    with MemoryFile() as memfile:
+        with memfile.open(driver="GTiff", height=20, width=20, count=1, dtype="float32", crs="EPSG:4326",
+                          transform=Affine(0.1, 0, -120, 0, -0.1, 40), nodata=-9999) as dst:
+            dst.write(data, 1)
+        return memfile.read()
+
+@pytest.fixture
+def polygon():
+    return Polygon([(-119.9, 39.9), (-119.58, 39.9), (-119.58, 39.58), (-119.9, 39.58)])
+
+def test_zonal_summary_is_compact(tiff_bytes, polygon):
+    summary = summarize_vegdri_tiff(tiff_bytes, polygon, "2022-07-30")
+    assert summary["date"] == "2022-07-30"
+    # 16 covered pixels, one of them nodata
+    assert summary["count"] == 15
+    assert summary["min"] == 21.0 and summary["max"] == 84.0
+
+def test_per_pixel_output_is_sparse_float32(tiff_bytes, polygon):
+    pixels = summarize_vegdri_tiff(tiff_bytes, polygon, "2022-07-30", per_pixel=True)
+    assert len(pixels) == 15
+    assert (pixels["VegDRI"] != -9999).all()
+    assert all(dtype == np.float32 for dtype in pixels.dtypes)
+    assert pixels["latitude"].between(39.5, 39.9).all() and pixels["longitude"].between(-119.9, -119.5).all()
+
+def test_geometry_outside_export(tiff_bytes):
+    outside = Polygon([(0, 0), (1, 0), (1, 1)])
+    assert summarize_vegdri_tiff(tiff_bytes, outside, "2022-07-30")["count"] == 0
+    assert summarize_vegdri_tiff(tiff_bytes, outside, "2022-07-30", per_pixel=True) is None
+
+SERVER = "https://vegdri.cr.usgs.gov/arcgis/rest/services/VegDRI/VegDRI_Current/ImageServer"
+POLYGON_JSON = '{"type": "Polygon", "coordinates": [[[-119.9, 39.9], [-119.58, 39.9], [-119.58, 39.58], [-119.9, 39.58], [-119.9, 39.9]]]}'
+
+def test_server_statistics_are_used_when_available():
+    with requests_mock.Mocker() as m:
+        m.get(f"{SERVER}/computeStatisticsHistograms", json={"statistics": [{"min": 1, "max": 9, "mean": 4.5, "count": 12}]})
+        export = m.get(f"{SERVER}/exportImage", json={})
+        stats = get_vegdri_data(POLYGON_JSON, "2022-07-30", server_stats=True)
+    assert stats == {"date": "2022-07-30", "mean": 4.5, "min": 1.0, "max": 9.0, "count": 12}
+    assert not export.called
+
+def test_point_uses_get_samples():
+    with requests_mock.Mocker() as m:
+        m.get(f"{SERVER}/getSamples", json={"samples": [{"value": "-1.5"}]})
+        stats = get_vegdri_data('{"type": "Point", "coordinates": [-119.7, 39.7]}', "2022-07-30", server_stats=True)
+    assert stats["mean"] == -1.5 and stats["count"] == 1
+
+def test_falls_back_to_export(tiff_bytes):
+    with requests_mock.Mocker() as m:
+        m.get(f"{SERVER}/computeStatisticsHistograms", json={"error": {"code": 400, "message": "Unable to compute"}})
+        m.get(f"{SERVER}/exportImage", json={"href": "https://vegdri.cr.usgs.gov/export.tif"})
+        m.get("https://vegdri.cr.usgs.gov/export.tif", content=tiff_bytes)
+        stats = get_vegdri_data(POLYGON_JSON, "2022-07-30", server_stats=True)
+    assert stats["count"] == 15
+
+def test_default_is_the_area_weighted_export(tiff_bytes, polygon):
+    with requests_mock.Mocker() as m:
+        server = m.get(f"{SERVER}/computeStatisticsHistograms", json={"statistics": [{"min": 1, "max": 9, "mean": 4.5, "count": 12}]})
+        m.get(f"{SERVER}/exportImage", json={"href": "https://vegdri.cr.usgs.gov/export.tif"})
+        m.get("https://vegdri.cr.usgs.gov/export.tif", content=tiff_bytes)
+        stats = get_vegdri_data(POLYGON_JSON, "2022-07-30")
+    assert not server.called
+    # Same value as reducing the exported image directly
+    assert stats == summarize_vegdri_tiff(tiff_bytes, polygon, "2022-07-30")
+
+def test_invalid_date_is_rejected():
+    assert get_vegdri_data(POLYGON_JSON, "07/30/2022") is None
+
+def test_export_size_follows_native_resolution():
+    # About 1 degree of latitude is ~111 native 1 km pixels
+    width, height = export_size((-120.0, 39.0, -119.0, 40.0))
+    assert height == 112 and 80 < width < 90
+    assert export_size((-130.0, 20.0, -60.0, 55.0)) == (4000, 3897)
+
+def mock_composites(m, dates):
+    m.get(SERVER, json={"timeInfo": {"startTimeField": "AcquisitionDate"}})
+    m.get(f"{SERVER}/query", json={"features": [
+        {"attributes": {"AcquisitionDate": int(pd.Timestamp(d, tz="UTC").timestamp() * 1000)}} for d in dates]})
+
+def test_series_is_fetched_concurrently_and_cached(tmp_path):
+    with requests_mock.Mocker() as m:
+        mock_composites(m, ["2022-07-03", "2022-07-10", "2022-07-17", "2022-07-24", "2022-07-31", "2022-08-07"])
+        stats = m.get(f"{SERVER}/computeStatisticsHistograms", json={"statistics": [{"min": 1, "max": 9, "mean": 4.5, "count": 12}]})
+        series = get_vegdri_series(POLYGON_JSON, "2022-07-05", "2022-07-30", server_stats=True, cache_dir=str(tmp_path))
+        assert series["date"].tolist() == ["2022-07-10", "2022-07-17", "2022-07-24", "2022-07-31"]
+        assert stats.call_count == 4
+        # A different start date lands on the same composites, so only the new one is fetched
+        get_vegdri_series(POLYGON_JSON, "2022-07-06", "2022-08-02", server_stats=True, cache_dir=str(tmp_path))
+        assert stats.call_count == 5
+
+def test_cache_keeps_server_and_export_statistics_apart(tmp_path, tiff_bytes, polygon):
+    with requests_mock.Mocker() as m:
+        mock_composites(m, ["2022-07-10"])
+        m.get(f"{SERVER}/computeStatisticsHistograms", json={"statistics": [{"min": 1, "max": 9, "mean": 4.5, "count": 12}]})
+        export = m.get(f"{SERVER}/exportImage", json={"href": "https://vegdri.cr.usgs.gov/export.tif"})
+        m.get("https://vegdri.cr.usgs.gov/export.tif", content=tiff_bytes)
+        server = get_vegdri_series(POLYGON_JSON, "2022-07-05", "2022-07-10", server_stats=True, cache_dir=str(tmp_path))
+        weighted = get_vegdri_series(POLYGON_JSON, "2022-07-05", "2022-07-10", cache_dir=str(tmp_path))
+        server_again = get_vegdri_series(POLYGON_JSON, "2022-07-05", "2022-07-10", server_stats=True, cache_dir=str(tmp_path))
+    assert server["mean"].tolist() == server_again["mean"].tolist() == [4.5]
+    assert weighted["mean"].tolist() == [summarize_vegdri_tiff(tiff_bytes, polygon, "2022-07-10")["mean"]]
+    assert export.call_count == 1
+
+def test_empty_composites_are_not_cached(tmp_path, tiff_bytes):
+    with MemoryFile() as memfile:
+        with memfile.open(driver="GTiff", height=20, width=20, count=1, dtype="float32", crs="EPSG:4326",
+                          transform=Affine(0.1, 0, -120, 0, -0.1, 40), nodata=-9999) as dst:
+            dst.write(np.full((20, 20), -9999, dtype=np.float32), 1)
+        unpublished = memfile.read()
+
+    def export(request, context):
+        return {"href": f"https://vegdri.cr.usgs.gov/{request.qs['time'][0]}.tif"}
+
+    with requests_mock.Mocker() as m:
+        mock_composites(m, ["2022-07-10", "2022-07-17"])
+        m.get(f"{SERVER}/exportImage", json=export)
+        published = m.get("https://vegdri.cr.usgs.gov/1657411200000.tif", content=tiff_bytes)
+        latest = m.get("https://vegdri.cr.usgs.gov/1658016000000.tif", content=unpublished)
+        first = get_vegdri_series(POLYGON_JSON, "2022-07-05", "2022-07-17", cache_dir=str(tmp_path))
+        assert first["count"].tolist() == [15, 0]
+        assert [p.name.endswith("_2022-07-10.json") for p in tmp_path.iterdir()] == [True]
+
+        # The empty composite is asked for again on the next run, the published one is not
+        get_vegdri_series(POLYGON_JSON, "2022-07-05", "2022-07-17", cache_dir=str(tmp_path))
+    assert published.call_count == 1 and latest.call_count == 2
+
+def test_weekly_calendar_fallback_is_aligned():
+    assert weekly_dates("2022-07-05", "2022-07-30") == ["2022-07-10", "2022-07-17", "2022-07-24", "2022-07-31"]
+    assert weekly_dates("2022-07-07", "2022-07-30") == weekly_dates("2022-07-05", "2022-07-30")
+    with requests_mock.Mocker() as m:
+        m.get(SERVER, status_code=503)
+        assert composite_dates("2022-07-05", "2022-07-30") == weekly_dates("2022-07-05", "2022-07-30")
@@ -0,0 +1,104 @@
+import functools
+import json
+import os
+import pytest
+import requests_mock
+import get_vegdri2
+from get_vegdri2 import SERVICE_URL, search_scenes, bulk_download, load_manifest
+
+ARCHIVES = {"S1": b"a" * 300, "S2": b"b" * 500}
+SCENES = [{"entityId": "S1", "acquisitionDate": "2022-07-03 00:00:00"},
+          {"entityId": "S2", "acquisitionDate": "2022-07-10 00:00:00"}]
+
+def m2m(data):
+    return {"json": {"data": data, "errorCode": None}}
+
+def available(entity_id):
+    return {"entityId": entity_id, "downloadId": int(entity_id[1:]),
+            "url": f"https://dds.cr.usgs.gov/{entity_id}.zip", "filesize": len(ARCHIVES[entity_id])}
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(get_vegdri2, "RETRY_DELAY", 0)
+
+@pytest.fixture
+def m2m_server():
+    with requests_mock.Mocker() as m:
+        for entity_id, payload in ARCHIVES.items():
+            m.get(f"https://dds.cr.usgs.gov/{entity_id}.zip", content=payload)
+        m.post(f"{SERVICE_URL}download-options", **m2m([
+            {"entityId": "S1", "id": "p1", "available": True},
+            {"entityId": "S2", "id": "p2", "available": True}]))
+        m.post(f"{SERVICE_URL}download-request", **m2m({"failed": []}))
+        yield m
+
+def test_search_pages_until_total_hits():
+    with requests_mock.Mocker() as m:
+        search = m.post(f"{SERVICE_URL}scene-search", [
+            m2m({"results": [{"entityId": "S1"}, {"entityId": "S2"}], "nextRecord": 3, "totalHits": 3}),
+            m2m({"results": [{"entityId": "S3"}], "nextRecord": 4, "totalHits": 3}),
+        ])
+        scenes = search_scenes("key", "2022-01-01", "2022-12-31", max_results=None)
+    assert [s["entityId"] for s in scenes] == ["S1", "S2", "S3"]
+    assert [r.json()["startingNumber"] for r in search.request_history] == [1, 3]
+
+def test_bulk_download_waits_for_every_request(tmp_path, m2m_server):
+    # Between polls S2 is briefly listed as neither available nor requested
+    m2m_server.post(f"{SERVICE_URL}download-retrieve", [
+        m2m({"available": [available("S1")], "requested": []}),
+        m2m({"available": [available("S1")], "requested": [{"downloadId": 2}]}),
+        m2m({"available": [available("S1"), available("S2")], "requested": []}),
+    ])
+    paths = bulk_download("key", SCENES, str(tmp_path), poll_interval=0)
+
+    assert sorted(p.split("/")[-1] for p in paths) == ["VEGDRI_2022-07-03.zip", "VEGDRI_2022-07-10.zip"]
+    assert (tmp_path / "VEGDRI_2022-07-10.zip").read_bytes() == ARCHIVES["S2"]
+    assert load_manifest(str(tmp_path))["S1"] == {"filename": "VEGDRI_2022-07-03.zip", "acquisitionDate": "2022-07-03 00:00:00"}
+
+def test_short_archive_is_retried_then_reported(tmp_path, m2m_server):
+    archive = m2m_server.get("https://dds.cr.usgs.gov/S2.zip", content=ARCHIVES["S2"][:100])
+    m2m_server.post(f"{SERVICE_URL}download-retrieve", **m2m({"available": [available("S1"), available("S2")], "requested": []}))
+    with pytest.raises(RuntimeError, match="1 of 2"):
+        bulk_download("key", SCENES, str(tmp_path), poll_interval=0)
+
+    assert archive.call_count == get_vegdri2.DOWNLOAD_ATTEMPTS * get_vegdri2.MAX_RETRIES
+    assert list(load_manifest(str(tmp_path))) == ["S1"]
+    assert not (tmp_path / "VEGDRI_2022-07-10.zip").exists()
+
+def test_main_ingests_finished_archives_then_raises(tmp_path, m2m_server, monkeypatch):
+    ingested = []
+    monkeypatch.setattr(get_vegdri2, "load_vars", lambda: None)
+    monkeypatch.setattr(get_vegdri2, "login", lambda: "key")
+    monkeypatch.setattr(get_vegdri2, "logout", lambda api_key: None)
+    monkeypatch.setattr(get_vegdri2, "search_scenes", lambda api_key, start_date, end_date, max_results: SCENES)
+    monkeypatch.setattr(get_vegdri2, "ingest_directory", lambda output_dir: ingested.append(
+        sorted(f for f in os.listdir(output_dir) if f.endswith(".zip"))))
+    monkeypatch.setattr(get_vegdri2, "bulk_download", functools.partial(bulk_download, poll_interval=0))
+    m2m_server.get("https://dds.cr.usgs.gov/S2.zip", content=ARCHIVES["S2"][:100])
+    m2m_server.post(f"{SERVICE_URL}download-retrieve", **m2m({"available": [available("S1"), available("S2")], "requested": []}))
+    with pytest.raises(RuntimeError, match="1 of 2"):
+        get_vegdri2.main("2022-07-01", "2022-07-31", output_dir=str(tmp_path), ingest=True)
+
+    assert ingested == [["VEGDRI_2022-07-03.zip"]]
+
+def test_interrupted_archive_is_resumed(tmp_path, m2m_server):
+    def rest(request, context):
+        start = int(request.headers["Range"].split("=")[1].rstrip("-"))
+        context.status_code = 206
+        return ARCHIVES["S2"][start:]
+
+    m2m_server.get("https://dds.cr.usgs.gov/S2.zip", [{"content": ARCHIVES["S2"][:100]}, {"content": rest}])
+    m2m_server.post(f"{SERVICE_URL}download-retrieve", **m2m({"available": [available("S1"), available("S2")], "requested": []}))
+    assert len(bulk_download("key", SCENES, str(tmp_path), poll_interval=0)) == 2
+
+    assert (tmp_path / "VEGDRI_2022-07-10.zip").read_bytes() == ARCHIVES["S2"]
+    assert sorted(load_manifest(str(tmp_path))) == ["S1", "S2"]
+
+def test_manifest_skips_downloaded_scenes(tmp_path, m2m_server):
+    m2m_server.post(f"{SERVICE_URL}download-retrieve", **m2m({"available": [available("S1"), available("S2")], "requested": []}))
+    assert len(bulk_download("key", SCENES, str(tmp_path), poll_interval=0)) == 2
+    options = len(m2m_server.request_history)
+
+    assert bulk_download("key", SCENES, str(tmp_path), poll_interval=0) == []
+    assert json.loads((tmp_path / "manifest.json").read_text()).keys() == {"S1", "S2"}
+    assert not any(r.url.endswith("download-options") for r in m2m_server.request_history[options:])
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import rasterio
+from pyproj import Transformer
+from vegdri_cube import write_cog, register_scene, load_index, query_cube, scene_date, CUBE_SHAPE, CUBE_NODATA, CUBE_RESOLUTION, CUBE_ORIGIN_X, CUBE_ORIGIN_Y
+
+@pytest.fixture
+def cube_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENFLOW_CACHE_DIR", str(tmp_path / "cache"))
+    cube = tmp_path / "cube"
+    cube.mkdir()
+    for week, value in enumerate([10.0, 20.0, 30.0]):
+        data = np.full(CUBE_SHAPE, value, dtype=np.float32)
+        data[:, :100] = CUBE_NODATA
+        filename = f"vegdri_2024-01-{1 + 7 * week:02d}.tif"
+        write_cog(data, str(cube / filename))
+        register_scene(f"2024-01-{1 + 7 * week:02d}", filename, str(cube))
+    return str(cube)
+
+@pytest.fixture
+def polygon():
+    # A 10 x 10 km square aligned to the cube grid, in (lon, lat)
+    to_lonlat = Transformer.from_crs("EPSG:5070", "EPSG:4326", always_xy=True)
+    x0, y0 = CUBE_ORIGIN_X + 2000 * CUBE_RESOLUTION, CUBE_ORIGIN_Y - 1500 * CUBE_RESOLUTION
+    corners = [(x0, y0), (x0 + 10000, y0), (x0 + 10000, y0 - 10000), (x0, y0 - 10000), (x0, y0)]
+    return [to_lonlat.transform(x, y) for x, y in corners]
+
+def test_cogs_are_tiled_and_compressed(cube_dir):
+    with rasterio.open(f"{cube_dir}/vegdri_2024-01-01.tif") as src:
+        assert src.profile["tiled"] and src.compression.name.lower() == "deflate"
+        assert src.block_shapes[0] == (512, 512)
+
+def test_index_and_dates(cube_dir):
+    assert sorted(load_index(cube_dir)) == ["2024-01-01", "2024-01-08", "2024-01-15"]
+    assert scene_date("VEGDRI_2024-01-08.zip") == "2024-01-08"
+
+def test_query_reads_date_range(cube_dir, polygon):
+    series = query_cube(polygon, "2024-01-05", "2024-01-31", cube_dir=cube_dir)
+    assert series["date"].tolist() == ["2024-01-08", "2024-01-15"]
+    assert series["mean"].tolist() == pytest.approx([20.0, 30.0])
+    assert (series["count"] >= 100).all()
+
+def test_query_skips_nodata(cube_dir):
+    to_lonlat = Transformer.from_crs("EPSG:5070", "EPSG:4326", always_xy=True)
+    x0, y0 = CUBE_ORIGIN_X + 50 * CUBE_RESOLUTION, CUBE_ORIGIN_Y - 1500 * CUBE_RESOLUTION
+    corners = [(x0, y0), (x0 + 10000, y0), (x0 + 10000, y0 - 10000), (x0, y0 - 10000), (x0, y0)]
+    series = query_cube([to_lonlat.transform(x, y) for x, y in corners], "2024-01-01", "2024-01-01", cube_dir=cube_dir)
+    assert series["count"].iloc[0] == 0
@@ -1,63 +1,65 @@
 import pytest
 import requests_mock
-from data.get_vegdri import get_vegdri_data
+from get_vegdri import get_vegdri_data, VEGDRI_IMAGE_SERVER
 import requests
 import json
-from data.utils.get_poly import simplify_polygon, get_huc8_polygon
+from dataUtils.get_poly import simplify_polygon, get_huc_polygon
+
+EXPORT_URL = f"{VEGDRI_IMAGE_SERVER}/exportImage"
+POINT = '{"type": "Point", "coordinates": [-74.0060, 40.7128]}'
 
 @pytest.fixture
 def mock_response():
+    # The export answers with the URL of the rendered TIFF; these tests stop before decoding it
     with requests_mock.Mocker() as m:
-        m.get('https://vegdri.cr.usgs.gov/api/v1/data', json={'test': 'data'})
+        m.get(EXPORT_URL, json={'href': 'https://vegdri.cr.usgs.gov/export.tif'})
+        m.get('https://vegdri.cr.usgs.gov/export.tif', status_code=404)
         yield m
 
 def test_missing_params():
     assert get_vegdri_data(None, None) is None
 
 def test_api_error(mock_response):
-    mock_response.get('https://vegdri.cr.usgs.gov/api/v1/data', status_code=500)
-    assert get_vegdri_data("40.7128,-74.0060", '2022-07-30') is None
+    mock_response.get(EXPORT_URL, status_code=500)
+    assert get_vegdri_data(POINT, '2022-07-30') is None
 
 def test_json_decode_error(mock_response):
-    mock_response.get('https://vegdri.cr.usgs.gov/api/v1/data', text='Invalid JSON')
-    assert get_vegdri_data("40.7128,-74.0060", '2022-07-30') is None
+    mock_response.get(EXPORT_URL, text='Invalid JSON')
+    assert get_vegdri_data(POINT, '2022-07-30') is None
 
-def test_success(mock_response):
-    assert get_vegdri_data("40.7128,-74.0060", '2022-07-30') == {'test': 'data'}
+def test_export_requested(mock_response):
+    # The TIFF download fails (404), so no statistics, but the export was asked for the date
+    assert get_vegdri_data(POINT, '2022-07-30') is None
+    assert mock_response.request_history[0].qs['time'] == ['1659139200000']
 
 def test_invalid_date_format(mock_response):
-    assert get_vegdri_data("40.7128,-74.0060", '07/30/2022') is None
-
-def test_out_of_range_latitude(mock_response):
-    assert get_vegdri_data("100,-74.0060", '2022-07-30') is None
-
-def test_out_of_range_longitude(mock_response):
-    assert get_vegdri_data("40.7128,200", '2022-07-30') is None
+    assert get_vegdri_data(POINT, '07/30/2022') is None
 
-def test_non_numeric_latitude(mock_response):
-    assert get_vegdri_data('abc,-74.0060', '2022-07-30') is None
+def test_not_geojson(mock_response):
+    assert get_vegdri_data("40.7128,-74.0060", '2022-07-30') is None
 
-def test_non_numeric_longitude(mock_response):
-    assert get_vegdri_data("40.7128,abc", '2022-07-30') is None
+def test_non_numeric_coordinates(mock_response):
+    assert get_vegdri_data('{"type": "Point", "coordinates": ["abc", 40.7]}', '2022-07-30') is None
 
 def test_missing_date(mock_response):
-    assert get_vegdri_data("40.7128,-74.0060", None) is None
+    assert get_vegdri_data(POINT, None) is None
 
-def test_empty_response(mock_response):
-    mock_response.get('https://vegdri.cr.usgs.gov/api/v1/data', text='')
-    assert get_vegdri_data("40.7128,-74.0060", '2022-07-30') is None
+def test_no_image_url(mock_response):
+    mock_response.get(EXPORT_URL, json={})
+    assert get_vegdri_data(POINT, '2022-07-30') is None
 
 def test_connection_error(mock_response):
-    mock_response.get('https://vegdri.cr.usgs.gov/api/v1/data', exc=requests.exceptions.RequestException)
-    assert get_vegdri_data("40.7128,-74.0060", '2022-07-30') is None
+    mock_response.get(EXPORT_URL, exc=requests.exceptions.RequestException)
+    assert get_vegdri_data(POINT, '2022-07-30') is None
 
-def test_polygon_success(mock_response):
-    polygon = '{"type": "Polygon", "coordinates": [[-100, 40], [-100, 45], [-90, 45], [-90, 40], [-100, 40]]}'
-    assert get_vegdri_data(polygon, '2022-07-30') == {'test': 'data'}
+def test_polygon_requests_export(mock_response):
+    polygon = '{"type": "Polygon", "coordinates": [[[-100, 40], [-100, 45], [-90, 45], [-90, 40], [-100, 40]]]}'
+    get_vegdri_data(polygon, '2022-07-30')
+    assert mock_response.request_history[0].qs['bbox'] == ['-100.0,40.0,-90.0,45.0']
 
-def test_invalid_polygon(mock_response):
-    polygon = '{"type": "Point", "coordinates": [40, -100]}'
-    assert get_vegdri_data(polygon, '2022-07-30') is None
+def test_unsupported_geometry(mock_response):
+    line = '{"type": "LineString", "coordinates": [[40, -100], [41, -100]]}'
+    assert get_vegdri_data(line, '2022-07-30') is None
 
 def test_polygon_missing_type(mock_response):
     polygon = '{"coordinates": [[-100, 40], [-100, 45], [-90, 45], [-90, 40], [-100, 40]]}'
@@ -82,21 +84,22 @@ def test_integration(mock_response):
     mock_response.get('https://hydro.nationalmap.gov/arcgis/rest/services/wbd/MapServer/4/query', json={
         "features": [
             {
+                "attributes": {"huc8": "18050004"},
                 "geometry": {
                     "rings": [
-                        [[-122.4194, 37.7749], [-122.4193, 37.7748], [-122.4192, 37.7747]]
+                        [[-122.5, 37.7], [-122.3, 37.7], [-122.3, 37.8], [-122.5, 37.8], [-122.5, 37.7]]
                     ]
                 }
             }
         ]
     })
-    huc8_polygon = get_huc8_polygon(lat, lon)
+    huc8_polygon, huc_id, _ = get_huc_polygon(lat, lon, 8)
     simplified_polygon = simplify_polygon(huc8_polygon)
     geometry = json.dumps({
         "type": "Polygon",
         "coordinates": [simplified_polygon]
     })
     date = "2022-01-01"
-    mock_response.get('https://vegdri.cr.usgs.gov/api/v1/data', json={'data': 'some data'})
-    data = get_vegdri_data(geometry, date)
-    assert data == {'data': 'some data'}
\ No newline at end of file
+    get_vegdri_data(geometry, date)
+    assert huc_id == "18050004"
+    assert any(r.url.startswith(EXPORT_URL) for r in mock_response.request_history)
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from dataUtils.zonal import compute_pixel_weights, get_pixel_weights, zonal_stats, batch_zonal_stats, cells_window, offset_cells, grid_key
+
+# 0.1 degree grid, 20 x 20 pixels, upper-left corner at (-120, 40)
+TRANSFORM = (0.1, 0.0, -120.0, 0.0, -0.1, 40.0)
+SHAPE = (20, 20)
+CRS = "EPSG:4326"
+
+@pytest.fixture
+def square_polygon():
+    # Covers pixel rows 1-3 and cols 1-3 fully, and a fifth of the pixels in row 4 / col 4
+    return [(-119.9, 39.9), (-119.58, 39.9), (-119.58, 39.58), (-119.9, 39.58), (-119.9, 39.9)]
+
+def test_fractional_weights_match_covered_area(square_polygon):
+    rows, cols, weights = compute_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS)
+    assert set(rows.tolist()) == {1, 2, 3, 4} and set(cols.tolist()) == {1, 2, 3, 4}
+    assert weights.sum() == pytest.approx(3.2 * 3.2, rel=1e-4)
+    assert weights[(rows == 4) & (cols == 4)][0] == pytest.approx(0.04, rel=1e-3)
+
+def test_center_weights_are_subset(square_polygon):
+    rows, cols, weights = compute_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS, fractional=False)
+    assert len(rows) == 9 and np.all(weights == 1.0)
+
+def test_point_selects_containing_pixel():
+    rows, cols, weights = compute_pixel_weights(Point(-119.75, 39.25), TRANSFORM, SHAPE, CRS)
+    assert rows.tolist() == [7] and cols.tolist() == [2] and weights.tolist() == [1.0]
+
+def test_polygon_outside_grid_has_no_cells():
+    rows, _, _ = compute_pixel_weights([(0, 0), (1, 0), (1, 1), (0, 0)], TRANSFORM, SHAPE, CRS)
+    assert len(rows) == 0
+
+def test_weights_are_cached_by_grid_and_polygon(square_polygon, tmp_path):
+    first = get_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS, cache_dir=str(tmp_path))
+    cached_files = os.listdir(tmp_path)
+    assert len(cached_files) == 1 and cached_files[0].startswith(grid_key(TRANSFORM, SHAPE, CRS))
+    second = get_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS, cache_dir=str(tmp_path))
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+    # A different grid gets its own entry
+    get_pixel_weights(square_polygon, (0.05, 0.0, -120.0, 0.0, -0.05, 40.0), (40, 40), CRS, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_truncated_cache_file_is_recomputed(square_polygon, tmp_path):
+    expected = get_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS, cache_dir=str(tmp_path))
+    cache_file, = tmp_path.iterdir()
+    cache_file.write_bytes(cache_file.read_bytes()[:20])
+
+    recomputed = get_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS, cache_dir=str(tmp_path))
+    for a, b in zip(expected, recomputed):
+        np.testing.assert_array_equal(a, b)
+    # The broken entry was replaced, and no temp files are left behind
+    assert os.listdir(tmp_path) == [cache_file.name]
+    with np.load(cache_file) as cached:
+        np.testing.assert_array_equal(cached["weights"], expected[2])
+
+def test_windowed_stats_match_full_array(square_polygon):
+    data = np.arange(400, dtype=np.float32).reshape(SHAPE)
+    data[2, 2] = -9999
+    cells = compute_pixel_weights(square_polygon, TRANSFORM, SHAPE, CRS)
+    row_off, col_off, height, width = cells_window(cells)
+    window = data[row_off:row_off + height, col_off:col_off + width]
+    full = zonal_stats(data, cells, fill_value=-9999)
+    windowed = zonal_stats(window, offset_cells(cells, row_off, col_off), fill_value=-9999)
+    assert full == pytest.approx(windowed)
+    assert full["count"] == len(cells[0]) - 1
+
+def test_batch_matches_single_polygon_stats(square_polygon):
+    data = np.random.default_rng(0).random(SHAPE).astype(np.float32)
+    polygons = {
+        "a": square_polygon,
+        "b": [(-118.5, 38.5), (-118.2, 38.5), (-118.2, 38.3), (-118.5, 38.5)],
+        "outside": [(0, 0), (1, 0), (1, 1), (0, 0)],
+    }
+    basin_cells = {k: compute_pixel_weights(p, TRANSFORM, SHAPE, CRS) for k, p in polygons.items()}
+    results = batch_zonal_stats(data, basin_cells)
+    for basin_id, cells in basin_cells.items():
+        if basin_id == "outside":
+            assert results[basin_id]["count"] == 0
+            continue
+        assert results[basin_id] == pytest.approx(zonal_stats(data, cells))